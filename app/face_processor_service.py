@@ -1,3 +1,4 @@
+import cv2
 import numpy as np
 from fastapi import Depends
 
@@ -5,24 +6,48 @@ from containers.face_recognition.actions.process_frame_action import ProcessFram
 from containers.face_recognition.actions.register_face_action import RegisterFaceAction
 from containers.face_recognition.models.face_data import PersonType
 from containers.face_recognition.repositories.face_repository import FaceRepository
+from containers.face_recognition.repositories.person_detection_repository import PersonDetectionRepository
 from containers.face_recognition.repositories.tracking_repository import TrackingRepository
+from containers.face_recognition.tasks.face_detector_task import scale_policy
 from containers.object_detection.repositories.detection_repository import ObjectDetectionRepository
+from containers.object_detection.tasks.object_routing_task import ObjectSnapshot
+from containers.tracking.repositories.track_state_repository import TrackStateRepository
+from face.attribute_scheduler import AttributeScheduler
+from face.face_scale import ScaleTimings
+from ship.core.exceptions import ModelRegistryException
+from ship.core.model_registry import model_registry, DEFAULT_STREAM
+from ship.core.pipeline import Pipeline, Stage
+from ship.setting import settings
+from face.face_roi import PERSON_ROI
 
 
 class FaceProcessorService:
     """Main service class orchestrating face processing"""
 
-    def __init__(self, session, recognition_attempts=3, data_path=None):
+    def __init__(self, session, recognition_attempts=3, data_path=None, stream_id=DEFAULT_STREAM,
+                 min_face_quality=0.0):
         # Initialize dependencies
         self.session = session
+        self.stream_id = stream_id
         self.frame_count = 0
         self.recognition_attempts = recognition_attempts
+        self.min_face_quality = min_face_quality
 
         # Initialize repositories
         self.face_repo = Depends(FaceRepository)
         self.tracking_repo = Depends(TrackingRepository)
         self.detection_repo = Depends(ObjectDetectionRepository)
 
+        # Per-track identity is cached for the lifetime of the stream and written through to person_detections
+        self.track_states = TrackStateRepository(PersonDetectionRepository(session))
+        self._resume_track_ids()
+        self.attribute_scheduler = AttributeScheduler()
+        # Non-person objects are stored when they change, not on every frame
+        self.object_snapshot = ObjectSnapshot()
+        # Face detector scales of this camera and what each of them costs
+        self.face_scale_policy = scale_policy(stream_id)
+        self.face_scale_timings = ScaleTimings(settings.FACE_SCALE_REPORT_EVERY, name=f"faces-{stream_id}")
+
         # Initialize models and dependencies
         self._init_dependencies(data_path)
 
@@ -35,21 +60,18 @@ class FaceProcessorService:
     def _init_dependencies(self, data_path):
         """Initialize all model dependencies"""
 
-        # Initialize models (these would be injected in real implementation)
+        # Models are shared process-wide through the registry, so extra services reuse loaded weights
         try:
-            from face.age_resnet_50 import AgeEstimator
-            from face.gender_detection import GenderEstimator
-            from face.res_emote_net_emotion import EmotionEstimator
             from face.face_pointing import process_image
 
-            self.age_estimator = AgeEstimator()
-            self.gender_estimator = GenderEstimator()
-            self.emotion_estimator = EmotionEstimator()
+            self.age_estimator = model_registry.get('age_estimator')
+            self.gender_estimator = model_registry.get('gender_estimator')
+            self.emotion_estimator = model_registry.get('emotion_estimator')
             self.face_processor = type('FaceProcessor', (), {
                 'detect_faces': lambda self, frame: process_image(frame)
             })()
 
-        except ImportError as e:
+        except (ImportError, ModelRegistryException) as e:
             print(f"Warning: Could not import face analysis models: {e}")
             self.age_estimator = None
             self.gender_estimator = None
@@ -62,10 +84,89 @@ class FaceProcessorService:
             # ... (add all COCO class names)
         ]
 
-    def process_frame(self, frame: np.ndarray) -> bool:
+    def _resume_track_ids(self):
+        """Keep the tracker numbering after the persisted track ids"""
+        last_track_id = self.track_states.last_track_id()
+        if not last_track_id:
+            return
+
+        try:
+            model_registry.get('tracker', stream_id=self.stream_id).resume_ids(last_track_id)
+        except ModelRegistryException as e:
+            print(f"Warning: Could not resume track ids: {e}")
+
+    def process_frame(self, frame: np.ndarray, timestamp=None) -> bool:
         """Process a single frame"""
         self.frame_count += 1
 
+        # Execute main processing action
+        action = self._create_action(timestamp)
+        return action.run(frame, self.frame_count)
+
+    def run_pipeline(self, saved_frames, on_processed=None, decode_workers=2, face_workers=1, queue_size=4) -> int:
+        """
+        Process saved frames with every stage working on a different frame at the same time.
+
+        decode -> detect -> faces -> track -> analyze, connected by bounded
+        queues, so throughput is set by the slowest stage. Frames are numbered,
+        tracked and analyzed in order. Analysis and saving share the last stage
+        because they use the same SQLAlchemy session, which must stay on one
+        thread; `on_processed(saved_frame)` is called there too, in frame order.
+        `face_workers` > 1 needs a face detector that can be called from several threads.
+        With FACE_DETECTION_MODE 'person_roi' faces come after track.
+
+        Returns:
+            Number of frames processed
+        """
+        person_roi = settings.FACE_DETECTION_MODE == PERSON_ROI
+
+        def decode(saved_frame):
+            frame = cv2.imread(saved_frame['frame_path'])
+            if frame is None:
+                return None
+            return {'record': saved_frame, 'frame': frame}
+
+        def detect(job):
+            self.frame_count += 1
+            job['frame_count'] = self.frame_count
+            job['action'] = self._create_action(job['record']['timestamp'])
+            job['detections'], job['objects'] = job['action'].route(job['action'].detect(job['frame']))
+            return job
+
+        def detect_faces(job):
+            if person_roi:
+                job['faces'] = job['action'].detect_faces(job['frame'], job['trackers'], job['frame_count'])
+            else:
+                job['faces'] = job['action'].detect_faces(job['frame'])
+            return job
+
+        def track(job):
+            job['trackers'], job['deleted_track_ids'] = job['action'].track(job['frame'], job['detections'])
+            return job
+
+        def analyze(job):
+            action, frame = job.pop('action'), job.pop('frame')
+            faces, landmarks, quality = job['faces']
+            rows = action.analyze(frame, job['frame_count'], job['trackers'], job['deleted_track_ids'],
+                                  faces, landmarks, quality)
+            action.save(job['frame_count'], job['objects'], rows)
+            if on_processed is not None:
+                on_processed(job['record'])
+            return job
+
+        faces_stage = Stage('faces', detect_faces, workers=face_workers, queue_size=queue_size)
+        track_stage = Stage('track', track, queue_size=queue_size)
+        # Person-ROI face detection needs the tracks of its frame, so it runs after tracking
+        pipeline = Pipeline([
+            Stage('decode', decode, workers=decode_workers, queue_size=queue_size),
+            Stage('detect', detect, queue_size=queue_size),
+            *([track_stage, faces_stage] if person_roi else [faces_stage, track_stage]),
+            Stage('analyze', analyze, queue_size=queue_size)
+        ], name=f"face-processor-{self.stream_id}")
+        return pipeline.run(saved_frames)
+
+    def _create_action(self, timestamp=None) -> ProcessFrameAction:
+        """Processing action for the current frame"""
         # Prepare dependencies for action
         dependencies = {
             'face_repository': self.face_repo,
@@ -77,12 +178,28 @@ class FaceProcessorService:
             'face_processor': self.face_processor,
             'known_faces': self.known_faces,
             'coco_names': self.coco_names,
-            'frame_count': self.frame_count
+            'frame_count': self.frame_count,
+            'stream_id': self.stream_id,
+            'track_states': self.track_states,
+            'attribute_scheduler': self.attribute_scheduler,
+            'object_snapshot': self.object_snapshot,
+            'face_scale_policy': self.face_scale_policy,
+            'face_scale_timings': self.face_scale_timings,
+            'min_face_quality': self.min_face_quality,
+            'timestamp': timestamp
         }
-
-        # Execute main processing action
-        action = ProcessFrameAction(**dependencies)
-        return action.run(frame, self.frame_count)
+        return ProcessFrameAction(**dependencies)
+
+    def warmup(self):
+        """Load every pipeline model up front so the first frame does not pay for it"""
+        model_registry.warmup('rtdetr', 'retinaface', stream_id=self.stream_id)
+
+    def close(self):
+        """Release this stream's tracker, track state, object snapshot and face scale timings"""
+        model_registry.reset_stream(self.stream_id)
+        self.track_states.clear()
+        self.object_snapshot.clear()
+        self.face_scale_timings.clear()
 
     def register_face(self, image_data: np.ndarray, name: str, person_type: str) -> tuple:
         """Register a new face"""
@@ -3,7 +3,6 @@ from app.face_processor_service import FaceProcessorService
 
 def main():
     """Main application entry point"""
-    import cv2
     from app.database import SessionLocal
     from app.repositories import get_repositories
 
@@ -22,23 +21,12 @@ def main():
         video_frame_repo = repos["video_frame"]
         saved_frames = video_frame_repo.get_unprocessed_frames()
 
-        for saved_frame in saved_frames:
-            frame = cv2.imread(saved_frame['frame_path'])
-
-            if frame is None:
-                continue
-
-            # Process frame using service
-            success = service.process_frame(frame)
-
-            if success:
-                # Mark frame as processed
-                video_frame_repo.mark_as_processed(saved_frame['id'])
-
-            # Check for exit condition
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord('q'):
-                break
+        # Decoding, detection, tracking and analysis run concurrently on different frames
+        processed = service.run_pipeline(
+            saved_frames,
+            on_processed=lambda saved_frame: video_frame_repo.mark_as_processed(saved_frame['id'])
+        )
+        print(f"Processed {processed} frames")
 
     finally:
         db.close()
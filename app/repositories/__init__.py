@@ -1,17 +1,21 @@
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 from datetime import datetime
 import numpy as np
-from typing import Dict, List, Optional, Tuple, Union, Any, Type
+from typing import Dict, Iterable, List, Optional, Tuple, Union, Any, Type
 from app import models
 from app.enums import PersonType
 from app.models import PersonDetection, ObjectDetection
+from ship.core.write_behind import SqlAlchemyBatchWriter, WriteBehindQueue
 
 
 class PersonDetectionRepository:
     """Repository for working with PersonDetection model"""
 
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, write_queue: Optional[WriteBehindQueue] = None):
         self.db = db
+        # When set, inserts and updates are deferred to the background writer
+        self.write_queue = write_queue
 
     def get_by_id(self, id: int) -> Optional[models.PersonDetection]:
         """Get a person detection by ID"""
@@ -21,7 +25,7 @@ class PersonDetectionRepository:
         """Get all person detections by track ID"""
         return self.db.query(models.PersonDetection).filter_by(track_id=track_id).all()
 
-    def save_face_data(self, frame_id: int, track_id: int, face_data: Dict[str, Any]) -> models.PersonDetection:
+    def save_face_data(self, frame_id: int, track_id: int, face_data: Dict[str, Any]) -> Optional[models.PersonDetection]:
         """Save face data for a detected person"""
         # Extract and convert data
         name = face_data.get("name", "unknown")
@@ -57,25 +61,30 @@ class PersonDetectionRepository:
         if track_id is not None:
             track_id = int(track_id)
 
+        row = dict(
+            frame_id=frame_id,
+            track_id=track_id,
+            name=name,
+            age=age,
+            gender=gender,
+            emotion=emotion,
+            face_top=top,
+            face_right=right,
+            face_bottom=bottom,
+            face_left=left,
+            body_top=body_top,
+            body_right=body_right,
+            body_bottom=body_bottom,
+            body_left=body_left,
+            person_type=person_type,
+            timestamp=timestamp
+        )
+        if self.write_queue is not None:
+            self.write_queue.insert(models.PersonDetection.__tablename__, row)
+            return None
+
         try:
-            person_detection = models.PersonDetection(
-                frame_id=frame_id,
-                track_id=track_id,
-                name=name,
-                age=age,
-                gender=gender,
-                emotion=emotion,
-                face_top=top,
-                face_right=right,
-                face_bottom=bottom,
-                face_left=left,
-                body_top=body_top,
-                body_right=body_right,
-                body_bottom=body_bottom,
-                body_left=body_left,
-                person_type=person_type,
-                timestamp=timestamp
-            )
+            person_detection = models.PersonDetection(**row)
 
             self.db.add(person_detection)
             self.db.commit()
@@ -92,6 +101,10 @@ class PersonDetectionRepository:
             print("No updates provided.")
             return
 
+        if self.write_queue is not None:
+            self.write_queue.update(models.PersonDetection.__tablename__, "track_id", track_id, updates)
+            return
+
         try:
             persons = self.db.query(models.PersonDetection).filter(models.PersonDetection.track_id == track_id).all()
             for person in persons:
@@ -106,6 +119,28 @@ class PersonDetectionRepository:
             print(f"Error updating fields: {e}")
             raise e
 
+    def load_track_states(self, limit: Optional[int] = 1000) -> List[Dict[str, Any]]:
+        """Latest row of the `limit` most recent tracks, highest track id first"""
+        persons = (
+            self.db.query(models.PersonDetection)
+            .distinct(models.PersonDetection.track_id)
+            .order_by(models.PersonDetection.track_id.desc(), models.PersonDetection.id.desc())
+            .limit(limit)
+            .all()
+        )
+        return [
+            {
+                "track_id": person.track_id,
+                "frame_id": person.frame_id,
+                "name": person.name,
+                "age": person.age,
+                "gender": person.gender,
+                "emotion": person.emotion,
+                "person_type": person.person_type
+            }
+            for person in persons
+        ]
+
     def get_face_data(self, track_id: int) -> Optional[Dict[str, Any]]:
         """Get stored data for a specific track_id"""
         person = (
@@ -183,6 +218,35 @@ class ObjectDetectionRepository:
             self.db.rollback()
             raise e
 
+    def create_many(self, detections: Iterable[Dict[str, Any]]) -> int:
+        """Create object detection records for a whole frame in one INSERT and one commit"""
+        timestamp = datetime.now()
+        rows = [
+            {
+                "frame_id": int(d["frame_id"]),
+                "class_": d["class_name"],
+                "class_id": int(d["class_id"]),
+                "x1": int(d["x1"]) if d.get("x1") is not None else None,
+                "y1": int(d["y1"]) if d.get("y1") is not None else None,
+                "x2": int(d["x2"]) if d.get("x2") is not None else None,
+                "y2": int(d["y2"]) if d.get("y2") is not None else None,
+                "conf": float(d["confidence"]) if d.get("confidence") is not None else None,
+                "timestamp": d.get("timestamp") or timestamp,
+            }
+            for d in detections
+        ]
+        if not rows:
+            return 0
+
+        try:
+            self.db.execute(insert(models.ObjectDetection), rows)
+            self.db.commit()
+            return len(rows)
+
+        except Exception as e:
+            self.db.rollback()
+            raise e
+
     def get_by_frame_id(self, frame_id: int) -> list[Type[ObjectDetection]]:
         """Get all object detections for a specific frame"""
         return self.db.query(models.ObjectDetection).filter_by(frame_id=frame_id).all()
@@ -240,11 +304,13 @@ class RegisteredPersonRepository:
 class PersonTrackingDataRepository:
     """Repository for working with PersonTrackingData model"""
 
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, write_queue: Optional[WriteBehindQueue] = None):
         self.db = db
+        # When set, inserts and updates are deferred to the background writer
+        self.write_queue = write_queue
 
     def save_frame_data(self, frame_id: int, track_id: int, face_data: Dict[str, Any],
-                        visible: bool, person_type: str = PersonType.CUSTOMER.value) -> models.PersonTrackingData:
+                        visible: bool, person_type: str = PersonType.CUSTOMER.value) -> Optional[models.PersonTrackingData]:
         """Save data for each frame to the person_tracking_data table"""
         name = face_data.get("name", "unknown")
 
@@ -278,26 +344,31 @@ class PersonTrackingDataRepository:
         if track_id is not None:
             track_id = int(track_id)
 
+        row = dict(
+            frame_id=frame_id,
+            track_id=track_id,
+            name=name,
+            age=age,
+            gender=gender,
+            emotion=emotion,
+            face_top=top,
+            face_right=right,
+            face_bottom=bottom,
+            face_left=left,
+            body_top=body_top,
+            body_right=body_right,
+            body_bottom=body_bottom,
+            body_left=body_left,
+            is_frontal=visible,
+            person_type=person_type,
+            timestamp=timestamp
+        )
+        if self.write_queue is not None:
+            self.write_queue.insert(models.PersonTrackingData.__tablename__, row)
+            return None
+
         try:
-            tracking_data = models.PersonTrackingData(
-                frame_id=frame_id,
-                track_id=track_id,
-                name=name,
-                age=age,
-                gender=gender,
-                emotion=emotion,
-                face_top=top,
-                face_right=right,
-                face_bottom=bottom,
-                face_left=left,
-                body_top=body_top,
-                body_right=body_right,
-                body_bottom=body_bottom,
-                body_left=body_left,
-                is_frontal=visible,
-                person_type=person_type,
-                timestamp=timestamp
-            )
+            tracking_data = models.PersonTrackingData(**row)
 
             self.db.add(tracking_data)
             self.db.commit()
@@ -372,13 +443,21 @@ class VideoFrameRepository:
             return None
 
 
+def create_write_queue(**options) -> WriteBehindQueue:
+    """Create a write-behind queue writing person_detections / person_tracking_data in the background"""
+    from app.database import SessionLocal
+
+    writer = SqlAlchemyBatchWriter(SessionLocal, [models.PersonDetection, models.PersonTrackingData])
+    return WriteBehindQueue(writer, **options)
+
+
 # Helper function to get all repositories
-def get_repositories(db: Session):
-    """Create and return all repositories"""
+def get_repositories(db: Session, write_queue: Optional[WriteBehindQueue] = None):
+    """Create and return all repositories (per-face writes go through `write_queue` when given)"""
     return {
-        "person_detection": PersonDetectionRepository(db),
+        "person_detection": PersonDetectionRepository(db, write_queue),
         "object_detection": ObjectDetectionRepository(db),
         "registered_person": RegisteredPersonRepository(db),
-        "person_tracking": PersonTrackingDataRepository(db),
+        "person_tracking": PersonTrackingDataRepository(db, write_queue),
         "video_frame": VideoFrameRepository(db)
     }
\ No newline at end of file
@@ -10,11 +10,17 @@ import numpy as np
 import math
 from face.age_resnet_50 import AgeEstimator
 from face.face_pointing import process_image
+from face.face_attributes import crop_face, estimate_attributes
+from face.attribute_scheduler import AttributeScheduler, TrackAttributes
+from face.face_association import match_faces_to_tracks
+from face.face_quality import face_quality
 from face.gender_detection import GenderEstimator
 from face.res_emote_net_emotion import EmotionEstimator
 from app.database import get_db, SessionLocal
 from app.repositories import get_repositories
 from app.enums import PersonType, COCO_NAMES
+from containers.object_detection.tasks.object_routing_task import ObjectSnapshot, tracked_mask, xywh_to_xyxy
+from containers.tracking.repositories.track_state_repository import TrackStateRepository
 from ultralytics import RTDETR
 
 # Initialize all models
@@ -23,7 +29,7 @@ gender_estimator = GenderEstimator()
 emotion_estimator = EmotionEstimator()
 
 from logging import warning as log_warning
-from tracking.strong_sort import StrongSORT
+from tracking.tracker_factory import create_tracker, STRONG_SORT
 
 
 class FaceProcessor:
@@ -31,21 +37,12 @@ class FaceProcessor:
     Enhanced class for face detection, tracking, recognition, and analysis
     """
 
-    def __init__(self, session, recognition_attempts=3, data_path=None):
+    def __init__(self, session, recognition_attempts=3, data_path=None, attribute_scheduler=None,
+                 min_face_quality=0.0, tracker_type=STRONG_SORT):
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
         print("Using Device:", self.device)
-        self.tracker = StrongSORT(
-            model_weights='tracking/weights/osnet_ain_x1_0_msmt17.pt',
-            device=self.device,
-            fp16=False,
-            max_dist=0.2,
-            max_iou_distance=0.7,
-            max_age=70,
-            n_init=3,
-            nn_budget=100,
-            mc_lambda=0.9,
-            ema_alpha=0.9
-        )
+        # 'bytetrack' tracks by motion only and needs no ReID network
+        self.tracker = create_tracker(tracker_type, device=self.device)
 
         # Initialize repositories
         self.session = session
@@ -54,7 +51,16 @@ class FaceProcessor:
         self.recognition_attempts = recognition_attempts
         self.data_path = data_path
         self.model = RTDETR('weights/rtdetr-x.pt')
-        self.track_metadata = {}
+
+        # Per-track identity and attributes live in memory, the database is only written through
+        self.track_states = TrackStateRepository(self.repos["person_detection"])
+        self.tracker.resume_ids(self.track_states.last_track_id())
+        # Age/gender/emotion are sampled a bounded number of times per track instead of per face per frame
+        self.attribute_scheduler = attribute_scheduler or AttributeScheduler()
+        # Frontal faces scoring below this are not used for recognition or attribute sampling
+        self.min_face_quality = min_face_quality
+        # Non-person objects are stored when they change, not on every frame
+        self.object_snapshot = ObjectSnapshot()
 
         # Load known faces from database
         self.known_faces = self.repos["registered_person"].get_all_persons()
@@ -65,68 +71,6 @@ class FaceProcessor:
         else:
             print("No data path specified for known faces directories")
 
-    def is_face_frontal(self, face_box, lm):
-        """
-        Checks if face is frontal using bounding box and 5 key points.
-
-        Args:
-          face_box: (x_face, y_face, x1_face, y1_face)
-          lm: landmarks array size (5,2): [left eye, right eye, nose, left mouth corner, right mouth corner]
-
-        Returns:
-          True if face is suitable for recognition (adequate scale and orientation),
-          otherwise False.
-        """
-        # Extract bounding box coordinates
-        x_face, y_face, x1_face, y1_face = face_box
-        face_width = x1_face - x_face
-        face_height = y1_face - y_face
-        scale = (face_width + face_height) / 2.0
-
-        # Extract landmark points
-        left_eye, right_eye = np.array(lm[0]), np.array(lm[1])
-        nose = np.array(lm[2])
-        mouth_left, mouth_right = np.array(lm[3]), np.array(lm[4])
-
-        # Distances between key points
-        eye_distance = np.linalg.norm(left_eye - right_eye)
-        middle_eye = (left_eye + right_eye) / 2.0
-        middle_mouth = (mouth_left + mouth_right) / 2.0
-        face_vertical = np.linalg.norm(middle_mouth - middle_eye)
-
-        # Calculate angles relative to horizontal
-        def angle_between(p1, p2):
-            return math.degrees(math.atan2(p2[1] - p1[1], p2[0] - p1[0]))
-
-        eye_angle = angle_between(left_eye, right_eye)
-        mouth_angle = angle_between(mouth_left, mouth_right)
-
-        # Relative proportions, adapted by scale
-        eye_ratio = eye_distance / scale
-        vertical_ratio = face_vertical / scale
-
-        # New criterion: ratio of distances from nose to middle point of eyes and to middle point of mouth
-        nose_to_eyes = np.linalg.norm(nose - middle_eye)
-        nose_to_mouth = np.linalg.norm(nose - middle_mouth)
-        nose_ratio = nose_to_eyes / nose_to_mouth  # for a frontal face usually close to 1
-
-        # Check tilt angles: if eyes or mouth are tilted more than 20°, face is probably not frontal
-        if abs(eye_angle) > 20 or abs(mouth_angle) > 20:
-            return False
-
-        # Check proportions relative to scale
-        if not (0.25 < eye_ratio < 0.55):
-            return False
-        if not (0.35 < vertical_ratio < 0.75):
-            return False
-
-        # Additional check: if face is tilted down, nose will be closer to mouth
-        # For strictly frontal face nose_ratio should not be too small
-        if nose_ratio < 0.8:
-            return False
-
-        return True
-
     def recognize_face(self, frame, face_location):
         """
         Recognize face and determine if it's a customer, waiter or celebrity.
@@ -155,52 +99,37 @@ class FaceProcessor:
         Perform comprehensive face analysis: age, gender, emotion
         Only perform analysis if not already done for this track_id
         """
-        # Check if we already have metadata for this track_id
-        try:
-            x_face, y_face, x1_face, y1_face = face_box
-
-            # Ensure coordinates are within frame boundaries
-            height, width = frame.shape[:2]
-            x_face = max(0, x_face)
-            y_face = max(0, y_face)
-            x1_face = min(width, x1_face)
-            y1_face = min(height, y1_face)
-
-            # Skip if face region is too small
-            if x1_face - x_face <= 10 or y1_face - y_face <= 10:
-                print(f"Face region too small for track {track_id}: {face_box}")
-                return None, None, None
-
-            # Extract face region for analysis
-            face_img = frame[y_face:y1_face, x_face:x1_face]
-
-            # Ensure face image is not empty
-            if face_img.size == 0 or face_img.shape[0] == 0 or face_img.shape[1] == 0:
-                print(f"Empty face image for track {track_id}: {face_box}")
-                return None, None, None
-
-            face_img = Image.fromarray(face_img)
+        return self.analyze_faces(frame, [face_box], [track_id])[0]
 
-            # Estimate age
-            age = age_estimator(face_img)
-
-            # Estimate gender
-            gender = gender_estimator(face_img)
+    def analyze_faces(self, frame, face_boxes, track_ids):
+        """
+        Age, gender and emotion for several faces of a frame, one forward pass per model.
 
-            # Estimate emotion
-            emotion = emotion_estimator(face_img)
+        Returns:
+          (age, gender, emotion) per face in input order, (None, None, None) for unusable crops
+        """
+        results = [(None, None, None)] * len(face_boxes)
+        face_images, indexes = [], []
+        for i, (face_box, track_id) in enumerate(zip(face_boxes, track_ids)):
+            face_img = crop_face(frame, face_box)
+            if face_img is None:
+                print(f"Face region too small for track {track_id}: {face_box}")
+                continue
+            face_images.append(face_img)
+            indexes.append(i)
 
-            return age, gender, emotion
-        except Exception as e:
-            print(f"Error analyzing face for track {track_id}: {e}")
-            return None, None, None
+        attributes = estimate_attributes(face_images, age_estimator, gender_estimator, emotion_estimator)
+        for i, face_attributes in zip(indexes, attributes):
+            results[i] = face_attributes
+        return results
 
-    def process_frame(self, frame):
+    def process_frame(self, frame, timestamp=None):
         """
         Process a video frame for face detection, tracking, and analysis
 
         Args:
             frame: Video frame to process
+            timestamp: Capture time of the frame, paces emotion sampling (wall clock if None)
 
         Returns:
             Modified frame if output=True, original frame if output=False
@@ -231,49 +160,64 @@ class FaceProcessor:
             log_warning("No valid detections found")
             return None
 
-        for i, box in enumerate(bbox):
-            x1, y1, w1, h1 = box
-
-            # Сохраняем обнаружение объекта через репозиторий
-            self.repos["object_detection"].create(
-                frame_id=self.frame_count,
-                class_name=COCO_NAMES[class_id[i]],
-                class_id=class_id[i],
-                x1=x1,
-                y1=y1,
-                x2=x1 + w1,
-                y2=y1 + h1,
-                confidence=round(conf[i], 2)
+        # Persons go to the tracker and face matching, other classes to the object snapshot
+        persons = tracked_mask(class_id)
+        object_boxes, object_conf, object_class_id = xywh_to_xyxy(bbox[~persons]), conf[~persons], class_id[~persons]
+
+        # Сохраняем новые для снимка объекты одной вставкой через репозиторий
+        new = self.object_snapshot.update(self.frame_count, object_boxes, object_class_id)
+        if len(new):
+            self.repos["object_detection"].create_many(
+                {
+                    "frame_id": self.frame_count,
+                    "class_name": COCO_NAMES[object_class_id[i]],
+                    "class_id": int(object_class_id[i]),
+                    "x1": float(object_boxes[i, 0]),
+                    "y1": float(object_boxes[i, 1]),
+                    "x2": float(object_boxes[i, 2]),
+                    "y2": float(object_boxes[i, 3]),
+                    "confidence": round(float(object_conf[i]), 2)
+                }
+                for i in new
             )
 
-        trackers = self.tracker.update(bbox, conf, class_id, frame)
+        if not persons.any():
+            # Tracks still age so people who left get deleted
+            self.tracker.increment_ages()
+            self.track_states.evict(self.tracker.deleted_track_ids)
+            return None
+
+        trackers = self.tracker.update(bbox[persons], conf[persons], class_id[persons], frame)
+        self.track_states.evict(self.tracker.deleted_track_ids)
         # Detect faces and landmarks
         faces, landmarks = process_image(frame)
 
+        # Faces due for attribute sampling are analyzed together once all faces of the frame are matched
+        now = self.attribute_scheduler.seconds(timestamp)
+        sampled = {}
+
+        # Match every face to at most one tracked body for the whole frame at once
+        face_track_ids, face_bodies = match_faces_to_tracks(faces, trackers)
+        # Frontal flags and quality scores of all faces in one pass
+        quality = face_quality(faces, landmarks, frame)
+        usable = quality.frontal & (quality.score >= self.min_face_quality)
+
         for i, face in enumerate(faces):
             x_face, y_face, x1_face, y1_face = face[:4].astype(int)
             face_box = (x_face, y_face, x1_face, y1_face)
 
-            # Match with tracker
-            matched_id = None
-            body_coordinates = None
-            for track in trackers:
-                x, y, x1, y1, obj_id, _, _ = map(int, track[:7])
-                matched_id = obj_id
-                if (x <= x_face <= x1 and y <= y_face <= y1) and (x <= x1_face <= x1 and y <= y1_face <= y1):
-                    body_coordinates = (y, x1, y1, x)  # top, right, bottom, left (same format as face)
-                    break
-
             # Skip if no matching tracker found
-            if matched_id is None:
+            if face_track_ids[i] < 0:
                 # print('Skip ,no matching tracker found')
                 continue
 
+            matched_id = int(face_track_ids[i])
+            x, y, x1, y1 = face_bodies[i]
+            body_coordinates = (y, x1, y1, x)  # top, right, bottom, left (same format as face)
+
             # Check if face is visible and frontal
-            visible = False
-            if landmarks is not None and i < len(landmarks):
-                lm = landmarks[i]
-                visible = self.is_face_frontal(face[:4], lm)
+            visible = bool(usable[i])
+            face_score = float(quality.score[i])
 
             # Convert face location format for recognition
             face_location = (y_face, x1_face, y1_face, x_face)  # top, right, bottom, left
@@ -291,37 +235,37 @@ class FaceProcessor:
                 face_data["body_left"] = body_coordinates[3]
 
             # Check if we already have metadata for this track_id in our memory cache
-            track_meta = self.repos["person_detection"].get_face_metadata(matched_id)
-            if track_meta:
-                # Update only the coordinate-related info and keep other metadata
-                for key, value in track_meta.items():
-                    if key not in ["face_location", "body_top", "body_right", "body_bottom", "body_left"]:
-                        face_data[key] = value
+            track_state = self.track_states.get(matched_id)
+            if track_state:
+                # Keep the current coordinates and take identity/attributes from the cache
+                face_data.update(track_state.as_face_data())
 
-                person_type = track_meta.get("person_type", PersonType.CUSTOMER.value)
+                person_type = track_state.person_type
 
-                if track_meta.get("name") == 'identifying..':
+                if track_state.name == 'identifying..':
                     if visible:
                         recognition_result = self.recognize_face(frame, face_location)
                         if recognition_result:
                             name_new, person_type_new = recognition_result
-                            if matched_id in self.track_metadata:
-                                del self.track_metadata[matched_id]
-                            self.repos["person_detection"].update_by_track_id(
+                            track_state.recognition_attempts = 0
+                            self.track_states.update(
                                 matched_id,
                                 {"name": name_new, "person_type": person_type_new}
                             )
                         else:
-                            if matched_id in self.track_metadata:
-                                self.track_metadata[matched_id] += 1
-                            else:
-                                self.track_metadata[matched_id] = 1
-                            if self.track_metadata[matched_id] == self.recognition_attempts:
-                                self.repos["person_detection"].update_by_track_id(
+                            attempts = self.track_states.record_attempt(matched_id)
+                            if attempts == self.recognition_attempts:
+                                self.track_states.update(
                                     matched_id,
                                     {"name": "unknown"}
                                 )
 
+                # Frontal faces of known tracks are sampled only while the scheduler still needs them
+                if visible and matched_id not in sampled and any(
+                        self.attribute_scheduler.due(track_state.attributes, face_score, now)):
+                    sampled[matched_id] = (face_box, face_score, face_data, visible, person_type)
+                    continue
+
             else:
                 # No cached data, process face if visible
                 if visible:
@@ -345,26 +289,16 @@ class FaceProcessor:
                     face_data["name"] = name
                     face_data["person_type"] = person_type
 
-                    # Analyze face (age, gender, emotion) only if not already done
-                    age, gender, emotion = self.analyze_face(frame, face_box, matched_id)
-
-                    if age:
-                        face_data["age"] = age
-                    if gender:
-                        face_data["gender"] = gender
-                    if emotion:
-                        face_data["emotion"] = emotion
-
-                    # Save to appropriate tables based on person_type
-                    self.repos["person_detection"].save_face_data(
-                        self.frame_count,
-                        matched_id,
-                        face_data
-                    )
+                    # The new track is created once its first attribute sample is taken
+                    if matched_id not in sampled:
+                        sampled[matched_id] = (face_box, face_score, face_data, visible, person_type)
+                        continue
                 else:
                     face_data["name"] = "identifying..."
                     person_type = PersonType.CUSTOMER.value
 
+            self.track_states.touch(matched_id, self.frame_count)
+
             # Always save frame data for each frame
             self.repos["person_tracking"].save_frame_data(
                 self.frame_count,
@@ -374,6 +308,32 @@ class FaceProcessor:
                 person_type
             )
 
+        if sampled:
+            attributes = [
+                self.track_states.get(matched_id).attributes if matched_id in self.track_states else TrackAttributes()
+                for matched_id in sampled
+            ]
+            # One batch per model for every due face of the frame
+            self.attribute_scheduler.sample(
+                frame,
+                [(track_attributes, face_box, face_score)
+                 for track_attributes, (face_box, face_score, _, _, _) in zip(attributes, sampled.values())],
+                now, age_estimator, gender_estimator, emotion_estimator
+            )
+
+            for (matched_id, (_, _, face_data, visible, person_type)), track_attributes in zip(sampled.items(), attributes):
+                # New tracks are cached and written to person_detections here, known ones only write changed aggregates
+                self.track_states.apply_attributes(self.frame_count, matched_id, face_data, track_attributes)
+                self.track_states.touch(matched_id, self.frame_count)
+
+                self.repos["person_tracking"].save_frame_data(
+                    self.frame_count,
+                    matched_id,
+                    face_data,
+                    visible,
+                    person_type
+                )
+
     def load_known_faces_from_directories(self, base_path):
         """
         Загружает известные лица из структурированных каталогов.
@@ -489,7 +449,7 @@ if __name__ == "__main__":
                 break
 
             # Обрабатываем кадр
-            face_processor.process_frame(frame)
+            face_processor.process_frame(frame, saved_frame['timestamp'])
 
             # Отмечаем обработанные кадры
             video_frame_repo.mark_as_processed(saved_frame['id'])
@@ -2,94 +2,151 @@ import numpy as np
 from fastapi import Depends
 
 from app.enums import CocoClass
-from containers.face_recognition.models.face_data import PersonType, FaceLocation
-from containers.face_recognition.models.person_detection import PersonDetection
+from containers.face_recognition.models.face_data import PersonType
 from containers.face_recognition.repositories.face_repository import FaceRepository
-from containers.face_recognition.repositories.person_detection_repository import PersonDetectionRepository
 from containers.face_recognition.tasks.face_detector_task import FaceDetectorTask
+from face.attribute_scheduler import AttributeScheduler, TrackAttributes
+from face.face_association import match_faces_to_tracks
 from containers.object_detection.repositories.detection_repository import ObjectDetectionRepository
 from ship.core.base_action import BaseAction
 from containers.face_recognition.tasks.face_analysis_task import FaceAnalysisTask
 from containers.face_recognition.tasks.face_recognition_task import FaceRecognitionTask
 from containers.face_recognition.tasks.face_validation_task import FaceValidationTask
 from containers.object_detection.tasks.detection_task import ObjectDetectionTask
+from containers.object_detection.tasks.object_routing_task import ObjectRoutingTask, ObjectSnapshot, xywh_to_xyxy
+from containers.tracking.models.track_state import TrackState
+from containers.tracking.repositories.track_state_repository import TrackStateRepository
 from containers.tracking.tasks.tracking_task import TrackingTask
 
 
 class ProcessFrameAction(BaseAction):
     """Main action for processing video frames"""
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, **dependencies):
+        super().__init__(**dependencies)
 
         self.detection_task = ObjectDetectionTask(**self.dependencies)
-        self.face_detector_task: FaceDetectorTask = Depends(FaceDetectorTask)
-
-        self.person_detection_repo: PersonDetectionRepository = Depends(PersonDetectionRepository)
+        self.face_detector_task = FaceDetectorTask(**self.dependencies)
+
+        # Per-track state outlives the action, so the service owns it and passes it in
+        # (`is None`, not `or`: an empty repository is falsy)
+        self.track_states: TrackStateRepository = self.dependencies.get('track_states')
+        if self.track_states is None:
+            self.track_states = TrackStateRepository()
+        self.attribute_scheduler: AttributeScheduler = self.dependencies.get('attribute_scheduler')
+        if self.attribute_scheduler is None:
+            self.attribute_scheduler = AttributeScheduler()
+        self.object_snapshot: ObjectSnapshot = self.dependencies.get('object_snapshot')
+        if self.object_snapshot is None:
+            self.object_snapshot = ObjectSnapshot()
         self.object_detection_repo: ObjectDetectionRepository = Depends(ObjectDetectionRepository)
         self.face_repo: FaceRepository = Depends(FaceRepository)
 
     def run(self, frame: np.ndarray, frame_count: int) -> bool:
-        """Process a single video frame"""
+        """Process a single video frame, one stage after another"""
         try:
+            persons, objects = self.route(self.detect(frame))
+            trackers, deleted_track_ids = self.track(frame, persons)
+            faces, landmarks, quality = self.detect_faces(frame, trackers, frame_count)
+            rows = self.analyze(frame, frame_count, trackers, deleted_track_ids, faces, landmarks, quality)
+            self.save(frame_count, objects, rows)
+            return True
+
+        except Exception as e:
+            print(f"Error processing frame: {e}")
+            return False
 
-            # Task 1: Object Detection
-            detections = self.detection_task.run(frame)
+    def detect(self, frame: np.ndarray) -> dict:
+        """Task 1: Object Detection"""
+        return self.detection_task.run(frame)
 
-            # Save detections to database
-            for i, box in enumerate(detections['boxes']):
-                x1, y1, w1, h1 = box
-                coco_class = CocoClass.from_value(detections['class_ids'][i])
+    def route(self, detections: dict) -> tuple:
+        """Persons go to tracking and face matching, other classes to the object snapshot"""
+        return ObjectRoutingTask(**self.dependencies).run(detections)
 
-                self.object_detection_repo.add(
-                    frame_id=frame_count,
-                    class_name=coco_class.name,
-                    class_id=coco_class.value,
-                    x1=x1, y1=y1, x2=x1 + w1, y2=y1 + h1,
-                    confidence=round(detections['confidences'][i], 2)
-                )
+    def track(self, frame: np.ndarray, detections: dict) -> tuple:
+        """Task 2: Tracking, frames must come in order. Returns tracker output and the ids of deleted tracks"""
+        tracking_task = TrackingTask(**self.dependencies)
+        trackers = tracking_task.run(detections, frame)
+        return trackers, list(tracking_task.deleted_track_ids)
 
-            # Task 2: Tracking
-            tracking_task = TrackingTask(**self.dependencies)
-            trackers = tracking_task.run(detections, frame)
+    def detect_faces(self, frame: np.ndarray, trackers=None, frame_count: int = None) -> tuple:
+        """
+        Task 3: Face Detection, faces, landmarks and their quality.
 
-            # Task 3: Face Processing
+        Independent of other frames unless `trackers` are given for person-ROI detection
+        """
+        if trackers is not None:
+            faces, landmarks = self.face_detector_task.run_rois(frame, trackers, frame_count)
+        else:
             faces, landmarks = self.face_detector_task.run(frame)
+        # Frontal flags and quality scores of all faces in one pass
+        return faces, landmarks, FaceValidationTask().run_batch(faces, landmarks, frame)
+
+    def analyze(self, frame: np.ndarray, frame_count: int, trackers, deleted_track_ids, faces, landmarks,
+                quality) -> list:
+        """
+        Task 4: Recognition and Face Analysis, frames must come in order (updates the per-track state).
+
+        Returns (track_id, face_data, is_visible) rows of the frame for `save`
+        """
+        self.track_states.evict(deleted_track_ids)
+
+        # Match every face to at most one tracked body for the whole frame at once
+        face_track_ids, face_bodies = match_faces_to_tracks(faces, trackers)
+        usable = quality.frontal & (quality.score >= self.dependencies.get('min_face_quality', 0.0))
+
+        rows = []
+        sampled = {}
+        for i, face in enumerate(faces):
+            if face_track_ids[i] < 0:
+                continue
+
+            x, y, x1, y1 = face_bodies[i]
+            self._process_single_face(
+                frame,
+                face,
+                bool(usable[i]),
+                float(quality.score[i]),
+                int(face_track_ids[i]),
+                (y, x1, y1, x),
+                frame_count,
+                sampled,
+                rows
+            )
 
-            for i, face in enumerate(faces):
-                self._process_single_face(
-                    frame,
-                    face,
-                    landmarks[i] if landmarks and i < len(landmarks) else None,
-                    trackers,
-                    frame_count
-                )
-
-            return True
+        # Every face due for attribute sampling, in one batch
+        self._sample_attributes(frame, sampled, frame_count, rows)
+        return rows
+
+    def save(self, frame_count: int, objects: dict, rows: list) -> None:
+        """Task 5: Save the objects new to the snapshot and the per-face rows of the frame"""
+        boxes = xywh_to_xyxy(objects['boxes'])
+        new = self.object_snapshot.update(frame_count, boxes, objects['class_ids'])
+        if len(new):
+            self.object_detection_repo.add_many(
+                {
+                    'frame_id': frame_count,
+                    'class_name': CocoClass.from_value(int(objects['class_ids'][i])).name,
+                    'class_id': int(objects['class_ids'][i]),
+                    'x1': float(boxes[i, 0]), 'y1': float(boxes[i, 1]),
+                    'x2': float(boxes[i, 2]), 'y2': float(boxes[i, 3]),
+                    'confidence': round(float(objects['confidences'][i]), 2)
+                }
+                for i in new
+            )
 
-        except Exception as e:
-            print(f"Error processing frame: {e}")
-            return False
+        for matched_id, face_data, is_visible in rows:
+            self._save_frame_data(frame_count, matched_id, face_data, is_visible)
 
-    def _process_single_face(self, frame, face, landmark, trackers, frame_count):
-        """Process a single detected face"""
+    def _process_single_face(self, frame, face, is_visible, face_score, matched_id, body_coordinates, frame_count,
+                             sampled, rows):
+        """Process a single detected face, faces due for attribute sampling are deferred to `sampled`"""
         x_face, y_face, x1_face, y1_face = face[:4].astype(int)
         face_box = (x_face, y_face, x1_face, y1_face)
 
-        # Find matching tracker
-        matched_id, body_coordinates = self._match_face_to_tracker(face_box, trackers)
-
-        if not matched_id:
-            return
-
-        # Validate face quality
-        validation_task = FaceValidationTask()
-        is_visible = False
-        if landmark is not None:
-            is_visible = validation_task.run(face[:4], landmark)
-
-        # Get existing metadata
-        person = self.person_detection_repo.get_face_metadata(matched_id)
+        # Get existing metadata from the in-memory cache
+        track_state = self.track_states.get(matched_id)
 
         face_location = (y_face, x1_face, y1_face, x_face)  # top, right, bottom, left
 
@@ -99,70 +156,86 @@ class ProcessFrameAction(BaseAction):
             "body_coordinates": body_coordinates
         }
 
-        if person is not None:
+        if track_state is not None:
+            face_data.update(track_state.as_face_data())
             self._handle_existing_track(
                 frame,
-                person,
+                track_state,
                 matched_id,
                 face_location,
                 is_visible
             )
-        else:
-            self._handle_new_track(
-                frame,
-                face_data,
-                matched_id,
-                face_location,
-                face_box,
-                is_visible
-            )
 
-        # Save frame data
+            # Frontal faces of known tracks are sampled only while the scheduler still needs them
+            now = self.attribute_scheduler.seconds(self.dependencies.get('timestamp'))
+            if is_visible and matched_id not in sampled and any(
+                    self.attribute_scheduler.due(track_state.attributes, face_score, now)):
+                sampled[matched_id] = (face_box, face_score, face_data, is_visible)
+                return
+        elif self._handle_new_track(frame, face_data, matched_id, face_location, is_visible):
+            # The new track is created once its first attribute sample is taken
+            if matched_id not in sampled:
+                sampled[matched_id] = (face_box, face_score, face_data, is_visible)
+                return
+
+        self.track_states.touch(matched_id, frame_count)
+        rows.append((matched_id, face_data, is_visible))
+
+    def _sample_attributes(self, frame, sampled, frame_count, rows):
+        """Run the attribute models due for the sampled faces at once, then cache them and add their rows"""
+        if not sampled:
+            return
+
+        attributes = [
+            self.track_states.get(matched_id).attributes if matched_id in self.track_states else TrackAttributes()
+            for matched_id in sampled
+        ]
+        self.attribute_scheduler.sample(
+            frame,
+            [(track_attributes, face_box, face_score)
+             for track_attributes, (face_box, face_score, _, _) in zip(attributes, sampled.values())],
+            self.attribute_scheduler.seconds(self.dependencies.get('timestamp')),
+            self.dependencies.get('age_estimator'),
+            self.dependencies.get('gender_estimator'),
+            self.dependencies.get('emotion_estimator')
+        )
+
+        for (matched_id, (_, _, face_data, is_visible)), track_attributes in zip(sampled.items(), attributes):
+            # New tracks are cached and written to person_detections here, known ones only write changed aggregates
+            self.track_states.apply_attributes(frame_count, matched_id, face_data, track_attributes)
+            self.track_states.touch(matched_id, frame_count)
+            rows.append((matched_id, face_data, is_visible))
+
+    def _save_frame_data(self, frame_count, matched_id, face_data, is_visible):
+        """Save per-frame tracking data of one face"""
         tracking_repo = self.dependencies.get('tracking_repo')
         tracking_repo.save_frame_data(
             frame_count, matched_id, face_data, is_visible,
             face_data.get('person_type', PersonType.CUSTOMER.value)
         )
 
-    def _match_face_to_tracker(self, face_box, trackers):
-        """Match face detection to object tracker"""
-        x_face, y_face, x1_face, y1_face = face_box
-
-        for track in trackers:
-            x, y, x1, y1, obj_id, _, _ = map(int, track[:7])
-            if (
-                    x <= x_face <= x1 and
-                    y <= y_face <= y1 and
-                    x <= x1_face <= x1 and
-                    y <= y1_face <= y1
-            ):
-                body_coordinates = (y, x1, y1, x)
-                return obj_id, body_coordinates
-
-        return None, None
-
-    def _handle_existing_track(self, frame, person: PersonDetection, matched_id, face_location, is_visible):
+    def _handle_existing_track(self, frame, track_state: TrackState, matched_id, face_location, is_visible):
         """Handle processing for existing tracked face"""
 
         # Handle identification process
-        if person.name == 'identifying..' and is_visible:
+        if track_state.name == 'identifying..' and is_visible:
             recognition_task = FaceRecognitionTask(**self.dependencies)
             name, person_type = recognition_task.run(
                 frame, face_location, self.face_repo.get_registered_persons()
             )
 
             if name != "unknown":
-                self.face_repo.update_track_metadata(matched_id, {
+                self.track_states.update(matched_id, {
                     "name": name,
                     "person_type": person_type
                 })
 
-    def _handle_new_track(self, frame, face_data, matched_id, face_location, face_box, is_visible):
-        """Handle processing for new tracked face"""
+    def _handle_new_track(self, frame, face_data, matched_id, face_location, is_visible) -> bool:
+        """Handle processing for new tracked face, returns True if it still needs face analysis"""
         if not is_visible:
             face_data["name"] = "identifying..."
             face_data["person_type"] = PersonType.CUSTOMER.value
-            return
+            return False
 
         # Face Recognition
         recognition_task = FaceRecognitionTask(**self.dependencies)
@@ -172,46 +245,4 @@ class ProcessFrameAction(BaseAction):
 
         face_data["name"] = name
         face_data["person_type"] = person_type
-
-        # Face Analysis
-        height, width = frame.shape[:2]
-        x_face, y_face, x1_face, y1_face = face_box
-
-        # Ensure coordinates are within bounds
-        x_face = max(0, min(x_face, width))
-        y_face = max(0, min(y_face, height))
-        x1_face = max(0, min(x1_face, width))
-        y1_face = max(0, min(y1_face, height))
-
-        if x1_face > x_face and y1_face > y_face:
-            face_img = frame[y_face:y1_face, x_face:x1_face]
-
-            analysis_task = FaceAnalysisTask(**self.dependencies)
-            analysis = analysis_task.run(face_img, matched_id)
-
-            if analysis.age:
-                face_data["age"] = analysis.age
-
-            if analysis.gender:
-                face_data["gender"] = analysis.gender
-
-            if analysis.emotion:
-                face_data["emotion"] = analysis.emotion
-
-        # Save to database
-        face_repo = self.dependencies.get('face_repository')
-        detection = PersonDetection(
-            track_id=matched_id,
-            frame_id=self.dependencies.get('frame_count', 0),
-            name=name,
-            person_type=PersonType(person_type),
-            face_location=FaceLocation(
-                top=face_location[0], right=face_location[1],
-                bottom=face_location[2], left=face_location[3]
-            ),
-            face_analysis=analysis if any([analysis.age, analysis.gender, analysis.emotion]) else None,
-            is_visible=is_visible,
-            body_coordinates=face_data.get('body_coordinates')
-        )
-
-        self.face_repo.save_face_detection(detection)
+        return True
@@ -12,7 +12,7 @@ class PersonDetection(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     frame_id = Column(Integer, nullable=False)
-    track_id = Column(Integer, nullable=False)
+    track_id = Column(Integer, nullable=False, index=True)
     name = Column(String)
     age = Column(Integer)
     gender = Column(String)
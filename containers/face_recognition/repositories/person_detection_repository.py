@@ -1,16 +1,19 @@
 from sqlalchemy.orm import Session
 from datetime import datetime
-from typing import Dict, Optional, Any, Type
+from typing import Dict, List, Optional, Any, Type
 from app import models
 from app.enums import PersonType
 from containers.face_recognition.models.person_detection import PersonDetection
+from ship.core.write_behind import WriteBehindQueue
 
 
 class PersonDetectionRepository:
     """Repository for working with PersonDetection model"""
 
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, write_queue: Optional[WriteBehindQueue] = None):
         self.db = db
+        # When set, inserts and updates are deferred to the background writer
+        self.write_queue = write_queue
 
     def get_by_id(self, id: int) -> Optional[PersonDetection]:
         """Get a person detection by ID"""
@@ -20,7 +23,7 @@ class PersonDetectionRepository:
         """Get all person detections by track ID"""
         return self.db.query(PersonDetection).filter_by(track_id=track_id).all()
 
-    def save_face_data(self, frame_id: int, track_id: int, face_data: Dict[str, Any]) -> PersonDetection:
+    def save_face_data(self, frame_id: int, track_id: int, face_data: Dict[str, Any]) -> Optional[PersonDetection]:
         """Save face data for a detected person"""
         # Extract and convert data
         name = face_data.get("name", "unknown")
@@ -56,25 +59,30 @@ class PersonDetectionRepository:
         if track_id is not None:
             track_id = int(track_id)
 
+        row = dict(
+            frame_id=frame_id,
+            track_id=track_id,
+            name=name,
+            age=age,
+            gender=gender,
+            emotion=emotion,
+            face_top=top,
+            face_right=right,
+            face_bottom=bottom,
+            face_left=left,
+            body_top=body_top,
+            body_right=body_right,
+            body_bottom=body_bottom,
+            body_left=body_left,
+            person_type=person_type,
+            timestamp=timestamp
+        )
+        if self.write_queue is not None:
+            self.write_queue.insert(PersonDetection.__tablename__, row)
+            return None
+
         try:
-            person_detection = PersonDetection(
-                frame_id=frame_id,
-                track_id=track_id,
-                name=name,
-                age=age,
-                gender=gender,
-                emotion=emotion,
-                face_top=top,
-                face_right=right,
-                face_bottom=bottom,
-                face_left=left,
-                body_top=body_top,
-                body_right=body_right,
-                body_bottom=body_bottom,
-                body_left=body_left,
-                person_type=person_type,
-                timestamp=timestamp
-            )
+            person_detection = PersonDetection(**row)
 
             self.db.add(person_detection)
             self.db.commit()
@@ -91,6 +99,10 @@ class PersonDetectionRepository:
             print("No updates provided.")
             return
 
+        if self.write_queue is not None:
+            self.write_queue.update(PersonDetection.__tablename__, "track_id", track_id, updates)
+            return
+
         try:
             persons = self.db.query(PersonDetection).filter(models.PersonDetection.track_id == track_id).all()
             for person in persons:
@@ -105,6 +117,28 @@ class PersonDetectionRepository:
             print(f"Error updating fields: {e}")
             raise e
 
+    def load_track_states(self, limit: Optional[int] = 1000) -> List[Dict[str, Any]]:
+        """Latest row of the `limit` most recent tracks, highest track id first"""
+        persons = (
+            self.db.query(PersonDetection)
+            .distinct(PersonDetection.track_id)
+            .order_by(PersonDetection.track_id.desc(), PersonDetection.id.desc())
+            .limit(limit)
+            .all()
+        )
+        return [
+            {
+                "track_id": person.track_id,
+                "frame_id": person.frame_id,
+                "name": person.name,
+                "age": person.age,
+                "gender": person.gender,
+                "emotion": person.emotion,
+                "person_type": person.person_type
+            }
+            for person in persons
+        ]
+
     def get_face_metadata(self, track_id: int) -> PersonDetection | None:
         """Get stored data for a specific track_id"""
         return (
@@ -1,33 +1,59 @@
 from ship.core.base_task import BaseTask
+from ship.core.model_registry import model_registry
 from containers.face_recognition.models.face_data import FaceAnalysis
-from PIL import Image
+from face.face_attributes import estimate_attributes
+from typing import List, Optional
 import numpy as np
 
 
-class FaceAnalysisTask(BaseTask):
-    """Task for analyzing face attributes (age, gender, emotion)"""
+def load_age_estimator():
+    from face.age_resnet_50 import AgeEstimator
+    return AgeEstimator()
 
-    def run(self, face_image: np.ndarray, track_id: int) -> FaceAnalysis:
-        """Analyze face for age, gender, and emotion"""
-        try:
-            # Convert to PIL Image
-            if face_image.size == 0 or face_image.shape[0] == 0 or face_image.shape[1] == 0:
-                return FaceAnalysis()
 
-            face_img = Image.fromarray(face_image)
+def load_gender_estimator():
+    from face.gender_detection import GenderEstimator
+    return GenderEstimator()
+
 
-            # Get estimators from dependencies
-            age_estimator = self.dependencies.get('age_estimator')
-            gender_estimator = self.dependencies.get('gender_estimator')
-            emotion_estimator = self.dependencies.get('emotion_estimator')
+def load_emotion_estimator():
+    from face.res_emote_net_emotion import EmotionEstimator
+    return EmotionEstimator()
 
-            # Estimate attributes
-            age = age_estimator(face_img) if age_estimator else None
-            gender = gender_estimator(face_img) if gender_estimator else None
-            emotion = emotion_estimator(face_img) if emotion_estimator else None
 
-            return FaceAnalysis(age=age, gender=gender, emotion=emotion)
+model_registry.register('age_estimator', load_age_estimator)
+model_registry.register('gender_estimator', load_gender_estimator)
+model_registry.register('emotion_estimator', load_emotion_estimator)
 
+
+class FaceAnalysisTask(BaseTask):
+    """Task for analyzing face attributes (age, gender, emotion)"""
+
+    def run(self, face_image: np.ndarray, track_id: int) -> FaceAnalysis:
+        """Analyze face for age, gender, and emotion"""
+        return self.run_batch([face_image], [track_id])[0]
+
+    def run_batch(self, face_images: List[Optional[np.ndarray]], track_ids: List[int]) -> List[FaceAnalysis]:
+        """Analyze several faces with one forward pass per model, results follow the input order"""
+        results = [FaceAnalysis() for _ in face_images]
+        indexes = [
+            i for i, face_image in enumerate(face_images)
+            if face_image is not None and face_image.size != 0 and face_image.shape[0] != 0 and face_image.shape[1] != 0
+        ]
+        if not indexes:
+            return results
+
+        try:
+            attributes = estimate_attributes(
+                [face_images[i] for i in indexes],
+                self.dependencies.get('age_estimator'),
+                self.dependencies.get('gender_estimator'),
+                self.dependencies.get('emotion_estimator')
+            )
         except Exception as e:
-            print(f"Error analyzing face for track {track_id}: {e}")
-            return FaceAnalysis()
\ No newline at end of file
+            print(f"Error analyzing faces for tracks {track_ids}: {e}")
+            return results
+
+        for i, (age, gender, emotion) in zip(indexes, attributes):
+            results[i] = FaceAnalysis(age=age, gender=gender, emotion=emotion)
+        return results
@@ -1,13 +1,70 @@
+from dataclasses import fields, replace
+
+from face.face_roi import RoiFaceDetector, PERSON_ROI
+from face.face_scale import ScalePolicy, ScaledFaceDetector
 from ship.core.base_task import BaseTask
-from ship.setting import absolute_path
+from ship.core.exceptions import ConfigurationException
+from ship.core.model_registry import model_registry, DEFAULT_STREAM
+from ship.setting import absolute_path, settings
+
+
+def load_retinaface():
+    if settings.FACE_DETECTOR_BACKEND == 'onnx':
+        from face.model.retinaface.retinaface_onnx import RetinaFaceOnnx
+
+        print("Warning: FACE_DETECTOR_BACKEND=onnx is experimental, check it with "
+              "face.model.retinaface.check_onnx_parity before relying on its faces")
+        return RetinaFaceOnnx(absolute_path(settings.FACE_DETECTOR_ONNX_PATH), 'net3',
+                              intra_op_threads=settings.FACE_DETECTOR_THREADS)
+
+    from face.model.retinaface.retinaface import RetinaFace
+
+    # Инициализация детектора один раз, на GPU (gpuid=0)
+    GPUID = 0
+    return RetinaFace(absolute_path('face/checkpoint/R50/R50'), 0, GPUID, 'net3')
+
+
+model_registry.register('retinaface', load_retinaface)
+
+
+def scale_policy(stream_id=DEFAULT_STREAM) -> ScalePolicy:
+    """Face detector scales of a camera: the FACE_SCALE_* settings with its FACE_SCALE_CAMERAS overrides"""
+    policy = ScalePolicy(
+        target_size=settings.FACE_SCALE_TARGET_SIZE,
+        max_size=settings.FACE_SCALE_MAX_SIZE,
+        pyramid=settings.FACE_SCALE_PYRAMID,
+        early_exit=settings.FACE_SCALE_EARLY_EXIT,
+        min_face=settings.FACE_MIN_FACE_SIZE
+    )
+    overrides = settings.FACE_SCALE_CAMERAS.get(str(stream_id), {})
+    setting = f"FACE_SCALE_CAMERAS['{stream_id}']"
+    if not isinstance(overrides, dict):
+        raise ConfigurationException(f"{setting} must be an object of ScalePolicy fields, got {overrides!r}")
+
+    known = [field.name for field in fields(ScalePolicy)]
+    unknown = sorted(set(overrides) - set(known))
+    if unknown:
+        raise ConfigurationException(f"{setting} has unknown keys {unknown}, expected some of {known}")
+    try:
+        return replace(policy, **overrides)
+    except (TypeError, ValueError) as e:
+        raise ConfigurationException(f"{setting} has an invalid value: {e}") from e
 
 
 class FaceDetectorTask(BaseTask):
     def run(self, frame, thresh=0.8, do_flip=False):
-        from face.model.retinaface.retinaface import RetinaFace
+        return self.detector().detect(frame, thresh, do_flip=do_flip)
+
+    def detector(self) -> ScaledFaceDetector:
+        """RetinaFace at the scales of this stream's policy, timed into its 'face_scale_timings'"""
+        policy = self.dependencies.get('face_scale_policy') or \
+            scale_policy(self.dependencies.get('stream_id', DEFAULT_STREAM))
+        return ScaledFaceDetector(model_registry.get('retinaface'), policy, self.dependencies.get('face_scale_timings'))
 
-        # Инициализация детектора один раз, на GPU (gpuid=0)
-        GPUID = 0
-        DETECTOR = RetinaFace(absolute_path('face/checkpoint/R50/R50'), 0, GPUID, 'net3')
+    def run_rois(self, frame, trackers, frame_id=None, thresh=0.8, do_flip=False):
+        """Faces on the upper bodies of `trackers` in one forward pass, see RoiFaceDetector"""
+        if settings.FACE_DETECTION_MODE != PERSON_ROI:
+            return self.run(frame, thresh, do_flip)
 
-        return DETECTOR.detect(frame, thresh, scales=[1.0], do_flip=do_flip)
+        detector = RoiFaceDetector(self.detector(), settings.FACE_ROI_FULL_FRAME_INTERVAL)
+        return detector.detect(frame, trackers, frame_id, thresh, do_flip)
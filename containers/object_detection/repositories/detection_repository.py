@@ -1,6 +1,9 @@
+from sqlalchemy import insert
+
 from containers.object_detection.models.object_detection import ObjectDetection
 from ship.core.base_repository import BaseRepository
 from datetime import datetime
+from typing import Any, Dict, Iterable
 
 
 class ObjectDetectionRepository(BaseRepository):
@@ -51,3 +54,32 @@ class ObjectDetectionRepository(BaseRepository):
         except Exception as e:
             self.db.rollback()
             raise e
+
+    def add_many(self, detections: Iterable[Dict[str, Any]]) -> int:
+        """Insert all detections of a frame (or several frames) with one multi-row INSERT and one commit"""
+        timestamp = datetime.now()
+        rows = [
+            {
+                'frame_id': int(d['frame_id']),
+                'class_': d['class_name'],
+                'class_id': int(d['class_id']),
+                'x1': int(d['x1']) if d.get('x1') is not None else None,
+                'y1': int(d['y1']) if d.get('y1') is not None else None,
+                'x2': int(d['x2']) if d.get('x2') is not None else None,
+                'y2': int(d['y2']) if d.get('y2') is not None else None,
+                'conf': float(d['confidence']) if d.get('confidence') is not None else None,
+                'timestamp': d.get('timestamp') or timestamp,
+            }
+            for d in detections
+        ]
+        if not rows:
+            return 0
+
+        try:
+            self.db.execute(insert(ObjectDetection), rows)
+            self.db.commit()
+            return len(rows)
+
+        except Exception as e:
+            self.db.rollback()
+            raise e
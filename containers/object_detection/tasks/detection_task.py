@@ -1,17 +1,29 @@
 import numpy as np
 
 from ship.core.base_task import BaseTask
+from ship.core.model_registry import model_registry
 from ship.setting import absolute_path
 
 
+def load_rtdetr():
+    from ultralytics import RTDETR
+
+    return RTDETR(absolute_path('weights/rtdetr-x.pt'))
+
+
+def warmup_rtdetr(model):
+    model.predict(np.zeros((640, 640, 3), dtype=np.uint8), conf=0.5, verbose=False)
+
+
+model_registry.register('rtdetr', load_rtdetr, warmup=warmup_rtdetr)
+
+
 class ObjectDetectionTask(BaseTask):
     """Task for object detection using RTDETR"""
 
     def run(self, frame: np.ndarray) -> dict:
         """Detect objects in frame"""
-        from ultralytics import RTDETR
-
-        model = RTDETR(absolute_path('weights/rtdetr-x.pt'))
+        model = model_registry.get('rtdetr')
 
         if not model:
             return {'boxes': [], 'confidences': [], 'class_ids': []}
@@ -0,0 +1,99 @@
+from typing import Iterable, Optional
+
+import numpy as np
+
+from app.enums import CocoClass
+from ship.core.base_task import BaseTask
+
+# Classes handed to the tracker and face matching, everything else goes to the object snapshot
+TRACKED_CLASS_IDS = (CocoClass.PERSON.value,)
+
+
+def tracked_mask(class_ids, tracked_class_ids: Iterable[int] = TRACKED_CLASS_IDS) -> np.ndarray:
+    """(N,) bool, True for detections the tracker should see"""
+    return np.isin(np.asarray(class_ids, dtype=int), list(tracked_class_ids))
+
+
+def xywh_to_xyxy(boxes) -> np.ndarray:
+    """RT-DETR center x, center y, width, height to x1, y1, x2, y2"""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    return np.c_[boxes[:, :2] - boxes[:, 2:] / 2, boxes[:, :2] + boxes[:, 2:] / 2]
+
+
+def _iou(boxes: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """(N, M) IoU of x1, y1, x2, y2 boxes"""
+    top_left = np.maximum(boxes[:, None, :2], others[None, :, :2])
+    bottom_right = np.minimum(boxes[:, None, 2:], others[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area = np.prod(boxes[:, 2:] - boxes[:, :2], axis=1)
+    other_area = np.prod(others[:, 2:] - others[:, :2], axis=1)
+    return intersection / np.maximum(area[:, None] + other_area[None, :] - intersection, 1e-9)
+
+
+class ObjectSnapshot:
+    """
+    Last stored set of non-person objects of one stream.
+
+    Static scenes (tables, chairs, cups) do not need a row per frame: objects
+    are looked at every `every_n_frames` frames, or earlier when the number of
+    objects of some class changes, and only objects without a same-class box
+    of IoU >= `dedup_iou` in the previous snapshot are stored.
+    """
+
+    def __init__(self, every_n_frames: int = 30, dedup_iou: float = 0.7):
+        self.every_n_frames = every_n_frames
+        self.dedup_iou = dedup_iou
+        self.last_frame: Optional[int] = None
+        self.boxes = np.zeros((0, 4))
+        self.class_ids = np.zeros(0, dtype=int)
+
+    def _counts(self, class_ids: np.ndarray) -> dict:
+        classes, counts = np.unique(class_ids, return_counts=True)
+        return dict(zip(classes.tolist(), counts.tolist()))
+
+    def due(self, frame_id: int, class_ids) -> bool:
+        """The snapshot is old or the objects per class differ from it"""
+        if self.last_frame is None or frame_id - self.last_frame >= self.every_n_frames:
+            return True
+        return self._counts(np.asarray(class_ids, dtype=int)) != self._counts(self.class_ids)
+
+    def update(self, frame_id: int, boxes_xyxy, class_ids) -> np.ndarray:
+        """
+        Take a new snapshot if it is due.
+
+        Returns:
+          Indices of the objects to store, empty when nothing is due or everything is already stored
+        """
+        class_ids = np.asarray(class_ids, dtype=int)
+        if not self.due(frame_id, class_ids):
+            return np.zeros(0, dtype=int)
+
+        boxes = np.asarray(boxes_xyxy, dtype=np.float64).reshape(-1, 4)
+        new = np.ones(len(boxes), dtype=bool)
+        if len(boxes) and len(self.boxes):
+            overlap = _iou(boxes, self.boxes)
+            overlap[class_ids[:, None] != self.class_ids[None, :]] = 0.0
+            new = overlap.max(axis=1) < self.dedup_iou
+
+        self.last_frame = frame_id
+        self.boxes, self.class_ids = boxes, class_ids
+        return np.flatnonzero(new)
+
+    def clear(self) -> None:
+        self.last_frame = None
+        self.boxes = np.zeros((0, 4))
+        self.class_ids = np.zeros(0, dtype=int)
+
+
+class ObjectRoutingTask(BaseTask):
+    """Splits RT-DETR detections into the ones to track and the ones for the object snapshot"""
+
+    def run(self, detections: dict) -> tuple:
+        """
+        Returns:
+          (tracked, objects) detection dicts with the same keys as `detections`
+        """
+        mask = tracked_mask(detections['class_ids'], self.dependencies.get('tracked_class_ids', TRACKED_CLASS_IDS))
+        tracked = {key: np.asarray(values)[mask] for key, values in detections.items()}
+        objects = {key: np.asarray(values)[~mask] for key, values in detections.items()}
+        return tracked, objects
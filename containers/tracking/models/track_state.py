@@ -0,0 +1,31 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from containers.face_recognition.models.face_data import PersonType
+from face.attribute_scheduler import TrackAttributes
+
+
+@dataclass
+class TrackState:
+    """In-memory identity and attributes of one tracked person"""
+    track_id: int
+    name: Optional[str] = None
+    person_type: str = PersonType.CUSTOMER.value
+    age: Optional[int] = None
+    gender: Optional[str] = None
+    emotion: Optional[str] = None
+    recognition_attempts: int = 0
+    first_seen_frame: Optional[int] = None
+    last_seen_frame: Optional[int] = None
+    # Attribute samples behind age/gender/emotion, see AttributeScheduler
+    attributes: TrackAttributes = field(default_factory=TrackAttributes)
+
+    def as_face_data(self) -> Dict[str, Any]:
+        """Identity fields in the same shape `get_frame_data` used to return them"""
+        return {
+            "name": self.name,
+            "age": self.age,
+            "gender": self.gender,
+            "emotion": self.emotion,
+            "person_type": self.person_type
+        }
@@ -1,19 +1,22 @@
 from sqlalchemy.orm import Session
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 
 from containers.face_recognition.models.face_data import PersonType
 from containers.tracking.models.person_tracking_data import PersonTrackingData
+from ship.core.write_behind import WriteBehindQueue
 
 
 class PersonTrackingDataRepository:
     """Repository for working with PersonTrackingData model"""
 
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, write_queue: Optional[WriteBehindQueue] = None):
         self.db = db
+        # When set, inserts and updates are deferred to the background writer
+        self.write_queue = write_queue
 
     def save_frame_data(self, frame_id: int, track_id: int, face_data: Dict[str, Any],
-                        visible: bool, person_type: str = PersonType.CUSTOMER.value) -> PersonTrackingData:
+                        visible: bool, person_type: str = PersonType.CUSTOMER.value) -> Optional[PersonTrackingData]:
         """Save data for each frame to the person_tracking_data table"""
         name = face_data.get("name", "unknown")
 
@@ -47,26 +50,31 @@ class PersonTrackingDataRepository:
         if track_id is not None:
             track_id = int(track_id)
 
+        row = dict(
+            frame_id=frame_id,
+            track_id=track_id,
+            name=name,
+            age=age,
+            gender=gender,
+            emotion=emotion,
+            face_top=top,
+            face_right=right,
+            face_bottom=bottom,
+            face_left=left,
+            body_top=body_top,
+            body_right=body_right,
+            body_bottom=body_bottom,
+            body_left=body_left,
+            is_frontal=visible,
+            person_type=person_type,
+            timestamp=timestamp
+        )
+        if self.write_queue is not None:
+            self.write_queue.insert(PersonTrackingData.__tablename__, row)
+            return None
+
         try:
-            tracking_data = PersonTrackingData(
-                frame_id=frame_id,
-                track_id=track_id,
-                name=name,
-                age=age,
-                gender=gender,
-                emotion=emotion,
-                face_top=top,
-                face_right=right,
-                face_bottom=bottom,
-                face_left=left,
-                body_top=body_top,
-                body_right=body_right,
-                body_bottom=body_bottom,
-                body_left=body_left,
-                is_frontal=visible,
-                person_type=person_type,
-                timestamp=timestamp
-            )
+            tracking_data = PersonTrackingData(**row)
 
             self.db.add(tracking_data)
             self.db.commit()
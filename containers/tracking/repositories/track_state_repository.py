@@ -0,0 +1,120 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+from containers.face_recognition.models.face_data import PersonType
+from containers.tracking.models.track_state import TrackState
+from face.attribute_scheduler import TrackAttributes
+
+
+class TrackStateRepository:
+    """
+    In-process store of per-track state, keyed by track_id.
+
+    Lookups never touch the database: `storage` (anything with `save_face_data`,
+    `update_by_track_id` and `load_track_states`, e.g. DatabaseManager or
+    PersonDetectionRepository) is only written through and read once for
+    `last_track_id`. Tracks deleted by the tracker are dropped with `evict`.
+    """
+
+    def __init__(self, storage=None):
+        self.storage = storage
+        self._states: Dict[int, TrackState] = {}
+
+    def __contains__(self, track_id) -> bool:
+        return int(track_id) in self._states
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def get(self, track_id: int) -> Optional[TrackState]:
+        return self._states.get(int(track_id))
+
+    def create(self, frame_id: int, track_id: int, face_data: Dict[str, Any],
+               attributes: Optional[TrackAttributes] = None) -> TrackState:
+        """Remember a newly identified track and persist it to the detected-id table"""
+        track_id = int(track_id)
+        state = TrackState(
+            track_id=track_id,
+            name=face_data.get("name"),
+            person_type=face_data.get("person_type", PersonType.CUSTOMER.value),
+            age=face_data.get("age"),
+            gender=face_data.get("gender"),
+            emotion=face_data.get("emotion"),
+            first_seen_frame=frame_id,
+            last_seen_frame=frame_id,
+            attributes=attributes or TrackAttributes()
+        )
+        self._states[track_id] = state
+
+        if self.storage is not None:
+            self.storage.save_face_data(frame_id, track_id, face_data)
+        return state
+
+    def update(self, track_id: int, updates: Dict[str, Any]) -> None:
+        """Apply `updates` to the cached state and write them through"""
+        state = self._states.get(int(track_id))
+        if state is not None:
+            for key, value in updates.items():
+                if hasattr(state, key):
+                    setattr(state, key, value)
+
+        if self.storage is not None:
+            self.storage.update_by_track_id(track_id, updates)
+
+    def apply_attributes(self, frame_id: int, track_id: int, face_data: Dict[str, Any],
+                         attributes: TrackAttributes) -> TrackState:
+        """
+        Merge the aggregated attributes into `face_data` and the track's state.
+
+        A new track is created (and persisted) with them, an existing one only
+        writes through the aggregates that changed.
+        """
+        summary = attributes.summary()
+        face_data.update(summary)
+
+        state = self.get(track_id)
+        if state is None:
+            return self.create(frame_id, track_id, face_data, attributes)
+
+        changed = {key: value for key, value in summary.items() if getattr(state, key) != value}
+        if changed:
+            self.update(track_id, changed)
+        return state
+
+    def touch(self, track_id: int, frame_id: int) -> None:
+        """Mark the track as seen on `frame_id`"""
+        state = self._states.get(int(track_id))
+        if state is not None:
+            state.last_seen_frame = frame_id
+
+    def record_attempt(self, track_id: int) -> int:
+        """Count one more failed recognition attempt, returns the total so far"""
+        state = self._states.get(int(track_id))
+        if state is None:
+            return 0
+        state.recognition_attempts += 1
+        return state.recognition_attempts
+
+    def evict(self, track_ids: Iterable[int]) -> List[int]:
+        """Drop state of tracks the tracker has deleted, returns the evicted ids"""
+        evicted = []
+        for track_id in track_ids:
+            if self._states.pop(int(track_id), None) is not None:
+                evicted.append(int(track_id))
+        return evicted
+
+    def last_track_id(self) -> int:
+        """
+        Highest persisted track id after a restart (0 if there is none).
+
+        The tracker keeps numbering after it instead of reusing ids that already
+        have rows, so no new track can match a persisted one and their state is
+        not loaded into the cache.
+        """
+        if self.storage is None:
+            return 0
+
+        rows = self.storage.load_track_states(1)
+        return int(rows[0]["track_id"]) if rows else 0
+
+    def clear(self) -> None:
+        self._states.clear()
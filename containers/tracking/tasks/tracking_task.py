@@ -1,7 +1,26 @@
 import numpy as np
 
 from ship.core.base_task import BaseTask
-from ship.setting import absolute_path
+from ship.core.model_registry import model_registry, DEFAULT_STREAM
+from ship.setting import absolute_path, settings
+
+
+def load_tracker():
+    from tracking.tracker_factory import create_tracker, STRONG_SORT
+
+    # The tracker is chosen per deployment; 'bytetrack' runs without a ReID network (CPU-only sites)
+    if settings.TRACKER == STRONG_SORT:
+        return create_tracker(
+            STRONG_SORT,
+            model_weights=absolute_path('tracking/weights/osnet_ain_x1_0_msmt17.pt'),
+            cmc_method=settings.TRACKER_CMC or None,
+            adaptive_reid=settings.TRACKER_ADAPTIVE_REID
+        )
+    return create_tracker(settings.TRACKER)
+
+
+# Trackers keep per-camera state, so every stream gets its own instance
+model_registry.register('tracker', load_tracker, per_stream=True)
 
 
 class TrackingTask(BaseTask):
@@ -9,25 +28,11 @@ class TrackingTask(BaseTask):
 
     def run(self, detections: dict, frame: np.ndarray) -> list:
         """Update tracker with new detections"""
-        import torch
-        from tracking.strong_sort import StrongSORT
-
-        # Initialize device
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        # Tracks removed by this update, so callers can drop their per-track state
+        self.deleted_track_ids = []
 
-        # Initialize tracker
-        tracker = StrongSORT(
-            model_weights=absolute_path('tracking/weights/osnet_ain_x1_0_msmt17.pt'),
-            device=device,
-            fp16=False,
-            max_dist=0.2,
-            max_iou_distance=0.7,
-            max_age=70,
-            n_init=3,
-            nn_budget=100,
-            mc_lambda=0.9,
-            ema_alpha=0.9
-        )
+        stream_id = self.dependencies.get('stream_id', DEFAULT_STREAM)
+        tracker = model_registry.get('tracker', stream_id=stream_id)
 
         if not tracker:
             return []
@@ -37,6 +42,11 @@ class TrackingTask(BaseTask):
         class_id = detections['class_ids']
 
         if len(bbox) == 0:
+            # No persons on this frame, tracks still age so people who left get deleted
+            tracker.increment_ages()
+            self.deleted_track_ids = tracker.deleted_track_ids
             return []
 
-        return tracker.update(bbox, conf, class_id, frame)
\ No newline at end of file
+        outputs = tracker.update(bbox, conf, class_id, frame)
+        self.deleted_track_ids = tracker.deleted_track_ids
+        return outputs
@@ -5,8 +5,11 @@ from PIL import Image
 from datetime import datetime
 import psycopg2
 from psycopg2 import pool
+from psycopg2.extras import execute_values
 import numpy as np
 
+from ship.core.write_behind import WriteBehindQueue, WriteOp
+
 
 # Константы для типов людей
 PERSON_TYPE_CUSTOMER = 'customer'
@@ -18,7 +21,8 @@ class DatabaseManager:
     Manages database connections and operations using connection pooling
     """
 
-    def __init__(self, dbname, user, password, host="localhost", port="5432", min_conn=1, max_conn=10):
+    def __init__(self, dbname, user, password, host="localhost", port="5432", min_conn=1, max_conn=10,
+                 detection_batch_frames=1, write_behind=False, write_behind_options=None):
         self.connection_pool = psycopg2.pool.ThreadedConnectionPool(
             min_conn,
             max_conn,
@@ -28,8 +32,17 @@ class DatabaseManager:
             port=port,
             database=dbname
         )
+        # Detections are buffered per frame and flushed every `detection_batch_frames` frames
+        self.detection_batch_frames = max(1, int(detection_batch_frames))
+        self._detection_buffer = []
+        self._buffered_frames = 0
         self.init_db()
 
+        # frame_data / detected_id writes go through a background writer instead of the inference thread
+        self.write_queue = None
+        if write_behind:
+            self.write_queue = WriteBehindQueue(self.write_ops, **(write_behind_options or {}))
+
     def init_db(self):
         """Initialize database tables if they don't exist and add any missing columns"""
         conn = self.connection_pool.getconn()
@@ -58,6 +71,9 @@ class DatabaseManager:
                     )
                 ''')
 
+                # Track updates and the last track id lookup on restart go by track_id
+                cursor.execute('CREATE INDEX IF NOT EXISTS detected_id_track_id_idx ON detected_id (track_id)')
+
                 cursor.execute('''
                     CREATE TABLE IF NOT EXISTS detected_things (
                         id SERIAL PRIMARY KEY,
@@ -124,66 +140,53 @@ class DatabaseManager:
         finally:
             self.connection_pool.putconn(conn)
 
+    @staticmethod
+    def _face_row(frame_id, track_id, face_data):
+        """Build a detected_id / frame_data row from face_data, converting numpy types to plain Python"""
+        # Преобразуем numpy.int64 в стандартный Python int
+        age = int(face_data.get("age")) if face_data.get("age") is not None else None
+
+        # Face location
+        face_location = face_data.get("face_location", (None, None, None, None))
+        if face_location and len(face_location) == 4:
+            # Преобразуем numpy.int64 в стандартный Python int
+            top = int(face_location[0]) if face_location[0] is not None else None
+            right = int(face_location[1]) if face_location[1] is not None else None
+            bottom = int(face_location[2]) if face_location[2] is not None else None
+            left = int(face_location[3]) if face_location[3] is not None else None
+        else:
+            top, right, bottom, left = None, None, None, None
+
+        # Body location - преобразуем numpy.int64 в стандартный Python int
+        body_top = int(face_data.get("body_top")) if face_data.get("body_top") is not None else None
+        body_right = int(face_data.get("body_right")) if face_data.get("body_right") is not None else None
+        body_bottom = int(face_data.get("body_bottom")) if face_data.get("body_bottom") is not None else None
+        body_left = int(face_data.get("body_left")) if face_data.get("body_left") is not None else None
+
+        return {
+            "frame_id": int(frame_id) if frame_id is not None else None,
+            "track_id": int(track_id) if track_id is not None else None,
+            "name": face_data.get("name", "unknown"),
+            "age": age,
+            "gender": face_data.get("gender"),
+            "emotion": face_data.get("emotion"),
+            "face_top": top,
+            "face_right": right,
+            "face_bottom": bottom,
+            "face_left": left,
+            "body_top": body_top,
+            "body_right": body_right,
+            "body_bottom": body_bottom,
+            "body_left": body_left,
+            "timestamp": datetime.now()
+        }
+
     def save_frame_data(self, frame_id, track_id, face_data, visible, person_type=PERSON_TYPE_CUSTOMER):
         """Save data for each frame to the frame_data table"""
-        conn = self.connection_pool.getconn()
-        try:
-            with conn.cursor() as cursor:
-                name = face_data.get("name", "unknown")
-
-                # Преобразуем numpy.int64 в стандартный Python int
-                age = int(face_data.get("age")) if face_data.get("age") is not None else None
-                gender = face_data.get("gender")
-                emotion = face_data.get("emotion")
-
-                # Face location
-                face_location = face_data.get("face_location", (None, None, None, None))
-                if face_location and len(face_location) == 4:
-                    # Преобразуем numpy.int64 в стандартный Python int
-                    top = int(face_location[0]) if face_location[0] is not None else None
-                    right = int(face_location[1]) if face_location[1] is not None else None
-                    bottom = int(face_location[2]) if face_location[2] is not None else None
-                    left = int(face_location[3]) if face_location[3] is not None else None
-                else:
-                    top, right, bottom, left = None, None, None, None
-
-                # Body location - преобразуем numpy.int64 в стандартный Python int
-                body_top = int(face_data.get("body_top")) if face_data.get("body_top") is not None else None
-                body_right = int(face_data.get("body_right")) if face_data.get("body_right") is not None else None
-                body_bottom = int(face_data.get("body_bottom")) if face_data.get("body_bottom") is not None else None
-                body_left = int(face_data.get("body_left")) if face_data.get("body_left") is not None else None
-
-                timestamp = datetime.now()
-
-                # Преобразуем frame_id и track_id в стандартный Python int
-                if frame_id is not None:
-                    frame_id = int(frame_id)
-                if track_id is not None:
-                    track_id = int(track_id)
-
-                try:
-                    cursor.execute('''
-                        INSERT INTO frame_data 
-                        (frame_id, track_id, name, age, gender, emotion, 
-                         face_top, face_right, face_bottom, face_left, 
-                         body_top, body_right, body_bottom, body_left,
-                         is_frontal, person_type, timestamp)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ''', (frame_id, track_id, name, age, gender, emotion,
-                          top, right, bottom, left,
-                          body_top, body_right, body_bottom, body_left,
-                          visible, person_type, timestamp))
-
-
-
-                    conn.commit()
-                except Exception as e:
-                    print(e)
-        except Exception as e:
-            print(f"Error saving frame data: {e}")
-            conn.rollback()
-        finally:
-            self.connection_pool.putconn(conn)
+        row = self._face_row(frame_id, track_id, face_data)
+        row["is_frontal"] = visible
+        row["person_type"] = person_type
+        self._persist("frame_data", row)
 
     def write_detection_to_db(self, frame_id, class_name, class_id, x1, y1, x2, y2, confidence, timestamp=None):
         """Write information about detected objects to the database"""
@@ -234,34 +237,84 @@ class DatabaseManager:
         finally:
             self.connection_pool.putconn(conn)
 
-    def update_by_track_id(self, track_id, updates: dict):
-        """Update any fields in 'detected_id' table for a given track_id"""
-        if not updates:
-            print("No updates provided.")
-            return
+    @staticmethod
+    def _detection_row(frame_id, class_name, class_id, x1, y1, x2, y2, confidence, timestamp=None):
+        """Convert one detection to a plain-Python `detected_things` row"""
+        return (
+            int(frame_id) if frame_id is not None else None,
+            class_name,
+            int(class_id) if class_id is not None else None,
+            int(x1) if x1 is not None else None,
+            int(y1) if y1 is not None else None,
+            int(x2) if x2 is not None else None,
+            int(y2) if y2 is not None else None,
+            float(confidence) if confidence is not None else None,
+            timestamp if timestamp is not None else datetime.now()
+        )
+
+    def write_detections_to_db(self, detections):
+        """
+        Write a batch of detected objects with a single multi-row INSERT in one transaction.
+
+        Args:
+          detections: iterable of (frame_id, class_name, class_id, x1, y1, x2, y2, confidence[, timestamp])
+
+        Returns:
+          Number of inserted rows
+        """
+        rows = [self._detection_row(*detection) for detection in detections]
+        if not rows:
+            return 0
 
         conn = self.connection_pool.getconn()
         try:
             with conn.cursor() as cursor:
-                # Генерируем динамически SET-часть запроса
-                set_clause = ', '.join([f"{key} = %s" for key in updates])
-                values = list(updates.values())
-                values.append(track_id)  # Добавляем track_id в конец
-
-                query = f'''
-                    UPDATE detected_id
-                    SET {set_clause}
-                    WHERE track_id = %s
-                '''
-
-                cursor.execute(query, values)
-                conn.commit()
-                print(f"Updated track_id {track_id} with fields: {list(updates.keys())}")
+                execute_values(cursor, '''
+                    INSERT INTO detected_things
+                    (frame_id, class, class_id, x1, y1, x2, y2, conf, timestamp)
+                    VALUES %s
+                ''', rows, page_size=len(rows))
+            conn.commit()
+            return len(rows)
         except Exception as e:
-            print(f"Error updating fields: {e}")
+            print(f"Error writing detections to database: {e}")
+            conn.rollback()
+            return 0
         finally:
             self.connection_pool.putconn(conn)
 
+    def add_frame_detections(self, detections):
+        """
+        Buffer all detections of one frame and flush once `detection_batch_frames` frames are collected.
+
+        Returns:
+          Number of rows written by this call (0 while the batch is still filling)
+        """
+        self._detection_buffer.extend(detections)
+        self._buffered_frames += 1
+        if self._buffered_frames >= self.detection_batch_frames:
+            return self.flush_detections()
+        return 0
+
+    def flush_detections(self):
+        """Write any buffered detections to the database"""
+        rows, self._detection_buffer = self._detection_buffer, []
+        self._buffered_frames = 0
+        return self.write_detections_to_db(rows)
+
+    def update_by_track_id(self, track_id, updates: dict):
+        """Update any fields in 'detected_id' table for a given track_id"""
+        if not updates:
+            print("No updates provided.")
+            return
+
+        if self.write_queue is not None:
+            self.write_queue.update("detected_id", "track_id", track_id, updates)
+            return
+
+        if self.write_ops([WriteOp("update", "detected_id", key=("track_id", track_id), values=updates)]):
+            print(f"Updated track_id {track_id} with fields: {list(updates.keys())}")
+
     def get_frame_data(self, track_id):
         """Get stored data for a specific frame and track_id"""
         conn = self.connection_pool.getconn()
@@ -300,6 +353,36 @@ class DatabaseManager:
         finally:
             self.connection_pool.putconn(conn)
 
+    def load_track_states(self, limit=1000):
+        """Latest detected_id row of the `limit` most recent tracks, highest track id first"""
+        conn = self.connection_pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('''
+                    SELECT DISTINCT ON (track_id) track_id, frame_id, name, age, gender, emotion, person_type
+                    FROM detected_id
+                    ORDER BY track_id DESC, id DESC
+                    LIMIT %s
+                ''', (limit,))
+
+                return [
+                    {
+                        "track_id": row[0],
+                        "frame_id": row[1],
+                        "name": row[2],
+                        "age": row[3],
+                        "gender": row[4],
+                        "emotion": row[5],
+                        "person_type": row[6]
+                    }
+                    for row in cursor.fetchall()
+                ]
+        except Exception as e:
+            print(f"Error loading track states: {e}")
+            return []
+        finally:
+            self.connection_pool.putconn(conn)
+
     def get_unprocessed_frames(self):
         conn = self.connection_pool.getconn()
         try:
@@ -364,63 +447,63 @@ class DatabaseManager:
             self.connection_pool.putconn(conn)
 
     def save_face_data(self, frame_id, track_id, face_data):
-        """Save data for each frame to the frame_data table"""
+        """Save face data for a newly identified track to the detected_id table"""
+        row = self._face_row(frame_id, track_id, face_data)
+        row["person_type"] = face_data.get("person_type")
+        self._persist("detected_id", row)
+
+    def _persist(self, table, row):
+        """Insert one row, through the write-behind queue when it is enabled"""
+        if self.write_queue is not None:
+            self.write_queue.insert(table, row)
+        else:
+            self.write_ops([WriteOp("insert", table, rows=[row])])
+
+    def write_ops(self, ops):
+        """
+        Apply grouped write operations in a single transaction.
+
+        Inserts become one multi-row INSERT per table, updates set the given
+        columns for every row matching the key column.
+
+        Returns:
+          True on success, False if the transaction was rolled back
+        """
         conn = self.connection_pool.getconn()
         try:
             with conn.cursor() as cursor:
-                name = face_data.get("name", "unknown")
-
-                # Преобразуем numpy.int64 в стандартный Python int
-                age = int(face_data.get("age")) if face_data.get("age") is not None else None
-                gender = face_data.get("gender")
-                emotion = face_data.get("emotion")
-                person_type = face_data.get("person_type")
-                # Face location
-                face_location = face_data.get("face_location", (None, None, None, None))
-                if face_location and len(face_location) == 4:
-                    # Преобразуем numpy.int64 в стандартный Python int
-                    top = int(face_location[0]) if face_location[0] is not None else None
-                    right = int(face_location[1]) if face_location[1] is not None else None
-                    bottom = int(face_location[2]) if face_location[2] is not None else None
-                    left = int(face_location[3]) if face_location[3] is not None else None
-                else:
-                    top, right, bottom, left = None, None, None, None
-
-                # Body location - преобразуем numpy.int64 в стандартный Python int
-                body_top = int(face_data.get("body_top")) if face_data.get("body_top") is not None else None
-                body_right = int(face_data.get("body_right")) if face_data.get("body_right") is not None else None
-                body_bottom = int(face_data.get("body_bottom")) if face_data.get("body_bottom") is not None else None
-                body_left = int(face_data.get("body_left")) if face_data.get("body_left") is not None else None
-
-
-                # Преобразуем frame_id и track_id в стандартный Python int
-                if frame_id is not None:
-                    frame_id = int(frame_id)
-                if track_id is not None:
-                    track_id = int(track_id)
-                timestamp = datetime.now()
-                try:
-                    cursor.execute('''
-                        INSERT INTO detected_id 
-                        (frame_id, track_id, name, age, gender, emotion, 
-                         face_top, face_right, face_bottom, face_left, 
-                         body_top, body_right, body_bottom, body_left,
-                         person_type, timestamp)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ''', (frame_id, track_id, name, age, gender, emotion,
-                          top, right, bottom, left,
-                          body_top, body_right, body_bottom, body_left,
-                          person_type, timestamp))
-
-                    conn.commit()
-                except Exception as e:
-                    print(e)
+                for op in ops:
+                    if op.kind == "insert":
+                        columns = list(op.rows[0])
+                        execute_values(
+                            cursor,
+                            f"INSERT INTO {op.table} ({', '.join(columns)}) VALUES %s",
+                            [tuple(row[column] for column in columns) for row in op.rows],
+                            page_size=len(op.rows)
+                        )
+                    else:
+                        key_column, key_value = op.key
+                        set_clause = ', '.join([f"{key} = %s" for key in op.values])
+                        cursor.execute(
+                            f"UPDATE {op.table} SET {set_clause} WHERE {key_column} = %s",
+                            list(op.values.values()) + [key_value]
+                        )
+            conn.commit()
+            return True
         except Exception as e:
-            print(f"Error saving frame data: {e}")
+            print(f"Error writing to database: {e}")
             conn.rollback()
+            return False
         finally:
             self.connection_pool.putconn(conn)
 
+    def close(self):
+        """Drain pending writes and close all pooled connections"""
+        self.flush_detections()
+        if self.write_queue is not None:
+            self.write_queue.close()
+        self.connection_pool.closeall()
+
     def register_known_face(self, name, face_encoding, person_type=PERSON_TYPE_CUSTOMER):
         """Register a known face in the database"""
         conn = self.connection_pool.getconn()
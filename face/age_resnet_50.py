@@ -50,23 +50,34 @@ class AgeEstimator:
 
     def __call__(self, images):
         """
-        Обрабатывает одиночное изображение: применяет трансформации и проводит через модель.
+        Обрабатывает одиночное изображение или список изображений (тогда возвращает список возрастов).
         """
-        if not isinstance(images, list):
-            images = [images]
-        image_tensor = [self.transform(img) for img in images]
-        image_tensor = torch.stack(image_tensor, dim=0).to(self.device)
-        # Если изображение не имеет размерности батча, добавляем её
-        if image_tensor.dim() == 3:
-            image_tensor = image_tensor.unsqueeze(0)
-        elif image_tensor.dim() != 4:
-            raise ValueError("Преобразованное изображение имеет некорректное число размерностей")
-
-        image_tensor = image_tensor.to(self.device)
-
-        with torch.no_grad():
-            output = self.model(image_tensor)
-        return str(int(output[0]))
+        if isinstance(images, list):
+            return self.predict_batch(images)
+        return self.predict_batch([images])[0]
+
+    def predict_batch(self, images, batch_size=64):
+        """
+        Оценивает возраст для списка лиц: один прямой проход на каждые `batch_size` изображений.
+        Возвращает результаты в том же порядке, что и входные изображения.
+        """
+        ages = []
+        for start in range(0, len(images), batch_size):
+            image_tensor = torch.stack([self.transform(img) for img in images[start:start + batch_size]], dim=0)
+            ages.extend(self.predict_tensor(image_tensor, batch_size))
+        return ages
+
+    def predict_tensor(self, image_tensor, batch_size=64):
+        """
+        Оценивает возраст для уже подготовленного батча (N, 3, 224, 224), нормализованного по ImageNet
+        (см. face.face_preprocessing.FacePreprocessor).
+        """
+        ages = []
+        for start in range(0, image_tensor.shape[0], batch_size):
+            with torch.no_grad():
+                output = self.model(image_tensor[start:start + batch_size].to(self.device))
+            ages.extend(str(int(age)) for age in output.reshape(-1))
+        return ages
 
 
 
@@ -0,0 +1,121 @@
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from statistics import median
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from face.face_attributes import crop_face, estimate_attributes
+
+
+@dataclass
+class TrackAttributes:
+    """Attribute samples collected for one track and their aggregates"""
+    age_samples: List[int] = field(default_factory=list)
+    gender_votes: Counter = field(default_factory=Counter)
+    emotion_timeline: Deque[Tuple[float, str]] = field(default_factory=lambda: deque(maxlen=256))
+    samples: int = 0
+    best_quality: float = 0.0
+    last_emotion_at: Optional[float] = None
+
+    @property
+    def age(self) -> Optional[int]:
+        return int(median(self.age_samples)) if self.age_samples else None
+
+    @property
+    def gender(self) -> Optional[str]:
+        return self.gender_votes.most_common(1)[0][0] if self.gender_votes else None
+
+    @property
+    def emotion(self) -> Optional[str]:
+        return self.emotion_timeline[-1][1] if self.emotion_timeline else None
+
+    def summary(self) -> Dict[str, Any]:
+        """Aggregated age (median), gender (majority vote) and latest emotion, only those already known"""
+        values = {"age": self.age, "gender": self.gender, "emotion": self.emotion}
+        return {key: value for key, value in values.items() if value is not None}
+
+
+class AttributeScheduler:
+    """
+    Decides when a track's face is worth sending to the attribute models.
+
+    Age and gender are sampled at most `max_samples` times per track, from
+    frontal crops at least `min_quality_ratio` as good as the best one seen so
+    far (quality is the `face.face_quality` score). Emotion is sampled every
+    `emotion_interval` seconds (never if None). Once a track has its samples,
+    it costs no model time apart from emotion.
+    """
+
+    def __init__(self, max_samples: int = 5, emotion_interval: Optional[float] = 2.0,
+                 min_quality_ratio: float = 0.8):
+        self.max_samples = max_samples
+        self.emotion_interval = emotion_interval
+        self.min_quality_ratio = min_quality_ratio
+
+    @staticmethod
+    def seconds(timestamp=None) -> float:
+        """Frame timestamp (datetime or seconds) as seconds, falling back to the wall clock"""
+        if isinstance(timestamp, datetime):
+            return timestamp.timestamp()
+        if timestamp is not None:
+            return float(timestamp)
+        return time.time()
+
+    def due(self, attributes: Optional[TrackAttributes], quality: float, now: float) -> Tuple[bool, bool]:
+        """Whether (age and gender, emotion) should be sampled from this crop"""
+        if attributes is None:
+            return True, self.emotion_interval is not None
+
+        age_gender = (
+            attributes.samples < self.max_samples and
+            quality >= self.min_quality_ratio * attributes.best_quality
+        )
+        emotion = self.emotion_interval is not None and (
+            attributes.last_emotion_at is None or now - attributes.last_emotion_at >= self.emotion_interval
+        )
+        return age_gender, emotion
+
+    def sample(self, frame: np.ndarray, candidates: Sequence[Tuple[TrackAttributes, Any, float]], now: float,
+               age_estimator=None, gender_estimator=None, emotion_estimator=None) -> None:
+        """
+        Run the models that are due for each (attributes, face_box, quality) candidate and record the results.
+
+        All age/gender crops go through the models in one batch, and so do all emotion crops.
+        """
+        age_gender_indexes, emotion_indexes, crops = [], [], {}
+        for i, (attributes, face_box, quality) in enumerate(candidates):
+            age_gender, emotion = self.due(attributes, quality, now)
+            if not (age_gender or emotion):
+                continue
+
+            face_img = crop_face(frame, face_box)
+            if face_img is None:
+                continue
+
+            crops[i] = face_img
+            if age_gender:
+                age_gender_indexes.append(i)
+            if emotion:
+                emotion_indexes.append(i)
+
+        if age_gender_indexes:
+            results = estimate_attributes([crops[i] for i in age_gender_indexes], age_estimator, gender_estimator)
+            for i, (age, gender, _) in zip(age_gender_indexes, results):
+                attributes, _, quality = candidates[i]
+                if age is not None:
+                    attributes.age_samples.append(int(age))
+                if gender is not None:
+                    attributes.gender_votes[gender] += 1
+                attributes.samples += 1
+                attributes.best_quality = max(attributes.best_quality, quality)
+
+        if emotion_indexes:
+            results = estimate_attributes([crops[i] for i in emotion_indexes], emotion_estimator=emotion_estimator)
+            for i, (_, _, emotion) in zip(emotion_indexes, results):
+                attributes = candidates[i][0]
+                if emotion is not None:
+                    attributes.emotion_timeline.append((now, emotion))
+                attributes.last_emotion_at = now
@@ -0,0 +1,115 @@
+from typing import Tuple
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+
+ASSIGN_HUNGARIAN = 'hungarian'
+ASSIGN_GREEDY = 'greedy'
+
+# Weight of the "face sits at the top of the body" tie-break in the association score
+HEAD_POSITION_WEIGHT = 0.5
+
+
+def containment_matrix(face_boxes, body_boxes) -> np.ndarray:
+    """
+    Fraction of every face box that lies inside every body box.
+
+    Args:
+      face_boxes: (N, 4) x1, y1, x2, y2
+      body_boxes: (M, 4) x1, y1, x2, y2
+
+    Returns:
+      (N, M) array in [0, 1]; 1 means the face is fully inside the body box
+    """
+    faces = np.asarray(face_boxes, dtype=np.float64).reshape(-1, 4)
+    bodies = np.asarray(body_boxes, dtype=np.float64).reshape(-1, 4)
+
+    inter_w = np.minimum(faces[:, None, 2], bodies[None, :, 2]) - np.maximum(faces[:, None, 0], bodies[None, :, 0])
+    inter_h = np.minimum(faces[:, None, 3], bodies[None, :, 3]) - np.maximum(faces[:, None, 1], bodies[None, :, 1])
+    inter = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+    area = (np.clip(faces[:, 2] - faces[:, 0], 0, None) * np.clip(faces[:, 3] - faces[:, 1], 0, None))[:, None]
+
+    # Degenerate (zero area) faces count as contained when both corners are inside the body
+    inside = (
+        (faces[:, None, 0] >= bodies[None, :, 0]) & (faces[:, None, 1] >= bodies[None, :, 1]) &
+        (faces[:, None, 2] <= bodies[None, :, 2]) & (faces[:, None, 3] <= bodies[None, :, 3])
+    )
+    return np.where(area > 0, inter / np.maximum(area, 1e-12), inside.astype(np.float64))
+
+
+def associate_faces(face_boxes, body_boxes, min_containment: float = 1.0,
+                    method: str = ASSIGN_HUNGARIAN) -> np.ndarray:
+    """
+    One-to-one assignment of faces to body boxes for a whole frame.
+
+    A pair is feasible when at least `min_containment` of the face lies inside
+    the body (1.0 = fully inside). Among feasible pairs, higher containment
+    wins, then the body whose top the face is closest to (heads sit at the top
+    of person boxes), so overlapping people in a crowd get their own faces.
+
+    Returns:
+      (N,) index of the assigned body box per face, -1 if unmatched
+    """
+    faces = np.asarray(face_boxes, dtype=np.float64).reshape(-1, 4)
+    bodies = np.asarray(body_boxes, dtype=np.float64).reshape(-1, 4)
+    matches = np.full(len(faces), -1, dtype=np.int64)
+    if len(faces) == 0 or len(bodies) == 0:
+        return matches
+
+    containment = containment_matrix(faces, bodies)
+    feasible = containment >= min_containment - 1e-9
+    if not feasible.any():
+        return matches
+
+    body_height = np.clip(bodies[:, 3] - bodies[:, 1], 1, None)
+    face_center_y = (faces[:, 1] + faces[:, 3]) / 2.0
+    head_offset = np.clip((face_center_y[:, None] - bodies[None, :, 1]) / body_height[None, :], 0, 1)
+    score = containment + HEAD_POSITION_WEIGHT * (1.0 - head_offset)
+
+    if method == ASSIGN_HUNGARIAN:
+        cost = np.where(feasible, -score, 1e6)
+        rows, cols = linear_sum_assignment(cost)
+        keep = feasible[rows, cols]
+        matches[rows[keep]] = cols[keep]
+    elif method == ASSIGN_GREEDY:
+        face_idx, body_idx = np.nonzero(feasible)
+        order = np.argsort(-score[face_idx, body_idx], kind='stable')
+        used_faces = np.zeros(len(faces), dtype=bool)
+        used_bodies = np.zeros(len(bodies), dtype=bool)
+        for f, b in zip(face_idx[order], body_idx[order]):
+            if not used_faces[f] and not used_bodies[b]:
+                matches[f] = b
+                used_faces[f] = used_bodies[b] = True
+    else:
+        raise ValueError(f"Unknown assignment method: {method}")
+
+    return matches
+
+
+def match_faces_to_tracks(faces, tracks, min_containment: float = 1.0,
+                          method: str = ASSIGN_HUNGARIAN) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Match detected faces to tracker output in one call.
+
+    Args:
+      faces: (N, >=4) face detections, x1, y1, x2, y2 first
+      tracks: (M, >=5) tracker output rows x1, y1, x2, y2, track_id, ...
+
+    Returns:
+      track_ids: (N,) matched track id per face, -1 if unmatched
+      body_boxes: (N, 4) int x1, y1, x2, y2 of the matched body, zeros if unmatched
+    """
+    face_boxes = np.asarray(faces).reshape(len(faces), -1)[:, :4].astype(int) if len(faces) else np.zeros((0, 4), int)
+    track_rows = np.asarray(tracks).reshape(len(tracks), -1) if len(tracks) else np.zeros((0, 5))
+    body_boxes = track_rows[:, :4].astype(int)
+    track_ids = track_rows[:, 4].astype(int)
+
+    matches = associate_faces(face_boxes, body_boxes, min_containment, method)
+    matched = matches >= 0
+
+    face_track_ids = np.full(len(face_boxes), -1, dtype=np.int64)
+    face_bodies = np.zeros((len(face_boxes), 4), dtype=int)
+    face_track_ids[matched] = track_ids[matches[matched]]
+    face_bodies[matched] = body_boxes[matches[matched]]
+    return face_track_ids, face_bodies
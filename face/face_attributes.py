@@ -0,0 +1,54 @@
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from face.face_preprocessing import get_preprocessor
+
+
+def crop_face(frame: np.ndarray, face_box, min_size: int = 10) -> Optional[np.ndarray]:
+    """Clip `face_box` (x1, y1, x2, y2) to the frame and return the crop, None if it is too small"""
+    height, width = frame.shape[:2]
+    x_face, y_face, x1_face, y1_face = (int(v) for v in face_box)
+    x_face = max(0, x_face)
+    y_face = max(0, y_face)
+    x1_face = min(width, x1_face)
+    y1_face = min(height, y1_face)
+
+    if x1_face - x_face <= min_size or y1_face - y_face <= min_size:
+        return None
+    return frame[y_face:y1_face, x_face:x1_face]
+
+
+def estimate_attributes(face_images: Sequence[np.ndarray], age_estimator=None, gender_estimator=None,
+                        emotion_estimator=None) -> List[Tuple[Optional[str], Optional[str], Optional[str]]]:
+    """
+    Age, gender and emotion for a batch of face crops (e.g. every new face of a frame).
+
+    The crops are preprocessed once for all models and every model runs once
+    per batch instead of once per face. Results are returned in input order;
+    an attribute is None if its model is missing or failed.
+    """
+    if not face_images:
+        return []
+
+    # Preprocess where the torch models run, so only uint8 crops are copied to the GPU
+    device = getattr(age_estimator or emotion_estimator, 'device', 'cpu')
+    batch = get_preprocessor(device)(
+        face_images,
+        age=age_estimator is not None,
+        gender=gender_estimator is not None,
+        emotion=emotion_estimator is not None
+    )
+
+    columns = []
+    for estimator, inputs in ((age_estimator, batch.age), (gender_estimator, batch.gender),
+                              (emotion_estimator, batch.emotion)):
+        values = [None] * len(face_images)
+        if estimator is not None:
+            try:
+                values = estimator.predict_tensor(inputs)
+            except Exception as e:
+                print(f"Error estimating {type(estimator).__name__} for {len(face_images)} faces: {e}")
+        columns.append(values)
+
+    return list(zip(*columns))
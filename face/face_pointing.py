@@ -1,31 +1,36 @@
 import numpy as np
-from face.model.retinaface.retinaface import RetinaFace
 import os
+from face.face_scale import ScalePolicy, ScaledFaceDetector, ScaleTimings
 # Инициализация детектора один раз, на GPU (gpuid=0)
 GPUID = 0
 MODEL_PATH = 'face/checkpoint/R50/R50'
 # MODEL_PATH = 'checkpoint/R50'
 path = os.path.join(os.getcwd(),MODEL_PATH)
-DETECTOR = RetinaFace(path,0, GPUID, 'net3')
+# FACE_DETECTOR_BACKEND=onnx: ONNX Runtime на CPU вместо MXNet (модель из face.model.retinaface.export_onnx).
+# Экспериментально: совпадение с MXNet (check_onnx_parity) ещё не подтверждено
+if os.getenv('FACE_DETECTOR_BACKEND', 'mxnet') == 'onnx':
+    from face.model.retinaface.retinaface_onnx import RetinaFaceOnnx
+    DETECTOR = RetinaFaceOnnx(os.getenv('FACE_DETECTOR_ONNX_PATH', path + '.onnx'), 'net3',
+                              intra_op_threads=int(os.getenv('FACE_DETECTOR_THREADS', 0)))
+else:
+    from face.model.retinaface.retinaface import RetinaFace
+    DETECTOR = RetinaFace(path,0, GPUID, 'net3')
+# Масштабы детектора (FACE_SCALE_*, FACE_MIN_FACE_SIZE), по умолчанию кадр в исходном разрешении
+SCALE_POLICY = ScalePolicy.from_env()
+# Время по масштабам печатается каждые FACE_SCALE_REPORT_EVERY кадров (0 - никогда)
+SCALE_TIMINGS = ScaleTimings(int(os.getenv('FACE_SCALE_REPORT_EVERY', 0)))
 
-def process_image(img, thresh=0.8, do_flip=False, image_out=False):
+def process_image(img, thresh=0.8, do_flip=False, image_out=False, policy=None, timings=None):
     """
     Обрабатывает изображение:
-      - вычисляет коэффициент масштабирования,
-      - детектирует лица с использованием GPU,
+      - выбирает масштабы по политике `policy` (по умолчанию SCALE_POLICY),
+      - детектирует лица, координаты возвращаются в системе исходного изображения,
       - (при необходимости) отрисовывает найденные прямоугольники и точки (landmarks).
+    Время детектора по каждому масштабу накапливается в `timings` (по умолчанию SCALE_TIMINGS).
     """
-    im_shape = img.shape
-    target_size, max_size = 1024, 1980
-    im_size_min = np.min(im_shape[0:2])
-    im_size_max = np.max(im_shape[0:2])
-    im_scale = float(target_size) / float(im_size_min)
-    if np.round(im_scale * im_size_max) > max_size:
-        im_scale = float(max_size) / float(im_size_max)
-    scales_list = [im_scale]
-
-    # Детектирование лиц с использованием заранее инициализированного DETECTOR (на GPU)
-    faces, landmarks = DETECTOR.detect(img, thresh, scales=[1.0], do_flip=do_flip)
+    # Детектирование лиц с использованием заранее инициализированного DETECTOR
+    detector = ScaledFaceDetector(DETECTOR, policy or SCALE_POLICY, timings or SCALE_TIMINGS)
+    faces, landmarks = detector.detect(img, thresh, do_flip=do_flip)
     if image_out:
         for i in range(faces.shape[0]):
             # Приведение координат к целым числам
@@ -40,6 +45,15 @@ def process_image(img, thresh=0.8, do_flip=False, image_out=False):
                     cv2.circle(img, (landmark5[l][0], landmark5[l][1]), 1, point_color, 2)
         return img, faces, landmarks
     return faces, landmarks
+
+
+def process_images(imgs, thresh=0.8, do_flip=False):
+    """
+    Детектирует лица сразу на нескольких изображениях (кадрах или ROI):
+    изображения собираются в батчи фиксированных размеров, по одному прямому проходу на батч.
+    Возвращает список (faces, landmarks) для каждого изображения.
+    """
+    return DETECTOR.detect_batch(imgs, thresh, do_flip=do_flip)
 import cv2
 import time
 
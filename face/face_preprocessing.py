@@ -0,0 +1,76 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Sequence
+
+import cv2
+import numpy as np
+import torch
+
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+# ITU-R 601-2 luma weights, same as PIL's Grayscale
+GRAY_WEIGHTS = (0.299, 0.587, 0.114)
+
+
+@dataclass
+class FaceBatch:
+    """Model inputs for a batch of face crops"""
+    age: Optional[torch.Tensor] = None  # (N, 3, 224, 224), ImageNet-normalized
+    gender: Optional[torch.Tensor] = None  # (N, 3, 224, 224), in [0, 1]
+    emotion: Optional[torch.Tensor] = None  # (N, 3, 64, 64), grayscale, ImageNet-normalized
+
+
+class FacePreprocessor:
+    """
+    Builds the inputs of every attribute model from uint8 face crops in one pass.
+
+    Each crop is resized once per target size with cv2; everything else
+    (scaling, normalization, grayscale) runs on the whole stacked batch on
+    `device`. Channels are used in the order they come in, like the PIL path did.
+    """
+
+    def __init__(self, device='cpu', size=224, emotion_size=64):
+        self.device = device
+        self.size = size
+        self.emotion_size = emotion_size
+        self.mean = torch.tensor(IMAGENET_MEAN, device=device).view(1, 3, 1, 1)
+        self.std = torch.tensor(IMAGENET_STD, device=device).view(1, 3, 1, 1)
+        self.gray = torch.tensor(GRAY_WEIGHTS, device=device).view(1, 3, 1, 1)
+
+    def __call__(self, crops: Sequence[np.ndarray], age=True, gender=True, emotion=True) -> FaceBatch:
+        batch = FaceBatch()
+        if len(crops) == 0:
+            return batch
+
+        if age or gender:
+            images = self._to_tensor(crops, self.size)
+            if gender:
+                batch.gender = images
+            if age:
+                batch.age = (images - self.mean) / self.std
+
+        if emotion:
+            images = self._to_tensor(crops, self.emotion_size)
+            gray = (images * self.gray).sum(dim=1, keepdim=True).expand(-1, 3, -1, -1)
+            batch.emotion = (gray - self.mean) / self.std
+
+        return batch
+
+    def _to_tensor(self, crops: Sequence[np.ndarray], size: int) -> torch.Tensor:
+        """Resize every crop to size x size and stack them into a float (N, 3, size, size) tensor in [0, 1]"""
+        resized = np.stack([
+            cv2.resize(
+                crop, (size, size),
+                interpolation=cv2.INTER_AREA if crop.shape[0] > size or crop.shape[1] > size else cv2.INTER_LINEAR
+            )
+            for crop in crops
+        ])
+        # Only the uint8 batch is copied to the device, the float conversion happens there
+        return torch.from_numpy(resized).to(self.device).permute(0, 3, 1, 2).float().div_(255.0)
+
+
+@lru_cache(maxsize=None)
+def get_preprocessor(device='cpu') -> FacePreprocessor:
+    """Shared preprocessor per device"""
+    return FacePreprocessor(device)
@@ -0,0 +1,115 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+# Frontal-face limits, unchanged from the former per-face is_face_frontal checks
+MAX_TILT_DEGREES = 20
+EYE_RATIO_RANGE = (0.25, 0.55)
+VERTICAL_RATIO_RANGE = (0.35, 0.75)
+MIN_NOSE_RATIO = 0.8
+
+# Faces of this side length (pixels) or larger get the full size score
+REFERENCE_FACE_SIZE = 112.0
+# Laplacian variance at which a crop counts as fully sharp
+REFERENCE_SHARPNESS = 100.0
+
+
+@dataclass
+class FaceQuality:
+    """Per-face quality of a frame's detections"""
+    frontal: np.ndarray  # (N,) bool, face is frontal enough for recognition
+    score: np.ndarray  # (N,) float in [0, 1], pose x size x sharpness
+    pose: np.ndarray  # (N,) float in [0, 1]
+    size: np.ndarray  # (N,) float in [0, 1]
+    sharpness: np.ndarray  # (N,) float in [0, 1], ones when no frame is given
+
+
+def _range_score(values: np.ndarray, low: float, high: float) -> np.ndarray:
+    """1 in the middle of (low, high), falling linearly to 0 at its ends"""
+    center, half_width = (low + high) / 2.0, (high - low) / 2.0
+    return np.clip(1.0 - np.abs(values - center) / half_width, 0.0, 1.0)
+
+
+def face_quality(face_boxes, landmarks, frame: Optional[np.ndarray] = None) -> FaceQuality:
+    """
+    Frontal flags and a continuous quality score for all faces of a frame at once.
+
+    Args:
+      face_boxes: (N, >=4) x1, y1, x2, y2
+      landmarks: (N, 5, 2) RetinaFace points: left eye, right eye, nose, left and right mouth corner
+      frame: image the boxes refer to; when given, sharpness (Laplacian variance) is part of the score
+
+    Returns:
+      FaceQuality with one entry per face
+    """
+    boxes = np.asarray(face_boxes, dtype=np.float64).reshape(len(face_boxes), -1)[:, :4] \
+        if len(face_boxes) else np.zeros((0, 4))
+    n = len(boxes)
+
+    width = boxes[:, 2] - boxes[:, 0]
+    height = boxes[:, 3] - boxes[:, 1]
+    size = np.clip(np.sqrt(np.clip(width * height, 0, None)) / REFERENCE_FACE_SIZE, 0.0, 1.0)
+    sharpness = _sharpness(frame, boxes) if frame is not None else np.ones(n)
+
+    if landmarks is None or len(landmarks) < n or n == 0:
+        zeros = np.zeros(n)
+        return FaceQuality(frontal=np.zeros(n, dtype=bool), score=zeros, pose=zeros, size=size, sharpness=sharpness)
+
+    lm = np.asarray(landmarks, dtype=np.float64)[:n].reshape(n, 5, 2)
+    left_eye, right_eye, nose, mouth_left, mouth_right = (lm[:, k] for k in range(5))
+    scale = (width + height) / 2.0
+
+    middle_eye = (left_eye + right_eye) / 2.0
+    middle_mouth = (mouth_left + mouth_right) / 2.0
+    eye_delta = right_eye - left_eye
+    mouth_delta = mouth_right - mouth_left
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        eye_ratio = np.linalg.norm(eye_delta, axis=1) / scale
+        vertical_ratio = np.linalg.norm(middle_mouth - middle_eye, axis=1) / scale
+        # Close to 1 for a frontal face, smaller when the face is tilted down
+        nose_ratio = np.linalg.norm(nose - middle_eye, axis=1) / np.linalg.norm(nose - middle_mouth, axis=1)
+
+    eye_angle = np.degrees(np.arctan2(eye_delta[:, 1], eye_delta[:, 0]))
+    mouth_angle = np.degrees(np.arctan2(mouth_delta[:, 1], mouth_delta[:, 0]))
+    tilt = np.maximum(np.abs(eye_angle), np.abs(mouth_angle))
+
+    frontal = (
+        (tilt <= MAX_TILT_DEGREES) &
+        (eye_ratio > EYE_RATIO_RANGE[0]) & (eye_ratio < EYE_RATIO_RANGE[1]) &
+        (vertical_ratio > VERTICAL_RATIO_RANGE[0]) & (vertical_ratio < VERTICAL_RATIO_RANGE[1]) &
+        (nose_ratio >= MIN_NOSE_RATIO)
+    )
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nose_symmetry = np.minimum(nose_ratio, 1.0 / nose_ratio)
+    pose = np.mean([
+        np.clip(1.0 - tilt / MAX_TILT_DEGREES, 0.0, 1.0),
+        _range_score(eye_ratio, *EYE_RATIO_RANGE),
+        _range_score(vertical_ratio, *VERTICAL_RATIO_RANGE),
+        np.clip((nose_symmetry - 0.5) / 0.5, 0.0, 1.0)
+    ], axis=0)
+    pose = np.nan_to_num(pose, nan=0.0)
+    frontal &= np.isfinite(eye_ratio) & np.isfinite(vertical_ratio) & np.isfinite(nose_ratio)
+
+    return FaceQuality(frontal=frontal, score=pose * size * sharpness, pose=pose, size=size, sharpness=sharpness)
+
+
+def is_face_frontal(face_box, lm) -> bool:
+    """Single-face shortcut for `face_quality(...).frontal`"""
+    return bool(face_quality([face_box], [lm]).frontal[0])
+
+
+def _sharpness(frame: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """Laplacian variance of every face crop, scaled to [0, 1]"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    height, width = gray.shape[:2]
+    sharpness = np.zeros(len(boxes))
+    for i, (x1, y1, x2, y2) in enumerate(boxes.astype(int)):
+        crop = gray[max(0, y1):min(height, y2), max(0, x1):min(width, x2)]
+        if crop.shape[0] > 2 and crop.shape[1] > 2:
+            sharpness[i] = cv2.Laplacian(crop, cv2.CV_64F).var()
+    return np.clip(sharpness / REFERENCE_SHARPNESS, 0.0, 1.0)
@@ -0,0 +1,173 @@
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+# Face detection modes: the whole frame, or only the upper bodies of tracked persons
+FULL_FRAME = 'full_frame'
+PERSON_ROI = 'person_roi'
+
+# Part of the person box, from its top, that holds the head and shoulders
+UPPER_BODY_FRACTION = 0.5
+# Margin around every region, as a fraction of the person box width, so faces on the edge are kept whole
+ROI_MARGIN = 0.1
+# Empty pixels between tiles so the detector never sees two regions as one face
+TILE_GAP = 32
+
+
+def upper_body_rois(body_boxes, frame_shape, upper_fraction: float = UPPER_BODY_FRACTION,
+                    margin: float = ROI_MARGIN) -> np.ndarray:
+    """
+    Head and shoulder regions of person boxes, overlapping regions merged into one.
+
+    Args:
+      body_boxes: (N, >=4) x1, y1, x2, y2, e.g. tracker output
+      frame_shape: shape of the frame the boxes refer to
+
+    Returns:
+      (R, 4) int x1, y1, x2, y2 regions inside the frame
+    """
+    height, width = frame_shape[:2]
+    boxes = np.asarray(body_boxes, dtype=np.float64).reshape(len(body_boxes), -1)[:, :4] \
+        if len(body_boxes) else np.zeros((0, 4))
+
+    pad = (boxes[:, 2] - boxes[:, 0]) * margin
+    rois = np.c_[
+        boxes[:, 0] - pad,
+        boxes[:, 1] - pad,
+        boxes[:, 2] + pad,
+        boxes[:, 1] + (boxes[:, 3] - boxes[:, 1]) * upper_fraction + pad
+    ]
+    rois = np.clip(np.round(rois), 0, [width, height, width, height]).astype(int)
+    rois = rois[(rois[:, 2] > rois[:, 0]) & (rois[:, 3] > rois[:, 1])]
+    return _merge_overlapping(rois)
+
+
+def _merge_overlapping(rois: np.ndarray) -> np.ndarray:
+    """Replace every group of overlapping regions with their bounding box, so no pixel is detected twice"""
+    rois = [roi for roi in rois]
+    merged = True
+    while merged and len(rois) > 1:
+        merged = False
+        for i in range(len(rois)):
+            for j in range(i + 1, len(rois)):
+                a, b = rois[i], rois[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    rois[i] = np.r_[np.minimum(a[:2], b[:2]), np.maximum(a[2:], b[2:])]
+                    del rois[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return np.asarray(rois, dtype=int).reshape(-1, 4)
+
+
+@dataclass
+class TileLayout:
+    """Where every region sits in the mosaic: region (x1, y1) is moved to tile (x1, y1)"""
+    rois: np.ndarray  # (R, 4) region in the frame
+    tiles: np.ndarray  # (R, 4) the same region in the mosaic
+    shape: Tuple[int, int]  # mosaic height, width
+
+
+def tile_layout(rois: np.ndarray, gap: int = TILE_GAP) -> TileLayout:
+    """
+    Pack regions into rows of a mosaic, tallest first, about as wide as it is high.
+    """
+    sizes = np.c_[rois[:, 2] - rois[:, 0], rois[:, 3] - rois[:, 1]]
+    row_width = max(int(sizes[:, 0].max()), int(np.sqrt(((sizes + gap).prod(axis=1)).sum())))
+
+    tiles = np.zeros_like(rois)
+    x = y = row_height = mosaic_width = 0
+    for i in np.argsort(-sizes[:, 1], kind='stable'):
+        w, h = sizes[i]
+        if x > 0 and x + w > row_width:
+            x, y, row_height = 0, y + row_height + gap, 0
+        tiles[i] = (x, y, x + w, y + h)
+        x += w + gap
+        row_height = max(row_height, h)
+        mosaic_width = max(mosaic_width, x - gap)
+    return TileLayout(rois=rois, tiles=tiles, shape=(y + row_height, mosaic_width))
+
+
+def build_mosaic(frame: np.ndarray, layout: TileLayout) -> np.ndarray:
+    """Copy every region of the frame into its tile, the gaps stay black"""
+    mosaic = np.zeros(layout.shape + frame.shape[2:], dtype=frame.dtype)
+    for (x1, y1, x2, y2), (tx1, ty1, tx2, ty2) in zip(layout.rois, layout.tiles):
+        mosaic[ty1:ty2, tx1:tx2] = frame[y1:y2, x1:x2]
+    return mosaic
+
+
+def map_to_frame(faces, landmarks, layout: TileLayout):
+    """
+    Move faces found in the mosaic back to frame coordinates.
+
+    A face belongs to the tile its center lies in and is clipped to it;
+    faces centered in a gap are dropped.
+    """
+    faces = np.asarray(faces, dtype=np.float32).reshape(len(faces), -1) if len(faces) else np.zeros((0, 5), np.float32)
+    centers = np.c_[(faces[:, 0] + faces[:, 2]) / 2, (faces[:, 1] + faces[:, 3]) / 2]
+    tiles = layout.tiles
+    inside = (
+        (centers[:, None, 0] >= tiles[None, :, 0]) & (centers[:, None, 0] < tiles[None, :, 2]) &
+        (centers[:, None, 1] >= tiles[None, :, 1]) & (centers[:, None, 1] < tiles[None, :, 3])
+    )
+    keep = inside.any(axis=1)
+    tile_index = inside.argmax(axis=1)[keep]
+
+    faces = faces[keep].copy()
+    own = tiles[tile_index]
+    faces[:, 0:4] = np.clip(faces[:, 0:4], own[:, [0, 1, 0, 1]], own[:, [2, 3, 2, 3]])
+    offset = (layout.rois[tile_index, :2] - own[:, :2]).astype(np.float32)
+    faces[:, 0:4] += np.tile(offset, 2)
+
+    if landmarks is not None:
+        landmarks = np.asarray(landmarks, dtype=np.float32)[keep] + offset[:, None, :]
+    return faces, landmarks
+
+
+class RoiFaceDetector:
+    """
+    Runs the face detector on the upper bodies of tracked persons instead of the whole frame.
+
+    All regions of a frame go through one forward pass as tiles of a single
+    mosaic. Every `full_frame_interval` frames (and on frames without tracks)
+    the whole frame is searched, so faces of people the tracker has not
+    confirmed yet are still found.
+    """
+
+    def __init__(self, detector, full_frame_interval: int = 30, upper_fraction: float = UPPER_BODY_FRACTION,
+                 margin: float = ROI_MARGIN, gap: int = TILE_GAP):
+        self.detector = detector
+        self.full_frame_interval = full_frame_interval
+        self.upper_fraction = upper_fraction
+        self.margin = margin
+        self.gap = gap
+
+    def full_frame_due(self, frame_id: Optional[int], trackers) -> bool:
+        if trackers is None or len(trackers) == 0 or frame_id is None:
+            return True
+        return self.full_frame_interval > 0 and frame_id % self.full_frame_interval == 0
+
+    def detect(self, frame: np.ndarray, trackers, frame_id: Optional[int] = None, thresh: float = 0.8,
+               do_flip: bool = False):
+        """
+        Args:
+          trackers: tracker output of this frame, (M, >=4) x1, y1, x2, y2 of confirmed tracks
+          frame_id: frame number, paces the full-frame fallback
+
+        Returns:
+          (faces, landmarks) in frame coordinates, as `detector.detect` returns them
+        """
+        # Full frames at the detector's own scales (see ScaledFaceDetector), the mosaic as it is
+        if self.full_frame_due(frame_id, trackers):
+            return self.detector.detect(frame, thresh, do_flip=do_flip)
+
+        rois = upper_body_rois(trackers, frame.shape, self.upper_fraction, self.margin)
+        if len(rois) == 0:
+            return self.detector.detect(frame, thresh, do_flip=do_flip)
+
+        layout = tile_layout(rois, self.gap)
+        faces, landmarks = self.detector.detect(build_mosaic(frame, layout), thresh, scales=[1.0], do_flip=do_flip)
+        return map_to_frame(faces, landmarks, layout)
@@ -0,0 +1,178 @@
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# Smallest face RetinaFace finds reliably, in detector input pixels (its smallest anchors, stride 8)
+MIN_DETECTABLE_FACE = 16
+
+
+@dataclass
+class ScalePolicy:
+    """
+    Input scales the face detector runs at for one camera.
+
+    The base scale brings the short side of the frame to `target_size` (0 keeps
+    the camera resolution), lowered further when `min_face`, the smallest face
+    expected at camera resolution, stays detectable after downscaling, and
+    capped so the long side stays within `max_size`. `pyramid` holds factors of
+    the base scale; levels run smallest first and with `early_exit` the pyramid
+    stops at the first level that finds no new face once faces were found.
+    """
+    target_size: int = 0
+    max_size: int = 0
+    pyramid: Tuple[float, ...] = (1.0,)
+    early_exit: bool = True
+    min_face: int = 0
+    min_detectable_face: int = MIN_DETECTABLE_FACE
+
+    def __post_init__(self):
+        self.pyramid = tuple(sorted({float(factor) for factor in self.pyramid})) or (1.0,)
+
+    @classmethod
+    def from_env(cls) -> 'ScalePolicy':
+        """Policy from the FACE_SCALE_* / FACE_MIN_FACE_SIZE environment variables, for scripts without settings"""
+        return cls(target_size=int(os.getenv('FACE_SCALE_TARGET_SIZE', 0)),
+                   max_size=int(os.getenv('FACE_SCALE_MAX_SIZE', 0)),
+                   pyramid=json.loads(os.getenv('FACE_SCALE_PYRAMID', '[1.0]')),
+                   early_exit=os.getenv('FACE_SCALE_EARLY_EXIT', 'true').lower() in ('1', 'true', 'yes'),
+                   min_face=int(os.getenv('FACE_MIN_FACE_SIZE', 0)))
+
+    def base_scale(self, frame_shape) -> float:
+        short_side, long_side = min(frame_shape[:2]), max(frame_shape[:2])
+        scale = float(self.target_size) / short_side if self.target_size > 0 else 1.0
+        if self.min_face > 0:
+            # Downscale only, faces smaller than the detector can see would be lost
+            scale = min(scale, 1.0, float(self.min_detectable_face) / self.min_face)
+        if self.max_size > 0 and np.round(scale * long_side) > self.max_size:
+            scale = float(self.max_size) / long_side
+        return scale
+
+    def scales(self, frame_shape) -> List[float]:
+        """Pyramid levels of a frame, smallest first"""
+        base = self.base_scale(frame_shape)
+        return [base * factor for factor in self.pyramid]
+
+
+@dataclass
+class _ScaleStats:
+    input_shape: Tuple[int, int] = (0, 0)
+    runs: int = 0
+    seconds: float = 0.0
+    faces: int = 0
+
+
+@dataclass
+class ScaleTimings:
+    """
+    Detector time and faces per input scale, accumulated over frames.
+
+    With `report_every` > 0 the table is logged (INFO, logger `face.face_scale`)
+    every that many frames, so a site can see what each pyramid level costs and
+    how often early exit skips it.
+    """
+    report_every: int = 0
+    name: str = 'faces'
+    frames: int = 0
+    stats: Dict[float, _ScaleStats] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, scale: float, input_shape, seconds: float, faces: int) -> None:
+        with self._lock:
+            stats = self.stats.setdefault(round(scale, 4), _ScaleStats())
+            stats.input_shape = tuple(input_shape)
+            stats.runs += 1
+            stats.seconds += seconds
+            stats.faces += faces
+
+    def frame_done(self) -> None:
+        with self._lock:
+            self.frames += 1
+            due = self.report_every > 0 and self.frames % self.report_every == 0
+        if due:
+            logger.info(self.report())
+
+    def report(self) -> str:
+        with self._lock:
+            lines = [f"{self.name} scale timings over {self.frames} frames:",
+                     f"{'scale':>7} {'input':>11} {'runs':>7} {'avg ms':>8} {'faces/run':>10}"]
+            for scale, stats in sorted(self.stats.items()):
+                height, width = stats.input_shape
+                lines.append(f"{scale:>7.3f} {f'{width}x{height}':>11} {stats.runs:>7} "
+                             f"{stats.seconds / stats.runs * 1000:>8.1f} {stats.faces / stats.runs:>10.2f}")
+        return '\n'.join(lines)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.frames = 0
+            self.stats.clear()
+
+
+class ScaledFaceDetector:
+    """
+    Runs a RetinaFace detector at the scales of a ScalePolicy.
+
+    The detector resizes the frame and maps faces back to frame coordinates
+    itself, so results are always in the coordinates of the frame passed in.
+    Faces of several pyramid levels are merged with the detector's NMS.
+    """
+
+    def __init__(self, detector, policy: Optional[ScalePolicy] = None, timings: Optional[ScaleTimings] = None):
+        self.detector = detector
+        self.policy = policy or ScalePolicy()
+        self.timings = timings
+
+    def _detect_at(self, frame: np.ndarray, thresh: float, scale: float, do_flip: bool):
+        start = time.perf_counter()
+        faces, landmarks = self.detector.detect(frame, thresh, scales=[scale], do_flip=do_flip)
+        if self.timings is not None:
+            input_shape = (int(round(frame.shape[0] * scale)), int(round(frame.shape[1] * scale)))
+            self.timings.record(scale, input_shape, time.perf_counter() - start, len(faces))
+        return faces, landmarks
+
+    def _merge(self, levels):
+        """Faces and landmarks of all levels, one face per NMS cluster"""
+        faces = np.concatenate([faces for faces, _ in levels]).astype(np.float32, copy=False)
+        landmarks = None if levels[0][1] is None else \
+            np.concatenate([landmarks for _, landmarks in levels]).astype(np.float32, copy=False)
+        if len(faces) == 0:
+            return faces, landmarks
+        order = np.argsort(-faces[:, 4], kind='stable')
+        keep = order[np.asarray(self.detector.nms(np.ascontiguousarray(faces[order])), dtype=int)]
+        return faces[keep], None if landmarks is None else landmarks[keep]
+
+    def detect(self, frame: np.ndarray, thresh: float = 0.8, scales: Optional[List[float]] = None,
+               do_flip: bool = False):
+        """
+        Args:
+          scales: explicit scales instead of the policy, e.g. for ROI mosaics already cropped to faces
+
+        Returns:
+          (faces, landmarks) in frame coordinates, as `detector.detect` returns them
+        """
+        scales = scales if scales is not None else self.policy.scales(frame.shape)
+        try:
+            if len(scales) == 1:
+                return self._detect_at(frame, thresh, scales[0], do_flip)
+
+            levels = []
+            found = 0
+            for scale in scales:
+                faces, landmarks = self._detect_at(frame, thresh, scale, do_flip)
+                levels.append((faces, landmarks))
+                merged = self._merge(levels)
+                if self.policy.early_exit and found and len(merged[0]) <= found:
+                    break
+                found = len(merged[0])
+            return merged
+        finally:
+            if self.timings is not None:
+                self.timings.frame_done()
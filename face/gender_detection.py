@@ -23,6 +23,10 @@ class GenderEstimator:
 
         # Получаем имя первого входного узла модели
         self.input_name = self.session.get_inputs()[0].name
+        # Модель, экспортированная с фиксированным батчем (число вместо имени оси),
+        # принимает ровно столько изображений за запуск, иначе батч динамический (None)
+        input_batch = self.session.get_inputs()[0].shape[0]
+        self.static_batch = input_batch if isinstance(input_batch, int) else None
         self.transform = transforms.Compose([
             transforms.Resize((224, 224)),     # нужный размер для вашей модели
             transforms.ToTensor(),             # (C, H, W), float32, 0–1
@@ -37,16 +41,41 @@ class GenderEstimator:
         # elif image_tensors.dim() != 4:
         #     raise ValueError("Преобразованное изображение имеет некорректное число размерностей")
          # Преобразует в тензор с dtype=float32, нормализует от 0 до 1
-        image_tensor = self.transform(image).unsqueeze(0)
-        image_np = image_tensor.numpy().astype(np.float32)
-        with torch.no_grad():
-            outputs = self.session.run(None, {self.input_name: image_np})
-        max_index = np.argmax(outputs)
-        print(max_index)
-        if max_index == 0:
-            return 'MAN'
-        else:
-            return "WOMAN"
+        if isinstance(image, list):
+            return self.predict_batch(image)
+        return self.predict_batch([image])[0]
+
+    def predict_batch(self, images, batch_size=64):
+        """
+        Определяет пол для списка лиц: один запуск сессии на каждые `batch_size` изображений.
+        Возвращает результаты в том же порядке, что и входные изображения.
+        """
+        genders = []
+        for start in range(0, len(images), batch_size):
+            image_tensor = torch.stack([self.transform(img) for img in images[start:start + batch_size]], dim=0)
+            genders.extend(self.predict_tensor(image_tensor, batch_size))
+        return genders
+
+    def predict_tensor(self, image_tensor, batch_size=64):
+        """
+        Определяет пол для уже подготовленного батча (N, 3, 224, 224) со значениями 0–1
+        (см. face.face_preprocessing.FacePreprocessor).
+        """
+        genders = []
+        image_np = image_tensor.detach().cpu().numpy().astype(np.float32)
+        if self.static_batch:
+            batch_size = self.static_batch
+        for start in range(0, image_np.shape[0], batch_size):
+            chunk = image_np[start:start + batch_size]
+            count = chunk.shape[0]
+            if self.static_batch and count < batch_size:
+                # Недостающие строки заполняются нулями, их результаты отбрасываются
+                padding = np.zeros((batch_size - count,) + chunk.shape[1:], dtype=np.float32)
+                chunk = np.concatenate([chunk, padding])
+            outputs = self.session.run(None, {self.input_name: chunk})
+            max_indexes = np.argmax(outputs[0][:count], axis=1)
+            genders.extend('MAN' if max_index == 0 else "WOMAN" for max_index in max_indexes)
+        return genders
 
 import numpy as np
 if __name__ == "__main__":
@@ -0,0 +1,109 @@
+"""
+Compare RetinaFaceOnnx against the MXNet RetinaFace on sample images.
+
+    python -m face.model.retinaface.check_onnx_parity --prefix face/checkpoint/R50/R50 --epoch 0 \
+        --onnx face/checkpoint/R50/R50.onnx --images face/images
+
+Faces are paired by IoU; the worst box, landmark and score differences per
+image are printed. Exits with 1 when a face is found by only one backend
+(unless its score is within --score-tol of the threshold) or a difference
+exceeds its tolerance.
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from .retinaface import RetinaFace
+from .retinaface_onnx import RetinaFaceOnnx
+
+
+def _iou(boxes, others):
+    """(N, M) IoU of x1, y1, x2, y2 boxes"""
+    top_left = np.maximum(boxes[:, None, :2], others[None, :, :2])
+    bottom_right = np.minimum(boxes[:, None, 2:4], others[None, :, 2:4])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area = np.prod(boxes[:, 2:4] - boxes[:, :2], axis=1)
+    other_area = np.prod(others[:, 2:4] - others[:, :2], axis=1)
+    return intersection / np.maximum(area[:, None] + other_area[None, :] - intersection, 1e-9)
+
+
+def compare(reference, candidate, threshold, score_tol, min_iou=0.5):
+    """
+    Pair the faces of two (faces, landmarks) results.
+
+    Returns:
+      dict with the count of paired faces, unexplained unpaired faces and the
+      max box, landmark and score differences of the pairs
+    """
+    (faces, landmarks), (other_faces, other_landmarks) = reference, candidate
+    result = {'paired': 0, 'missing': 0, 'box': 0.0, 'landmark': 0.0, 'score': 0.0}
+    paired = np.zeros(len(other_faces), dtype=bool)
+    overlap = _iou(faces, other_faces) if len(faces) and len(other_faces) else np.zeros((len(faces), len(other_faces)))
+    for i in np.argsort(-faces[:, 4]) if len(faces) else []:
+        candidates = np.where(paired, -1.0, overlap[i]) if len(other_faces) else np.zeros(0)
+        j = int(np.argmax(candidates)) if len(candidates) else -1
+        if j < 0 or candidates[j] < min_iou:
+            result['missing'] += int(faces[i, 4] >= threshold + score_tol)
+            continue
+        paired[j] = True
+        result['paired'] += 1
+        result['box'] = max(result['box'], float(np.abs(faces[i, :4] - other_faces[j, :4]).max()))
+        result['score'] = max(result['score'], float(abs(faces[i, 4] - other_faces[j, 4])))
+        if landmarks is not None and other_landmarks is not None:
+            result['landmark'] = max(result['landmark'], float(np.abs(landmarks[i] - other_landmarks[j]).max()))
+    result['missing'] += int((other_faces[~paired, 4] >= threshold + score_tol).sum()) if len(other_faces) else 0
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--prefix', default='face/checkpoint/R50/R50')
+    parser.add_argument('--epoch', type=int, default=0)
+    parser.add_argument('--onnx', default=None, help='defaults to <prefix>.onnx')
+    parser.add_argument('--network', default='net3')
+    parser.add_argument('--images', default='face/images')
+    parser.add_argument('--thresh', type=float, default=0.8)
+    parser.add_argument('--box-tol', type=float, default=1.0, help='pixels')
+    parser.add_argument('--landmark-tol', type=float, default=1.0, help='pixels')
+    parser.add_argument('--score-tol', type=float, default=0.01)
+    parser.add_argument('--threads', type=int, default=0, help='ONNX Runtime intra-op threads, 0 = all cores')
+    args = parser.parse_args()
+
+    reference = RetinaFace(args.prefix, args.epoch, -1, args.network)
+    candidate = RetinaFaceOnnx(args.onnx or args.prefix + '.onnx', args.network, intra_op_threads=args.threads)
+
+    failed = False
+    paths = sorted(os.path.join(args.images, name) for name in os.listdir(args.images)
+                   if name.lower().endswith(('.png', '.jpg', '.jpeg')))
+    print(f"{'image':<24} {'mxnet':>5} {'onnx':>5} {'missing':>7} {'box px':>7} {'lmk px':>7} {'score':>7} "
+          f"{'mxnet ms':>9} {'onnx ms':>8}")
+    for path in paths:
+        img = cv2.imread(path)
+        if img is None:
+            print(f"Warning: could not read {path}")
+            continue
+        start = time.perf_counter()
+        expected = reference.detect(img, args.thresh, scales=[1.0])
+        reference_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        actual = candidate.detect(img, args.thresh, scales=[1.0])
+        candidate_ms = (time.perf_counter() - start) * 1000
+
+        result = compare(expected, actual, args.thresh, args.score_tol)
+        ok = (result['missing'] == 0 and result['box'] <= args.box_tol and result['landmark'] <= args.landmark_tol
+              and result['score'] <= args.score_tol)
+        failed = failed or not ok
+        print(f"{os.path.basename(path):<24} {len(expected[0]):>5} {len(actual[0]):>5} {result['missing']:>7} "
+              f"{result['box']:>7.3f} {result['landmark']:>7.3f} {result['score']:>7.4f} "
+              f"{reference_ms:>9.1f} {candidate_ms:>8.1f}{'' if ok else '  FAIL'}")
+
+    print('parity FAILED' if failed else 'parity OK')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""
+Export a RetinaFace MXNet checkpoint (R50, mnet) to ONNX for RetinaFaceOnnx.
+
+    python -m face.model.retinaface.export_onnx --prefix face/checkpoint/R50/R50 --epoch 0 \
+        --output face/checkpoint/R50/R50.onnx
+
+Needs MXNet >= 1.9 and the `onnx` package. Batch, height and width of the
+input stay dynamic, so one file serves every frame size and detect_batch bucket.
+"""
+import argparse
+
+import numpy as np
+import mxnet as mx
+
+
+def export(prefix, epoch, output, opset=13):
+    sym, arg_params, aux_params = mx.model.load_checkpoint(prefix, epoch)
+    params = dict(arg_params)
+    params.update(aux_params)
+    mx.onnx.export_model(sym,
+                         params,
+                         in_shapes=[(1, 3, 640, 640)],
+                         in_types=[np.float32],
+                         onnx_file_path=output,
+                         opset_version=opset,
+                         dynamic=True,
+                         dynamic_input_shapes=[(None, 3, None, None)])
+    print('exported %s-%04d (%d outputs) to %s' % (prefix, epoch, len(sym), output))
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--prefix', default='face/checkpoint/R50/R50')
+    parser.add_argument('--epoch', type=int, default=0)
+    parser.add_argument('--output', default=None, help='defaults to <prefix>.onnx')
+    parser.add_argument('--opset', type=int, default=13)
+    args = parser.parse_args()
+    export(args.prefix, args.epoch, args.output or args.prefix + '.onnx', args.opset)
+
+
+if __name__ == '__main__':
+    main()
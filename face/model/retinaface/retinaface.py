@@ -3,9 +3,14 @@ import sys
 import os
 import datetime
 import time
+from collections import OrderedDict
 import numpy as np
-import mxnet as mx
-from mxnet import ndarray as nd
+try:
+    import mxnet as mx
+    from mxnet import ndarray as nd
+except ImportError:
+    # Only the ONNX Runtime backend (retinaface_onnx) works without MXNet
+    mx = nd = None
 import cv2
 #from rcnn import config
 from .rcnn.logger import logger
@@ -15,6 +20,11 @@ from .rcnn.processing.generate_anchor import generate_anchors_fpn, anchors_plane
 from .rcnn.processing.nms import gpu_nms_wrapper, cpu_nms_wrapper
 from .rcnn.processing.bbox_transform import bbox_overlaps
 
+# Batch sizes and padded sides (multiples of 32) detect_batch binds modules for
+BATCH_SIZES = (1, 2, 4, 8)
+SIDE_BUCKETS = (320, 480, 640, 800, 1088, 1280, 1920)
+
+
 class RetinaFace:
     def __init__(self,
                  prefix,
@@ -206,29 +216,56 @@ class RetinaFace:
         #self._bbox_pred = nonlinear_pred
         #self._landmark_pred = landmark_pred
 
-        sym, arg_params, aux_params = mx.model.load_checkpoint(prefix, epoch)
         if self.ctx_id >= 0:
-            self.ctx = mx.gpu(self.ctx_id)
             self.nms = gpu_nms_wrapper(self.nms_threshold, self.ctx_id)
         else:
-            self.ctx = mx.cpu()
             self.nms = cpu_nms_wrapper(self.nms_threshold)
         self.pixel_means = np.array(pixel_means, dtype=np.float32)
         self.pixel_stds = np.array(pixel_stds, dtype=np.float32)
         self.pixel_scale = float(pixel_scale)
         print('means', self.pixel_means)
+        # Normalization of the RGB input channels as one multiply-add: (x / scale - mean) / std
+        rgb_means, rgb_stds = self.pixel_means[::-1], self.pixel_stds[::-1]
+        self._input_gain = (1.0 / (self.pixel_scale * rgb_stds)).astype(
+            np.float32).reshape(3, 1, 1)
+        self._input_bias = (-rgb_means / rgb_stds).astype(np.float32).reshape(
+            3, 1, 1)
+        self._identity_input = bool(np.all(self._input_gain == 1.0)
+                                    and np.all(self._input_bias == 0.0))
+        # Input blobs reused per (H, W), like the bound module, detect is not thread-safe
+        self._input_blobs = OrderedDict()
+        self._max_input_blobs = 8
+        # Anchor planes per (H, W, stride) of the feature maps, they only depend on the input shape
+        self._anchor_planes = OrderedDict()
+        self._max_anchor_planes = 32
+        #self.bbox_stds = [0.1, 0.1, 0.2, 0.2]
+        #self.landmark_std = 0.1
+        self.bbox_stds = [1.0, 1.0, 1.0, 1.0]
+        self.landmark_std = 1.0
+
+        num_outputs = self._load_model(prefix, epoch)
         self.use_landmarks = False
-        if len(sym) // len(self._feat_stride_fpn) >= 3:
+        if num_outputs // len(self._feat_stride_fpn) >= 3:
             self.use_landmarks = True
         print('use_landmarks', self.use_landmarks)
         self.cascade = 0
-        if float(len(sym)) // len(self._feat_stride_fpn) > 3.0:
+        if float(num_outputs) // len(self._feat_stride_fpn) > 3.0:
             self.cascade = 1
         print('cascade', self.cascade)
-        #self.bbox_stds = [0.1, 0.1, 0.2, 0.2]
-        #self.landmark_std = 0.1
-        self.bbox_stds = [1.0, 1.0, 1.0, 1.0]
-        self.landmark_std = 1.0
+
+    def _load_model(self, prefix, epoch):
+        """
+        Load the MXNet checkpoint `prefix`-`epoch` and bind it.
+
+        Returns:
+          number of network outputs, which tells landmarks and cascade apart
+        """
+        sym, arg_params, aux_params = mx.model.load_checkpoint(prefix, epoch)
+        if self.ctx_id >= 0:
+            self.ctx = mx.gpu(self.ctx_id)
+        else:
+            self.ctx = mx.cpu()
+        num_outputs = len(sym)
 
         if self.debug:
             c = len(sym) // len(self._feat_stride_fpn)
@@ -244,21 +281,58 @@ class RetinaFace:
                                                image_size[1]))],
                         for_training=False)
         self.model.set_params(arg_params, aux_params)
+        self._symbol, self._arg_params, self._aux_params = sym, arg_params, aux_params
+        # Modules bound per (batch, H, W) bucket for detect_batch, sharing the weights of self.model
+        self._batch_modules = OrderedDict()
+        self._max_batch_modules = 4
+        return num_outputs
+
+    def _forward(self, blob, batched=False):
+        """
+        Run the network on the normalized (N, 3, H, W) float32 `blob`.
+
+        `batched` blobs come from detect_batch and go through the module bound
+        for their bucket.
+
+        Returns:
+          list of numpy outputs in symbol order
+        """
+        module = self._batch_module(blob.shape) if batched else self.model
+        data = nd.array(blob, dtype=np.float32)
+        module.forward(mx.io.DataBatch(data=(data, ),
+                                       provide_data=[('data', data.shape)]),
+                       is_train=False)
+        return [out.asnumpy() for out in module.get_outputs()]
+
+    def input_blob(self, im):
+        """
+        BGR image (uint8 or float, any strides) as the normalized float32 (1, 3, H, W) RGB blob.
+
+        The channel swap, HWC -> CHW transpose and dtype conversion are a
+        single strided copy into a buffer kept per input shape, followed by an
+        in-place multiply-add, so no intermediate image is allocated.
+        """
+        shape = im.shape[:2]
+        blob = self._input_blobs.pop(shape, None)
+        if blob is None:
+            blob = np.empty((1, 3) + shape, dtype=np.float32)
+            if len(self._input_blobs) >= self._max_input_blobs:
+                self._input_blobs.popitem(last=False)
+        self._input_blobs[shape] = blob
+        self._normalize_into(blob[0], im)
+        return blob
+
+    def _normalize_into(self, out, im):
+        """Write BGR `im` normalized into the (3, h, w) float32 RGB view `out`"""
+        if self._identity_input:
+            np.copyto(out, im[:, :, ::-1].transpose(2, 0, 1), casting='unsafe')
+        else:
+            np.multiply(im[:, :, ::-1].transpose(2, 0, 1), self._input_gain,
+                        out=out, casting='unsafe')
+            out += self._input_bias
 
     def get_input(self, img):
-        im = img.astype(np.float32)
-        im_tensor = np.zeros((1, 3, im.shape[0], im.shape[1]))
-        for i in range(3):
-            im_tensor[
-                0,
-                i, :, :] = (im[:, :, 2 - i] / self.pixel_scale -
-                            self.pixel_means[2 - i]) / self.pixel_stds[2 - i]
-        #if self.debug:
-        #  timeb = datetime.datetime.now()
-        #  diff = timeb - timea
-        #  print('X2 uses', diff.total_seconds(), 'seconds')
-        data = nd.array(im_tensor)
-        return data
+        return nd.array(self.input_blob(img), dtype=np.float32)
 
     def detect(self, img, threshold=0.5, scales=[1.0], do_flip=False):
         #print('in_detect', threshold, scales, do_flip, do_nms)
@@ -285,7 +359,8 @@ class RetinaFace:
                                         fy=im_scale,
                                         interpolation=cv2.INTER_LINEAR)
                     else:
-                        im = img.copy()
+                        # Only read below, a view is enough
+                        im = img
                     if flip:
                         im = im[:, ::-1, :]
                     if self.nocrop:
@@ -297,11 +372,9 @@ class RetinaFace:
                             w = im.shape[1]
                         else:
                             w = (im.shape[1] // 32 + 1) * 32
-                        _im = np.zeros((h, w, 3), dtype=np.float32)
+                        _im = np.zeros((h, w, 3), dtype=im.dtype)
                         _im[0:im.shape[0], 0:im.shape[1], :] = im
                         im = _im
-                    else:
-                        im = im.astype(np.float32)
                     if self.debug:
                         timeb = datetime.datetime.now()
                         diff = timeb - timea
@@ -309,242 +382,35 @@ class RetinaFace:
                     #self.model.bind(data_shapes=[('data', (1, 3, image_size[0], image_size[1]))], for_training=False)
                     #im_info = [im.shape[0], im.shape[1], im_scale]
                     im_info = [im.shape[0], im.shape[1]]
-                    im_tensor = np.zeros((1, 3, im.shape[0], im.shape[1]))
-                    for i in range(3):
-                        im_tensor[0, i, :, :] = (
-                            im[:, :, 2 - i] / self.pixel_scale -
-                            self.pixel_means[2 - i]) / self.pixel_stds[2 - i]
                     if self.debug:
                         timeb = datetime.datetime.now()
                         diff = timeb - timea
                         print('X2 uses', diff.total_seconds(), 'seconds')
-                    data = nd.array(im_tensor)
-                    db = mx.io.DataBatch(data=(data, ),
-                                         provide_data=[('data', data.shape)])
+                    blob = self.input_blob(im)
                     if self.debug:
                         timeb = datetime.datetime.now()
                         diff = timeb - timea
                         print('X3 uses', diff.total_seconds(), 'seconds')
-                    self.model.forward(db, is_train=False)
-                    net_out = self.model.get_outputs()
-
-
-                    #post_nms_topN = self._rpn_post_nms_top_n
-                    #min_size_dict = self._rpn_min_size_fpn
-
-                    sym_idx = 0
-
-                    for _idx, s in enumerate(self._feat_stride_fpn):
-                        #if len(scales)>1 and s==32 and im_scale==scales[-1]:
-                        #  continue
-                        _key = 'stride%s' % s
-                        stride = int(s)
-                        is_cascade = False
-                        if self.cascade:
-                            is_cascade = True
-                        #if self.vote and stride==4 and len(scales)>2 and (im_scale==scales[0]):
-                        #  continue
-                        #print('getting', im_scale, stride, idx, len(net_out), data.shape, file=sys.stderr)
-                        scores = net_out[sym_idx].asnumpy()
-                        if self.debug:
-                            timeb = datetime.datetime.now()
-                            diff = timeb - timea
-                            print('A uses', diff.total_seconds(), 'seconds')
-                        #print(scores.shape)
-                        #print('scores',stride, scores.shape, file=sys.stderr)
-                        scores = scores[:, self._num_anchors['stride%s' %
-                                                             s]:, :, :]
-
-                        bbox_deltas = net_out[sym_idx + 1].asnumpy()
-
-                        #if DEBUG:
-                        #    print 'im_size: ({}, {})'.format(im_info[0], im_info[1])
-                        #    print 'scale: {}'.format(im_info[2])
-
-                        #_height, _width = int(im_info[0] / stride), int(im_info[1] / stride)
-                        height, width = bbox_deltas.shape[
-                            2], bbox_deltas.shape[3]
-
-                        A = self._num_anchors['stride%s' % s]
-                        K = height * width
-                        anchors_fpn = self._anchors_fpn['stride%s' % s]
-                        anchors = anchors_plane(height, width, stride,
-                                                anchors_fpn)
-                        #print((height, width), (_height, _width), anchors.shape, bbox_deltas.shape, scores.shape, file=sys.stderr)
-                        anchors = anchors.reshape((K * A, 4))
-                        #print('num_anchors', self._num_anchors['stride%s'%s], file=sys.stderr)
-                        #print('HW', (height, width), file=sys.stderr)
-                        #print('anchors_fpn', anchors_fpn.shape, file=sys.stderr)
-                        #print('anchors', anchors.shape, file=sys.stderr)
-                        #print('bbox_deltas', bbox_deltas.shape, file=sys.stderr)
-                        #print('scores', scores.shape, file=sys.stderr)
-
-                        #scores = self._clip_pad(scores, (height, width))
-                        scores = scores.transpose((0, 2, 3, 1)).reshape(
-                            (-1, 1))
-
-                        #print('pre', bbox_deltas.shape, height, width)
-                        #bbox_deltas = self._clip_pad(bbox_deltas, (height, width))
-                        #print('after', bbox_deltas.shape, height, width)
-                        bbox_deltas = bbox_deltas.transpose((0, 2, 3, 1))
-                        bbox_pred_len = bbox_deltas.shape[3] // A
-                        #print(bbox_deltas.shape)
-                        bbox_deltas = bbox_deltas.reshape((-1, bbox_pred_len))
-                        bbox_deltas[:,
-                                    0::4] = bbox_deltas[:, 0::
-                                                        4] * self.bbox_stds[0]
-                        bbox_deltas[:,
-                                    1::4] = bbox_deltas[:, 1::
-                                                        4] * self.bbox_stds[1]
-                        bbox_deltas[:,
-                                    2::4] = bbox_deltas[:, 2::
-                                                        4] * self.bbox_stds[2]
-                        bbox_deltas[:,
-                                    3::4] = bbox_deltas[:, 3::
-                                                        4] * self.bbox_stds[3]
-                        proposals = self.bbox_pred(anchors, bbox_deltas)
-
-                        #print(anchors.shape, bbox_deltas.shape, A, K, file=sys.stderr)
-                        if is_cascade:
-                            print('cascad')
-                            cascade_sym_num = 0
-                            cls_cascade = False
-                            bbox_cascade = False
-                            __idx = [3, 4]
-                            if not self.use_landmarks:
-                                __idx = [2, 3]
-                            for diff_idx in __idx:
-                                if sym_idx + diff_idx >= len(net_out):
-                                    break
-                                body = net_out[sym_idx + diff_idx].asnumpy()
-                                if body.shape[1] // A == 2:  #cls branch
-                                    if cls_cascade or bbox_cascade:
-                                        break
-                                    else:
-                                        cascade_scores = body[:, self.
-                                                              _num_anchors[
-                                                                  'stride%s' %
-                                                                  s]:, :, :]
-                                        cascade_scores = cascade_scores.transpose(
-                                            (0, 2, 3, 1)).reshape((-1, 1))
-                                        #scores = (scores+cascade_scores)/2.0
-                                        scores = cascade_scores  #TODO?
-                                        cascade_sym_num += 1
-                                        cls_cascade = True
-                                        #print('find cascade cls at stride', stride)
-                                elif body.shape[1] // A == 4:  #bbox branch
-                                    cascade_deltas = body.transpose(
-                                        (0, 2, 3, 1)).reshape(
-                                            (-1, bbox_pred_len))
-                                    cascade_deltas[:, 0::
-                                                   4] = cascade_deltas[:, 0::
-                                                                       4] * self.bbox_stds[
-                                                                           0]
-                                    cascade_deltas[:, 1::
-                                                   4] = cascade_deltas[:, 1::
-                                                                       4] * self.bbox_stds[
-                                                                           1]
-                                    cascade_deltas[:, 2::
-                                                   4] = cascade_deltas[:, 2::
-                                                                       4] * self.bbox_stds[
-                                                                           2]
-                                    cascade_deltas[:, 3::
-                                                   4] = cascade_deltas[:, 3::
-                                                                       4] * self.bbox_stds[
-                                                                           3]
-                                    proposals = self.bbox_pred(
-                                        proposals, cascade_deltas)
-                                    cascade_sym_num += 1
-                                    bbox_cascade = True
-                                    #print('find cascade bbox at stride', stride)
-
-                        proposals = clip_boxes(proposals, im_info[:2])
-
-                        #if self.vote:
-                        #  if im_scale>1.0:
-                        #    keep = self._filter_boxes2(proposals, 160*im_scale, -1)
-                        #  else:
-                        #    keep = self._filter_boxes2(proposals, -1, 100*im_scale)
-                        #  if stride==4:
-                        #    keep = self._filter_boxes2(proposals, 12*im_scale, -1)
-                        #    proposals = proposals[keep, :]
-                        #    scores = scores[keep]
-
-                        #keep = self._filter_boxes(proposals, min_size_dict['stride%s'%s] * im_info[2])
-                        #proposals = proposals[keep, :]
-                        #scores = scores[keep]
-                        #print('333', proposals.shape)
-                        if stride == 4 and self.decay4 < 1.0:
-                            scores *= self.decay4
-
-                        scores_ravel = scores.ravel()
-                        #print('__shapes', proposals.shape, scores_ravel.shape)
-                        #print('max score', np.max(scores_ravel))
-                        order = np.where(scores_ravel >= threshold)[0]
-                        #_scores = scores_ravel[order]
-                        #_order = _scores.argsort()[::-1]
-                        #order = order[_order]
-                        proposals = proposals[order, :]
-                        scores = scores[order]
-                        if flip:
-                            oldx1 = proposals[:, 0].copy()
-                            oldx2 = proposals[:, 2].copy()
-                            proposals[:, 0] = im.shape[1] - oldx2 - 1
-                            proposals[:, 2] = im.shape[1] - oldx1 - 1
-
-                        proposals[:, 0:4] /= im_scale
-
-                        proposals_list.append(proposals)
-                        scores_list.append(scores)
-                        if self.nms_threshold < 0.0:
-                            _strides = np.empty(shape=(scores.shape),
-                                                dtype=np.float32)
-                            _strides.fill(stride)
-                            strides_list.append(_strides)
-
-                        if not self.vote and self.use_landmarks:
-                            landmark_deltas = net_out[sym_idx + 2].asnumpy()
-                            #landmark_deltas = self._clip_pad(landmark_deltas, (height, width))
-                            landmark_pred_len = landmark_deltas.shape[1] // A
-                            landmark_deltas = landmark_deltas.transpose(
-                                (0, 2, 3, 1)).reshape(
-                                    (-1, 5, landmark_pred_len // 5))
-                            landmark_deltas *= self.landmark_std
-                            #print(landmark_deltas.shape, landmark_deltas)
-                            landmarks = self.landmark_pred(
-                                anchors, landmark_deltas)
-                            landmarks = landmarks[order, :]
-
-                            if flip:
-                                landmarks[:, :,
-                                          0] = im.shape[1] - landmarks[:, :,
-                                                                       0] - 1
-                                #for a in range(5):
-                                #  oldx1 = landmarks[:, a].copy()
-                                #  landmarks[:,a] = im.shape[1] - oldx1 - 1
-                                order = [1, 0, 2, 4, 3]
-                                flandmarks = landmarks.copy()
-                                for idx, a in enumerate(order):
-                                    flandmarks[:, idx, :] = landmarks[:, a, :]
-                                    #flandmarks[:, idx*2] = landmarks[:,a*2]
-                                    #flandmarks[:, idx*2+1] = landmarks[:,a*2+1]
-                                landmarks = flandmarks
-                            landmarks[:, :, 0:2] /= im_scale
-                            #landmarks /= im_scale
-                            #landmarks = landmarks.reshape( (-1, landmark_pred_len) )
-                            landmarks_list.append(landmarks)
-                            #proposals = np.hstack((proposals, landmarks))
-                        if self.use_landmarks:
-                            sym_idx += 3
-                        else:
-                            sym_idx += 2
-                        if is_cascade:
-                            sym_idx += cascade_sym_num
+                    net_out = self._forward(blob)
+                    self._decode(net_out, im_info, im_scale, flip, threshold,
+                                 proposals_list, scores_list, landmarks_list,
+                                 strides_list)
 
         if self.debug:
             timeb = datetime.datetime.now()
             diff = timeb - timea
             print('B uses', diff.total_seconds(), 'seconds')
+        det, landmarks = self._postprocess(proposals_list, scores_list,
+                                           landmarks_list, strides_list)
+        if self.debug:
+            timeb = datetime.datetime.now()
+            diff = timeb - timea
+            print('C uses', diff.total_seconds(), 'seconds')
+        return det, landmarks
+
+    def _postprocess(self, proposals_list, scores_list, landmarks_list,
+                     strides_list):
+        """Sort the candidates of one image by score and suppress overlaps"""
         proposals = np.vstack(proposals_list)
         landmarks = None
         if proposals.shape[0] == 0:
@@ -589,13 +455,195 @@ class RetinaFace:
         else:
             det = np.hstack((proposals[:, 0:4], scores)).astype(np.float32,
                                                                 copy=False)
-
-        if self.debug:
-            timeb = datetime.datetime.now()
-            diff = timeb - timea
-            print('C uses', diff.total_seconds(), 'seconds')
         return det, landmarks
 
+    def _batch_module(self, shape):
+        """Module bound for the (batch, 3, H, W) bucket `shape`, the weights are shared"""
+        module = self._batch_modules.pop(shape, None)
+        if module is None:
+            module = mx.mod.Module(symbol=self._symbol,
+                                   context=self.ctx,
+                                   label_names=None)
+            module.bind(data_shapes=[('data', shape)],
+                        for_training=False,
+                        shared_module=self.model)
+            module.set_params(self._arg_params, self._aux_params)
+            if len(self._batch_modules) >= self._max_batch_modules:
+                self._batch_modules.popitem(last=False)
+        self._batch_modules[shape] = module
+        return module
+
+    @staticmethod
+    def _bucket(size, buckets):
+        for bucket in buckets:
+            if size <= bucket:
+                return bucket
+        return buckets[-1]
+
+    def detect_batch(self,
+                     imgs,
+                     threshold=0.5,
+                     do_flip=False,
+                     max_batch=BATCH_SIZES[-1],
+                     buckets=SIDE_BUCKETS):
+        """
+        Detect faces in several images (frames or ROIs) with one forward pass per batch.
+
+        Images are placed top-left into a zero-padded batch of a bucketed
+        shape: height and width are rounded up to the next of `buckets`, the
+        batch size to the next of BATCH_SIZES. Images larger than the largest
+        bucket are scaled down to fit it. Bound modules are cached per bucket,
+        so a stream of similar images does not rebind. With `do_flip` the
+        mirrored images go into the same batch.
+
+        Returns:
+          list of (faces, landmarks) per image, as `detect` returns them, in image coordinates
+        """
+        flips = [0, 1] if do_flip else [0]
+        # Images of the same bucket go into the same batches, so small ROIs are not padded to frame size
+        entries = sorted(((i, flip) for i in range(len(imgs)) for flip in flips),
+                         key=lambda entry: (self._bucket(imgs[entry[0]].shape[0], buckets),
+                                            self._bucket(imgs[entry[0]].shape[1], buckets)))
+        candidates = [([], [], [], []) for _ in imgs]
+        per_batch = min(max(1, max_batch), BATCH_SIZES[-1])
+        for start in range(0, len(entries), per_batch):
+            chunk = entries[start:start + per_batch]
+            height = self._bucket(max(imgs[i].shape[0] for i, _ in chunk), buckets)
+            width = self._bucket(max(imgs[i].shape[1] for i, _ in chunk), buckets)
+            batch = self._bucket(len(chunk), BATCH_SIZES)
+
+            blob_shape = (batch, 3, height, width)
+            blob = self._input_blobs.pop(blob_shape, None)
+            if blob is None:
+                blob = np.empty(blob_shape, dtype=np.float32)
+                if len(self._input_blobs) >= self._max_input_blobs:
+                    self._input_blobs.popitem(last=False)
+            self._input_blobs[blob_shape] = blob
+            # Padding is a black pixel after normalization, like nocrop padding in detect
+            blob[:] = self._input_bias[None] if not self._identity_input else 0.0
+
+            infos = []
+            for slot, (i, flip) in enumerate(chunk):
+                im = imgs[i]
+                im_scale = min(1.0, float(height) / im.shape[0],
+                               float(width) / im.shape[1])
+                if im_scale != 1.0:
+                    im = cv2.resize(im,
+                                    None,
+                                    None,
+                                    fx=im_scale,
+                                    fy=im_scale,
+                                    interpolation=cv2.INTER_LINEAR)
+                    im = im[:height, :width]
+                if flip:
+                    im = im[:, ::-1, :]
+                self._normalize_into(blob[slot, :, :im.shape[0], :im.shape[1]], im)
+                infos.append(([im.shape[0], im.shape[1]], im_scale))
+
+            net_out = self._forward(blob, batched=True)
+
+            for slot, ((i, flip), (im_info, im_scale)) in enumerate(zip(chunk, infos)):
+                # Anchors of the padded area are clipped to the image like any other
+                self._decode([out[slot:slot + 1] for out in net_out], im_info,
+                             im_scale, flip, threshold, *candidates[i])
+
+        return [self._postprocess(*lists) for lists in candidates]
+
+    def _anchor_plane(self, height, width, stride):
+        """(height * width * A, 4) anchors of one stride, cached per feature map size"""
+        key = (height, width, stride)
+        anchors = self._anchor_planes.pop(key, None)
+        if anchors is None:
+            anchors = anchors_plane(height, width, stride,
+                                    self._anchors_fpn['stride%s' % stride])
+            anchors = anchors.reshape((-1, 4))
+            if len(self._anchor_planes) >= self._max_anchor_planes:
+                self._anchor_planes.popitem(last=False)
+        self._anchor_planes[key] = anchors
+        return anchors
+
+    def _decode(self, net_out, im_info, im_scale, flip, threshold,
+                proposals_list, scores_list, landmarks_list, strides_list):
+        """
+        Append the faces of one image, in original image coordinates, to the lists of `detect`.
+
+        `net_out` are the numpy outputs of a batch of one. Scores are
+        thresholded first, so boxes and landmarks are only decoded for the
+        anchors that pass, not for the whole feature map.
+        """
+        bbox_stds = np.asarray(self.bbox_stds, dtype=np.float32)
+        sym_idx = 0
+        for s in self._feat_stride_fpn:
+            stride = int(s)
+            A = self._num_anchors['stride%s' % s]
+            scores = net_out[sym_idx][:, A:, :, :]
+            bbox_deltas = net_out[sym_idx + 1]
+            height, width = bbox_deltas.shape[2], bbox_deltas.shape[3]
+            bbox_pred_len = bbox_deltas.shape[1] // A
+            sym_step = 3 if self.use_landmarks else 2
+
+            # Cascade branches: a cls branch replaces the scores, bbox branches refine the proposals
+            cascade_deltas = []
+            if self.cascade:
+                cls_cascade = False
+                for diff_idx in ([3, 4] if self.use_landmarks else [2, 3]):
+                    if sym_idx + diff_idx >= len(net_out):
+                        break
+                    body = net_out[sym_idx + diff_idx]
+                    if body.shape[1] // A == 2:
+                        if cls_cascade or cascade_deltas:
+                            break
+                        scores = body[:, A:, :, :]
+                        cls_cascade = True
+                        sym_step += 1
+                    elif body.shape[1] // A == 4:
+                        cascade_deltas.append(body)
+                        sym_step += 1
+
+            scores = scores.transpose((0, 2, 3, 1)).reshape((-1, 1))
+            if stride == 4 and self.decay4 < 1.0:
+                scores = scores * self.decay4
+            order = np.where(scores.ravel() >= threshold)[0]
+            scores = scores[order]
+            anchors = self._anchor_plane(height, width, stride)[order]
+
+            bbox_tile = np.tile(bbox_stds, bbox_pred_len // 4)
+            deltas = bbox_deltas.transpose((0, 2, 3, 1)).reshape(
+                (-1, bbox_pred_len))[order] * bbox_tile
+            proposals = self.bbox_pred(anchors, deltas)
+            for body in cascade_deltas:
+                deltas = body.transpose((0, 2, 3, 1)).reshape(
+                    (-1, bbox_pred_len))[order] * bbox_tile
+                proposals = self.bbox_pred(proposals, deltas)
+            proposals = clip_boxes(proposals, im_info[:2])
+
+            if flip:
+                oldx1 = proposals[:, 0].copy()
+                oldx2 = proposals[:, 2].copy()
+                proposals[:, 0] = im_info[1] - oldx2 - 1
+                proposals[:, 2] = im_info[1] - oldx1 - 1
+            proposals[:, 0:4] /= im_scale
+
+            proposals_list.append(proposals)
+            scores_list.append(scores)
+            if self.nms_threshold < 0.0:
+                strides_list.append(np.full(scores.shape, stride, dtype=np.float32))
+
+            if not self.vote and self.use_landmarks:
+                landmark_deltas = net_out[sym_idx + 2]
+                landmark_pred_len = landmark_deltas.shape[1] // A
+                landmark_deltas = landmark_deltas.transpose((0, 2, 3, 1)).reshape(
+                    (-1, 5, landmark_pred_len // 5))[order] * self.landmark_std
+                landmarks = self.landmark_pred(anchors, landmark_deltas)
+                if flip:
+                    landmarks[:, :, 0] = im_info[1] - landmarks[:, :, 0] - 1
+                    # Left and right eye and mouth corner swap sides
+                    landmarks = landmarks[:, [1, 0, 2, 4, 3], :]
+                landmarks[:, :, 0:2] /= im_scale
+                landmarks_list.append(landmarks)
+
+            sym_idx += sym_step
+
     def detect_center(self, img, threshold=0.5, scales=[1.0], do_flip=False):
         det, landmarks = self.detect(img, threshold, scales, do_flip)
         if det.shape[0] == 0:
@@ -738,7 +786,7 @@ class RetinaFace:
         if boxes.shape[0] == 0:
             return np.zeros((0, box_deltas.shape[1]))
 
-        boxes = boxes.astype(np.float, copy=False)
+        boxes = boxes.astype(np.float64, copy=False)
         widths = boxes[:, 2] - boxes[:, 0] + 1.0
         heights = boxes[:, 3] - boxes[:, 1] + 1.0
         ctr_x = boxes[:, 0] + 0.5 * (widths - 1.0)
@@ -772,16 +820,17 @@ class RetinaFace:
     @staticmethod
     def landmark_pred(boxes, landmark_deltas):
         if boxes.shape[0] == 0:
-            return np.zeros((0, landmark_deltas.shape[1]))
-        boxes = boxes.astype(np.float, copy=False)
+            return np.zeros((0, ) + landmark_deltas.shape[1:],
+                            dtype=landmark_deltas.dtype)
+        boxes = boxes.astype(np.float64, copy=False)
         widths = boxes[:, 2] - boxes[:, 0] + 1.0
         heights = boxes[:, 3] - boxes[:, 1] + 1.0
         ctr_x = boxes[:, 0] + 0.5 * (widths - 1.0)
         ctr_y = boxes[:, 1] + 0.5 * (heights - 1.0)
+        # Like the original, columns past x and y keep their deltas
         pred = landmark_deltas.copy()
-        for i in range(5):
-            pred[:, i, 0] = landmark_deltas[:, i, 0] * widths + ctr_x
-            pred[:, i, 1] = landmark_deltas[:, i, 1] * heights + ctr_y
+        pred[:, :, 0] = landmark_deltas[:, :, 0] * widths[:, None] + ctr_x[:, None]
+        pred[:, :, 1] = landmark_deltas[:, :, 1] * heights[:, None] + ctr_y[:, None]
         return pred
         #preds = []
         #for i in range(landmark_deltas.shape[1]):
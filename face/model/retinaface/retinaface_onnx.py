@@ -0,0 +1,54 @@
+from __future__ import print_function
+import onnxruntime as ort
+
+from .retinaface import RetinaFace
+
+
+class RetinaFaceOnnx(RetinaFace):
+    """
+    RetinaFace running an exported model (see export_onnx) on the ONNX Runtime CPU provider.
+
+    Preprocessing, anchor decode and NMS are the ones of RetinaFace, only the
+    forward pass differs, so `detect` and `detect_batch` are drop-in.
+    `intra_op_threads` = 0 lets ONNX Runtime use one thread per physical
+    core; lower it when several detectors share a node.
+    """
+
+    def __init__(self,
+                 model_path,
+                 network='net3',
+                 nms=0.4,
+                 nocrop=False,
+                 decay4=0.5,
+                 vote=False,
+                 intra_op_threads=0,
+                 inter_op_threads=1):
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        # ctx_id -1: CPU NMS
+        super(RetinaFaceOnnx, self).__init__(model_path,
+                                             None,
+                                             ctx_id=-1,
+                                             network=network,
+                                             nms=nms,
+                                             nocrop=nocrop,
+                                             decay4=decay4,
+                                             vote=vote)
+
+    def _load_model(self, prefix, epoch):
+        sess_options = ort.SessionOptions()
+        sess_options.log_severity_level = 3
+        sess_options.intra_op_num_threads = self.intra_op_threads
+        sess_options.inter_op_num_threads = self.inter_op_threads
+        sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(prefix,
+                                            sess_options=sess_options,
+                                            providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        print('onnx outputs:', len(self.session.get_outputs()))
+        return len(self.session.get_outputs())
+
+    def _forward(self, blob, batched=False):
+        # The exported input has dynamic batch, height and width, so every bucket runs in the same session
+        return self.session.run(None, {self.input_name: blob})
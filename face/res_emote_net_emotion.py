@@ -19,7 +19,6 @@ class EmotionEstimator:
         self.transform = transforms.Compose([
             transforms.Resize((64, 64)),
             transforms.Grayscale(num_output_channels=3),
-            transforms.RandomHorizontalFlip(),
             transforms.ToTensor(),
             transforms.Normalize(
                 mean=[0.485, 0.456, 0.406],
@@ -45,18 +44,33 @@ class EmotionEstimator:
         Позволяет вызывать экземпляр класса как функцию.
         Поддерживает одиночное изображение или список изображений.
         """
-        image_tensors = self.transform(image).to(self.device)
-        # image_tensors = torch.stack(image_tensors, dim=0).to(self.device)
-        if image_tensors.dim() == 3:
-            image_tensors = image_tensors.unsqueeze(0)
-        else:
-            raise ValueError("Преобразованное изображение имеет некорректное число размерностей")
+        if isinstance(image, list):
+            return self.predict_batch(image)
+        return self.predict_batch([image])[0]
 
-        with torch.no_grad():
-            output = self.model(image_tensors)
-        _, predicted = torch.max(output.data, 1)
-        pre = self.emotions[predicted]
-        return pre
+    def predict_batch(self, images, batch_size=64):
+        """
+        Распознаёт эмоции для списка лиц: один прямой проход на каждые `batch_size` изображений.
+        Возвращает результаты в том же порядке, что и входные изображения.
+        """
+        emotions = []
+        for start in range(0, len(images), batch_size):
+            image_tensors = torch.stack([self.transform(img) for img in images[start:start + batch_size]], dim=0)
+            emotions.extend(self.predict_tensor(image_tensors, batch_size))
+        return emotions
+
+    def predict_tensor(self, image_tensors, batch_size=64):
+        """
+        Распознаёт эмоции для уже подготовленного батча (N, 3, 64, 64) в оттенках серого,
+        нормализованного по ImageNet (см. face.face_preprocessing.FacePreprocessor).
+        """
+        emotions = []
+        for start in range(0, image_tensors.shape[0], batch_size):
+            with torch.no_grad():
+                output = self.model(image_tensors[start:start + batch_size].to(self.device))
+            _, predicted = torch.max(output.data, 1)
+            emotions.extend(self.emotions[index] for index in predicted.tolist())
+        return emotions
 
 import numpy as np
 if __name__ == "__main__":
@@ -9,10 +9,19 @@ import cv2
 import numpy as np
 import math
 from face.age_resnet_50 import AgeEstimator
-from face.face_pointing import process_image
+from face.face_pointing import DETECTOR, SCALE_POLICY
+from face.face_roi import RoiFaceDetector, FULL_FRAME, PERSON_ROI
+from face.face_scale import ScaledFaceDetector, ScaleTimings
+from face.face_attributes import crop_face, estimate_attributes
+from face.attribute_scheduler import AttributeScheduler, TrackAttributes
+from face.face_association import match_faces_to_tracks
+from face.face_quality import face_quality
+from ship.core.pipeline import Pipeline, Stage
 from face.gender_detection import GenderEstimator
 from face.res_emote_net_emotion import EmotionEstimator
 from db_manager import DatabaseManager
+from containers.object_detection.tasks.object_routing_task import ObjectSnapshot, tracked_mask, xywh_to_xyxy
+from containers.tracking.repositories.track_state_repository import TrackStateRepository
 from ultralytics import RTDETR
 
 # Initialize all models
@@ -21,7 +30,7 @@ gender_estimator = GenderEstimator()
 emotion_estimator = EmotionEstimator()
 
 from logging import warning as log_warning
-from tracking.strong_sort import StrongSORT
+from tracking.tracker_factory import create_tracker, STRONG_SORT
 
 # Константы для типов людей
 PERSON_TYPE_CUSTOMER = 'customer'
@@ -47,27 +56,36 @@ class FaceProcessor:
     Enhanced class for face detection, tracking, recognition, and analysis
     """
 
-    def __init__(self, db_manager, recognition_attempts=3, data_path=None):
+    def __init__(self, db_manager, recognition_attempts=3, data_path=None, attribute_scheduler=None,
+                 min_face_quality=0.0, tracker_type=STRONG_SORT, object_snapshot=None,
+                 face_detection_mode=FULL_FRAME, roi_full_frame_interval=30, scale_policy=None,
+                 scale_report_every=0):
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
         print("Using Device:", self.device)
-        self.tracker = StrongSORT(
-            model_weights='tracking/weights/osnet_ain_x1_0_msmt17.pt',
-            device=self.device,
-            fp16=False,
-            max_dist=0.2,
-            max_iou_distance=0.7,
-            max_age=70,
-            n_init=3,
-            nn_budget=100,
-            mc_lambda=0.9,
-            ema_alpha=0.9
-        )
+        # 'bytetrack' tracks by motion only and needs no ReID network
+        self.tracker = create_tracker(tracker_type, device=self.device)
         self.db_manager = db_manager
         self.frame_count = 0
         self.recognition_attempts = recognition_attempts
         self.data_path = data_path
         self.model = RTDETR('weights/rtdetr-x.pt')
-        self.track_metadata = {}
+
+        # Per-track identity and attributes live in memory, the database is only written through.
+        # After a restart new tracks are numbered after the persisted ones instead of reusing their ids
+        self.track_states = TrackStateRepository(self.db_manager)
+        self.tracker.resume_ids(self.track_states.last_track_id())
+        # Age/gender/emotion are sampled a bounded number of times per track instead of per face per frame
+        self.attribute_scheduler = attribute_scheduler or AttributeScheduler()
+        # Frontal faces scoring below this are not used for recognition or attribute sampling
+        self.min_face_quality = min_face_quality
+        # Non-person objects are stored every few frames or when they change, not on every frame
+        self.object_snapshot = object_snapshot or ObjectSnapshot()
+        # Face detector scales of this camera (target resolution, pyramid, min face size), timed per scale
+        self.scale_timings = ScaleTimings(scale_report_every)
+        self.face_detector = ScaledFaceDetector(DETECTOR, scale_policy or SCALE_POLICY, self.scale_timings)
+        # 'person_roi' looks for faces only on the upper bodies of tracked persons, with a full frame every few frames
+        self.roi_detector = RoiFaceDetector(self.face_detector, roi_full_frame_interval) \
+            if face_detection_mode == PERSON_ROI else None
 
         # Load known faces from database
         self.known_faces = self.db_manager.get_known_faces()
@@ -80,68 +98,6 @@ class FaceProcessor:
         else:
             print("No data path specified for known faces directories")
 
-    def is_face_frontal(self, face_box, lm):
-        """
-        Checks if face is frontal using bounding box and 5 key points.
-
-        Args:
-          face_box: (x_face, y_face, x1_face, y1_face)
-          lm: landmarks array size (5,2): [left eye, right eye, nose, left mouth corner, right mouth corner]
-
-        Returns:
-          True if face is suitable for recognition (adequate scale and orientation),
-          otherwise False.
-        """
-        # Extract bounding box coordinates
-        x_face, y_face, x1_face, y1_face = face_box
-        face_width = x1_face - x_face
-        face_height = y1_face - y_face
-        scale = (face_width + face_height) / 2.0
-
-        # Extract landmark points
-        left_eye, right_eye = np.array(lm[0]), np.array(lm[1])
-        nose = np.array(lm[2])
-        mouth_left, mouth_right = np.array(lm[3]), np.array(lm[4])
-
-        # Distances between key points
-        eye_distance = np.linalg.norm(left_eye - right_eye)
-        middle_eye = (left_eye + right_eye) / 2.0
-        middle_mouth = (mouth_left + mouth_right) / 2.0
-        face_vertical = np.linalg.norm(middle_mouth - middle_eye)
-
-        # Calculate angles relative to horizontal
-        def angle_between(p1, p2):
-            return math.degrees(math.atan2(p2[1] - p1[1], p2[0] - p1[0]))
-
-        eye_angle = angle_between(left_eye, right_eye)
-        mouth_angle = angle_between(mouth_left, mouth_right)
-
-        # Relative proportions, adapted by scale
-        eye_ratio = eye_distance / scale
-        vertical_ratio = face_vertical / scale
-
-        # New criterion: ratio of distances from nose to middle point of eyes and to middle point of mouth
-        nose_to_eyes = np.linalg.norm(nose - middle_eye)
-        nose_to_mouth = np.linalg.norm(nose - middle_mouth)
-        nose_ratio = nose_to_eyes / nose_to_mouth  # for a frontal face usually close to 1
-
-        # Check tilt angles: if eyes or mouth are tilted more than 20°, face is probably not frontal
-        if abs(eye_angle) > 20 or abs(mouth_angle) > 20:
-            return False
-
-        # Check proportions relative to scale
-        if not (0.25 < eye_ratio < 0.55):
-            return False
-        if not (0.35 < vertical_ratio < 0.75):
-            return False
-
-        # Additional check: if face is tilted down, nose will be closer to mouth
-        # For strictly frontal face nose_ratio should not be too small
-        if nose_ratio < 0.8:
-            return False
-
-        return True
-
     def recognize_face(self, frame, face_location):
         """
         Recognize face and determine if it's a customer, waiter or celebrity.
@@ -170,61 +126,60 @@ class FaceProcessor:
         Perform comprehensive face analysis: age, gender, emotion
         Only perform analysis if not already done for this track_id
         """
-        # Check if we already have metadata for this track_id
-        try:
-            x_face, y_face, x1_face, y1_face = face_box
-
-            # Ensure coordinates are within frame boundaries
-            height, width = frame.shape[:2]
-            x_face = max(0, x_face)
-            y_face = max(0, y_face)
-            x1_face = min(width, x1_face)
-            y1_face = min(height, y1_face)
-
-            # Skip if face region is too small
-            if x1_face - x_face <= 10 or y1_face - y_face <= 10:
-                print(f"Face region too small for track {track_id}: {face_box}")
-                return None, None, None
+        return self.analyze_faces(frame, [face_box], [track_id])[0]
 
-            # Extract face region for analysis
-            face_img = frame[y_face:y1_face, x_face:x1_face]
-
-            # Ensure face image is not empty
-            if face_img.size == 0 or face_img.shape[0] == 0 or face_img.shape[1] == 0:
-                print(f"Empty face image for track {track_id}: {face_box}")
-                return None, None, None
-
-            face_img = Image.fromarray(face_img)
-
-            # Estimate age
-            age = age_estimator(face_img)
-
-            # Estimate gender
-            gender = gender_estimator(face_img)
+    def analyze_faces(self, frame, face_boxes, track_ids):
+        """
+        Age, gender and emotion for several faces of a frame, one forward pass per model.
 
-            # Estimate emotion
-            emotion = emotion_estimator(face_img)
+        Returns:
+          (age, gender, emotion) per face in input order, (None, None, None) for unusable crops
+        """
+        results = [(None, None, None)] * len(face_boxes)
+        face_images, indexes = [], []
+        for i, (face_box, track_id) in enumerate(zip(face_boxes, track_ids)):
+            face_img = crop_face(frame, face_box)
+            if face_img is None:
+                print(f"Face region too small for track {track_id}: {face_box}")
+                continue
+            face_images.append(face_img)
+            indexes.append(i)
 
-            return age, gender, emotion
-        except Exception as e:
-            print(f"Error analyzing face for track {track_id}: {e}")
-            return None, None, None
+        attributes = estimate_attributes(face_images, age_estimator, gender_estimator, emotion_estimator)
+        for i, face_attributes in zip(indexes, attributes):
+            results[i] = face_attributes
+        return results
 
-    def process_frame(self, frame):
+    def process_frame(self, frame, timestamp=None):
         """
         Process a video frame for face detection, tracking, and analysis
 
+        The stages run one after another here; `run_pipeline` runs the same
+        stages concurrently on consecutive frames.
+
         Args:
             frame: Video frame to process
-
-        Returns:
-            Modified frame if output=True, original frame if output=False
+            timestamp: Capture time of the frame, paces emotion sampling (wall clock if None)
         """
+        persons, objects = self.route(self.detect(frame))
+        frame_id, trackers, deleted_track_ids = self.track(frame, persons)
+        if trackers is None:
+            # Tracks can still expire on a frame without persons
+            self.track_states.evict(deleted_track_ids)
+            self.save(frame_id, objects, [])
+            return None
 
-        # Increment frame counter
-        self.frame_count += 1
+        faces, landmarks, quality = self.detect_faces(frame, trackers, frame_id)
+        rows = self.analyze(frame, frame_id, trackers, deleted_track_ids, faces, landmarks, quality, timestamp)
+        self.save(frame_id, objects, rows)
+
+    def detect(self, frame):
+        """
+        Object detection stage
 
-        # Get tracking information
+        Returns:
+            (bbox xywh, conf, class_id) arrays, None if the frame has nothing to track
+        """
         if frame is None or not isinstance(frame, np.ndarray) or frame.size == 0:
             log_warning("Frame is empty or invalid")
             return None
@@ -246,41 +201,89 @@ class FaceProcessor:
             log_warning("No valid detections found")
             return None
 
-        for i, box in enumerate(bbox):
-            x1, y1, w1, h1 = box
-            # bbox[i] = [x, y, x + w, y + h]
-            # x1, y1, w1, h1 = map(int, [x1, y1, w1, h1])
+        return bbox, conf, class_id
+
+    def route(self, detections):
+        """
+        Routing stage: only persons are tracked and matched to faces, so ReID never sees furniture
+
+        Returns:
+            (persons, objects) in the `detect` format, persons None if there are none
+        """
+        if detections is None:
+            return None, None
+
+        bbox, conf, class_id = detections
+        persons = tracked_mask(class_id)
+        objects = bbox[~persons], conf[~persons], class_id[~persons]
+        if not persons.any():
+            return None, objects
+        return (bbox[persons], conf[persons], class_id[persons]), objects
+
+    def track(self, frame, detections):
+        """
+        Tracking stage, frames must come in order
 
-            self.db_manager.write_detection_to_db(self.frame_count, coco_names[class_id[i]], class_id[i], x1, y1, x1 + w1, y1 + h1, round(conf[i], 2))
+        Returns:
+            (frame_id, tracker output or None if there were no detections, ids of tracks deleted on this frame)
+        """
+        # Increment frame counter
+        self.frame_count += 1
+        if detections is None:
+            # Tracks still age so people who left get deleted
+            self.tracker.increment_ages()
+            return self.frame_count, None, list(self.tracker.deleted_track_ids)
 
+        bbox, conf, class_id = detections
         trackers = self.tracker.update(bbox, conf, class_id, frame)
-        # Detect faces and landmarks
-        faces, landmarks = process_image(frame)
+        return self.frame_count, trackers, list(self.tracker.deleted_track_ids)
+
+    def detect_faces(self, frame, trackers=None, frame_id=None):
+        """
+        Face detection stage: faces, landmarks and their quality.
+
+        Independent of other frames, except in 'person_roi' mode, which needs this frame's `trackers`
+        """
+        if self.roi_detector is not None and trackers is not None:
+            faces, landmarks = self.roi_detector.detect(frame, trackers, frame_id)
+        else:
+            faces, landmarks = self.face_detector.detect(frame)
+        return faces, landmarks, face_quality(faces, landmarks, frame)
+
+    def analyze(self, frame, frame_id, trackers, deleted_track_ids, faces, landmarks, quality, timestamp=None):
+        """
+        Recognition and attribute stage, frames must come in order (it owns the per-track state)
+
+        Returns:
+            (track_id, face_data, visible, person_type) rows of the frame for `save`
+        """
+        self.track_states.evict(deleted_track_ids)
+        rows = []
+
+        # Faces due for attribute sampling are analyzed together once all faces of the frame are matched
+        now = self.attribute_scheduler.seconds(timestamp)
+        sampled = {}
+
+        # Match every face to at most one tracked body for the whole frame at once
+        face_track_ids, face_bodies = match_faces_to_tracks(faces, trackers)
+        usable = quality.frontal & (quality.score >= self.min_face_quality)
 
         for i, face in enumerate(faces):
             x_face, y_face, x1_face, y1_face = face[:4].astype(int)
             face_box = (x_face, y_face, x1_face, y1_face)
 
-            # Match with tracker
-            matched_id = None
-            body_coordinates = None
-            for track in trackers:
-                x, y, x1, y1, obj_id, _, _ = map(int, track[:7])
-                matched_id = obj_id
-                if (x <= x_face <= x1 and y <= y_face <= y1) and (x <= x1_face <= x1 and y <= y1_face <= y1):
-                    body_coordinates = (y, x1, y1, x)  # top, right, bottom, left (same format as face)
-                    break
-
             # Skip if no matching tracker found
-            if matched_id is None:
+            if face_track_ids[i] < 0:
                 # print('Skip ,no matching tracker found')
                 continue
 
+            matched_id = int(face_track_ids[i])
+            x, y, x1, y1 = face_bodies[i]
+            body_coordinates = (y, x1, y1, x)  # top, right, bottom, left (same format as face)
+
             # Check if face is visible and frontal
-            visible = False
-            if landmarks is not None and i < len(landmarks):
-                lm = landmarks[i]
-                visible = self.is_face_frontal(face[:4], lm)
+            visible = bool(usable[i])
+            face_score = float(quality.score[i])
 
             # Convert face location format for recognition
             face_location = (y_face, x1_face, y1_face, x_face)  # top, right, bottom, left
@@ -298,31 +301,30 @@ class FaceProcessor:
                 face_data["body_left"] = body_coordinates[3]
 
             # Check if we already have metadata for this track_id in our memory cache
-            track_meta = self.db_manager.get_frame_data(matched_id)
-            if track_meta:
-                # Update only the coordinate-related info and keep other metadata
-                for key, value in track_meta.items():
-                    if key not in ["face_location", "body_top", "body_right", "body_bottom", "body_left"]:
-                        face_data[key] = value
+            track_state = self.track_states.get(matched_id)
+            if track_state:
+                # Keep the current coordinates and take identity/attributes from the cache
+                face_data.update(track_state.as_face_data())
 
-                person_type = track_meta.get("person_type", PERSON_TYPE_CUSTOMER)
+                person_type = track_state.person_type
 
-                if track_meta.get("name") == 'identifying..':
+                if track_state.name == 'identifying..':
                     if visible:
                         recognition_result = self.recognize_face(frame, face_location)
                         if recognition_result:
                             name_new, person_type_new = recognition_result
-                            if matched_id in self.track_metadata:
-                                del self.track_metadata[matched_id]
-                            self.db_manager.update_by_track_id(matched_id,
-                                                               {"name": name_new, "person_type": person_type_new})
+                            track_state.recognition_attempts = 0
+                            self.track_states.update(matched_id, {"name": name_new, "person_type": person_type_new})
                         else:
-                            if matched_id in self.track_metadata:
-                                self.track_metadata[matched_id] += 1
-                            else:
-                                self.track_metadata[matched_id] = 1
-                            if self.track_metadata[matched_id] == self.recognition_attempts:
-                                self.db_manager.update_by_track_id(matched_id, {"name": "unknown"})
+                            attempts = self.track_states.record_attempt(matched_id)
+                            if attempts == self.recognition_attempts:
+                                self.track_states.update(matched_id, {"name": "unknown"})
+
+                # Frontal faces of known tracks are sampled only while the scheduler still needs them
+                if visible and matched_id not in sampled and any(
+                        self.attribute_scheduler.due(track_state.attributes, face_score, now)):
+                    sampled[matched_id] = (face_box, face_score, face_data, visible, person_type)
+                    continue
 
             else:
                 # No cached data, process face if visible
@@ -334,32 +336,132 @@ class FaceProcessor:
                     if recognition_result[0] is None:
                         # Save minimal data and continue
                         face_data["name"] = "identifying..."
-                        self.db_manager.save_frame_data(self.frame_count, matched_id, face_data, visible,
-                                                        PERSON_TYPE_CUSTOMER)
+                        rows.append((matched_id, face_data, visible, PERSON_TYPE_CUSTOMER))
                         continue
 
                     name, person_type = recognition_result
                     face_data["name"] = name
                     face_data["person_type"] = person_type
 
-                    # Analyze face (age, gender, emotion) only if not already done
-                    age, gender, emotion = self.analyze_face(frame, face_box, matched_id)
-
-                    if age:
-                        face_data["age"] = age
-                    if gender:
-                        face_data["gender"] = gender
-                    if emotion:
-                        face_data["emotion"] = emotion
-
-                    # Save to appropriate tables based on person_type
-                    self.db_manager.save_face_data(self.frame_count, matched_id, face_data)
+                    # The new track is created once its first attribute sample is taken
+                    if matched_id not in sampled:
+                        sampled[matched_id] = (face_box, face_score, face_data, visible, person_type)
+                        continue
                 else:
                     face_data["name"] = "identifying..."
                     person_type = PERSON_TYPE_CUSTOMER
 
+            self.track_states.touch(matched_id, frame_id)
+
             # Always save frame data for each frame
-            self.db_manager.save_frame_data(self.frame_count, matched_id, face_data, visible, person_type)
+            rows.append((matched_id, face_data, visible, person_type))
+
+        if sampled:
+            attributes = [
+                self.track_states.get(matched_id).attributes if matched_id in self.track_states else TrackAttributes()
+                for matched_id in sampled
+            ]
+            # One batch per model for every due face of the frame
+            self.attribute_scheduler.sample(
+                frame,
+                [(track_attributes, face_box, face_score)
+                 for track_attributes, (face_box, face_score, _, _, _) in zip(attributes, sampled.values())],
+                now, age_estimator, gender_estimator, emotion_estimator
+            )
+
+            for (matched_id, (_, _, face_data, visible, person_type)), track_attributes in zip(sampled.items(), attributes):
+                # New tracks are cached and written to detected_id here, known ones only write changed aggregates
+                self.track_states.apply_attributes(frame_id, matched_id, face_data, track_attributes)
+                self.track_states.touch(matched_id, frame_id)
+
+                rows.append((matched_id, face_data, visible, person_type))
+
+        return rows
+
+    def save(self, frame_id, objects, rows):
+        """Database stage: objects new to the snapshot and per-face rows of one frame"""
+        bbox, conf, class_id = objects if objects is not None else (np.zeros((0, 4)), np.zeros(0), np.zeros(0, int))
+        boxes = xywh_to_xyxy(bbox)
+        new = self.object_snapshot.update(frame_id, boxes, class_id)
+        if len(new):
+            # One multi-row insert per snapshot instead of a commit per box
+            self.db_manager.add_frame_detections([
+                (frame_id, coco_names[class_id[i]], int(class_id[i]), *boxes[i].tolist(), round(float(conf[i]), 2))
+                for i in new
+            ])
+
+        for track_id, face_data, visible, person_type in rows:
+            self.db_manager.save_frame_data(frame_id, track_id, face_data, visible, person_type)
+
+    def run_pipeline(self, saved_frames, decode_workers=2, face_workers=1, queue_size=4):
+        """
+        Process saved frames with every stage working on a different frame at the same time.
+
+        decode -> detect -> faces -> track -> analyze -> save, connected by
+        bounded queues, so throughput is set by the slowest stage. Tracking,
+        analysis and saving see frames in order and frames are marked processed
+        in order. `face_workers` > 1 needs a face detector that can be called
+        from several threads. In 'person_roi' mode faces come after track.
+
+        Returns:
+            Number of frames processed
+        """
+        def decode(saved_frame):
+            frame = cv2.imread(saved_frame['frame_path'])
+            if frame is None:
+                log_warning(f"Could not read frame {saved_frame['frame_path']}")
+                return None
+            return {'record': saved_frame, 'frame': frame}
+
+        def detect(job):
+            job['detections'], job['objects'] = self.route(self.detect(job['frame']))
+            return job
+
+        def detect_faces(job):
+            # Frames without persons are not analyzed, so their faces are not needed
+            if self.roi_detector is not None:
+                job['faces'] = self.detect_faces(job['frame'], job['trackers'], job['frame_id']) \
+                    if job['trackers'] is not None else None
+            else:
+                job['faces'] = self.detect_faces(job['frame']) if job['detections'] is not None else None
+            return job
+
+        def track(job):
+            job['frame_id'], job['trackers'], job['deleted_track_ids'] = self.track(job['frame'], job['detections'])
+            return job
+
+        def analyze(job):
+            frame = job.pop('frame')
+            if job['trackers'] is not None:
+                faces, landmarks, quality = job['faces']
+                job['rows'] = self.analyze(frame, job['frame_id'], job['trackers'], job['deleted_track_ids'],
+                                           faces, landmarks, quality, job['record']['timestamp'])
+            else:
+                # Tracks can still expire on a frame without persons
+                self.track_states.evict(job['deleted_track_ids'])
+            return job
+
+        def save(job):
+            self.save(job['frame_id'], job['objects'], job.get('rows', []))
+            self.db_manager.mark_frame_as_processed(job['record']['id'])
+            return job
+
+        faces_stage = Stage('faces', detect_faces, workers=face_workers, queue_size=queue_size)
+        track_stage = Stage('track', track, queue_size=queue_size)
+        # Person-ROI face detection needs the tracks of its frame, so it runs after tracking
+        middle = [track_stage, faces_stage] if self.roi_detector is not None else [faces_stage, track_stage]
+        pipeline = Pipeline([
+            Stage('decode', decode, workers=decode_workers, queue_size=queue_size),
+            Stage('detect', detect, queue_size=queue_size),
+            *middle,
+            Stage('analyze', analyze, queue_size=queue_size),
+            Stage('save', save, queue_size=queue_size)
+        ], name='face-processor')
+        processed = pipeline.run(saved_frames)
+
+        for name, stats in pipeline.stats().items():
+            print(f"{name}: {stats['processed']} frames, {stats['busy']:.1f}s busy")
+        return processed
 
     def load_known_faces_from_directories(self, base_path):
         """
@@ -458,7 +560,9 @@ if __name__ == "__main__":
         user="mvp",
         password="123",
         host="localhost",
-        port=5432
+        port=5432,
+        # Reads come from the in-memory track cache, so per-face writes can go through the background writer
+        write_behind=True
     )
 
     # Путь к директории с известными лицами
@@ -469,22 +573,10 @@ if __name__ == "__main__":
 
     print("Processing video...")
 
+    # Декодирование, детекция, трекинг, анализ и запись в БД работают параллельно над разными кадрами
     saved_frames = db_manager.get_unprocessed_frames()
-    for saved_frame in saved_frames:
-        frame = cv2.imread(saved_frame['frame_path'])
-        ret = frame is not None
-
-        if not ret:
-            break
-
-        # Обрабатываем кадр
-        face_processor.process_frame(frame)
-
-        # Отмечаем обработанные кадры
-        db_manager.mark_frame_as_processed(saved_frame['id'])
-
+    processed = face_processor.run_pipeline(saved_frames)
+    print(f"Processed {processed} frames")
 
-        # Проверяем нажатие клавиши для выхода
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q'):
-            break
\ No newline at end of file
+    # Записываем оставшиеся в буфере обнаружения и очередь записи
+    db_manager.close()
@@ -2,6 +2,8 @@ from face.age_resnet_50 import AgeEstimator
 
 
 from face.face_pointing import process_image
+from face.face_association import associate_faces
+from face.face_quality import face_quality
 from face.face_recog import FaceRecognizer
 
 from face.gender_detection import GenderEstimator
@@ -29,94 +31,25 @@ class Counting:
         self.tracker = ObjectTracking()
         self.face_id = FaceRecognizer()
 
-    def is_face_frontal(self, face_box, lm):
-        """
-        Проверяет, смотрит ли лицо строго вперёд, используя bounding box и 5 ключевых точек.
-
-        Аргументы:
-          face_box: (x_face, y_face, x1_face, y1_face)
-          lm: массив landmarks размером (5,2): [левый глаз, правый глаз, нос, левый угол рта, правый угол рта]
-
-        Возвращает:
-          True, если лицо подходит для распознавания (адекватный масштаб и ориентация),
-          иначе False.
-        """
-        # Извлекаем координаты bounding box
-        x_face, y_face, x1_face, y1_face = face_box
-        face_width = x1_face - x_face
-        face_height = y1_face - y_face
-        scale = (face_width + face_height) / 2.0
-
-        # Из landmarks извлекаем точки
-        left_eye, right_eye = np.array(lm[0]), np.array(lm[1])
-        nose = np.array(lm[2])
-        mouth_left, mouth_right = np.array(lm[3]), np.array(lm[4])
-
-        # Расстояния между ключевыми точками
-        eye_distance = np.linalg.norm(left_eye - right_eye)
-        middle_eye = (left_eye + right_eye) / 2.0
-        middle_mouth = (mouth_left + mouth_right) / 2.0
-        face_vertical = np.linalg.norm(middle_mouth - middle_eye)
-
-        # Вычисляем углы относительно горизонтали
-        def angle_between(p1, p2):
-            return math.degrees(math.atan2(p2[1] - p1[1], p2[0] - p1[0]))
-
-        eye_angle = angle_between(left_eye, right_eye)
-        mouth_angle = angle_between(mouth_left, mouth_right)
-
-        # Относительные соотношения, адаптированные по масштабу
-        eye_ratio = eye_distance / scale
-        vertical_ratio = face_vertical / scale
-
-        # Новый критерий: соотношение расстояний от носа до средней точки глаз и до средней точки рта.
-        nose_to_eyes = np.linalg.norm(nose - middle_eye)
-        nose_to_mouth = np.linalg.norm(nose - middle_mouth)
-        nose_ratio = nose_to_eyes / nose_to_mouth  # для фронтального лица обычно близко к 1
-
-        # Отладочная информация (при необходимости можно раскомментировать)
-        # print("scale:", scale, "eye_distance:", eye_distance, "face_vertical:", face_vertical)
-        # print("eye_ratio:", eye_ratio, "vertical_ratio:", vertical_ratio)
-        # print("eye_angle:", eye_angle, "mouth_angle:", mouth_angle, "nose_ratio:", nose_ratio)
-
-        # Проверка углов наклона: если глаза или рот наклонены более чем на 10°, лицо, скорее всего, не фронтальное
-        if abs(eye_angle) > 20 or abs(mouth_angle) > 20:
-            return False
-
-        # Проверка соотношений относительно масштаба
-        if not (0.25 < eye_ratio < 0.55):
-            return False
-        if not (0.35 < vertical_ratio < 0.75):
-            return False
-
-        # Дополнительная проверка: если лицо наклонено вниз, нос окажется ближе к рту.
-        # Для строго фронтального лица nose_ratio должно быть не слишком маленьким.
-        if nose_ratio < 0.8:
-            return False
-
-        return True
-
-
     def __call__(self, frame):
         trackers = self.tracker(frame)
         faces, landmarks = process_image(frame)
         out = []
 
+        # Один проход сопоставления всех лиц со всеми треками
+        body_boxes = np.array([track.tlbr for track in trackers], dtype=float).reshape(-1, 4).astype(int)
+        face_boxes = np.asarray(faces).reshape(len(faces), -1)[:, :4].astype(int) if len(faces) else np.zeros((0, 4), int)
+        matches = associate_faces(face_boxes, body_boxes)
+        # Фронтальность всех лиц кадра за один векторный проход
+        frontal = face_quality(faces, landmarks).frontal
+
         for i, face in enumerate(faces):
             x_face, y_face, x1_face, y1_face = face[:4].astype(int)
             face_box = (x_face, y_face, x1_face, y1_face)
 
-            matched_id = None
-            for track in trackers:
-                x, y, x1, y1 = map(int, track.tlbr)
-                if (x <= x_face <= x1 and y <= y_face <= y1) and (x <= x1_face <= x1 and y <= y1_face <= y1):
-                    matched_id = track.track_id
-                    break
-
-            visible = False
-            if landmarks is not None:
-                lm = landmarks[i]
-                visible = self.is_face_frontal(face[:4], lm)
+            matched_id = trackers[matches[i]].track_id if matches[i] >= 0 else None
+
+            visible = bool(frontal[i])
 
             if matched_id is not None:
                 color = (0, 255, 0) if visible else (0, 0, 255)
@@ -4,4 +4,12 @@ class FaceProcessingException(Exception):
 
 class TrackingException(Exception):
     """Custom exception for tracking errors"""
-    pass
\ No newline at end of file
+    pass
+
+class ModelRegistryException(Exception):
+    """Custom exception for model registry errors"""
+    pass
+
+class ConfigurationException(Exception):
+    """Custom exception for invalid settings"""
+    pass
@@ -0,0 +1,118 @@
+import sys
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from ship.core.exceptions import ModelRegistryException
+
+
+DEFAULT_STREAM = 'default'
+
+
+@dataclass
+class ModelSpec:
+    """How to build (and optionally warm up) a registered model"""
+    factory: Callable[[], Any]
+    warmup: Optional[Callable[[Any], None]] = None
+    per_stream: bool = False
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of loaded models shared by container Tasks.
+
+    Models are registered by key with a factory and are loaded lazily on the
+    first `get`. Shared models (detectors, estimators) are loaded once per
+    process; stateful models such as trackers are registered with
+    `per_stream=True` and get one instance per stream id.
+    """
+
+    def __init__(self):
+        self._specs: Dict[str, ModelSpec] = {}
+        self._models: Dict[Tuple[str, Hashable], Any] = {}
+        self._locks: Dict[Tuple[str, Hashable], threading.Lock] = {}
+        self._lock = threading.RLock()
+
+    def register(self, key: str, factory: Callable[[], Any], warmup: Optional[Callable[[Any], None]] = None,
+                 per_stream: bool = False, replace: bool = False) -> None:
+        """Register a model factory under `key` (existing registrations are kept unless `replace`)"""
+        with self._lock:
+            if key in self._specs and not replace:
+                return
+            self._specs[key] = ModelSpec(factory=factory, warmup=warmup, per_stream=per_stream)
+
+    def is_registered(self, key: str) -> bool:
+        return key in self._specs
+
+    def is_loaded(self, key: str, stream_id: Hashable = DEFAULT_STREAM) -> bool:
+        return self._instance_key(key, stream_id) in self._models
+
+    def get(self, key: str, stream_id: Hashable = DEFAULT_STREAM) -> Any:
+        """Return the shared instance for `key`, loading it on first use"""
+        instance_key = self._instance_key(key, stream_id)
+        model = self._models.get(instance_key)
+        if model is not None:
+            return model
+
+        with self._lock:
+            load_lock = self._locks.setdefault(instance_key, threading.Lock())
+
+        # Only one thread builds a given model; others wait for it instead of loading it twice
+        with load_lock:
+            model = self._models.get(instance_key)
+            if model is None:
+                model = self._load(key)
+                self._models[instance_key] = model
+        return model
+
+    def warmup(self, *keys: str, stream_id: Hashable = DEFAULT_STREAM) -> None:
+        """Load the given models (all registered models by default) and run their warm-up hooks"""
+        for key in keys or tuple(self._specs):
+            model = self.get(key, stream_id)
+            spec = self._specs[key]
+            if spec.warmup is not None:
+                spec.warmup(model)
+
+    def unload(self, key: str, stream_id: Optional[Hashable] = None) -> None:
+        """Drop loaded instances of `key` (only the given stream's instance if `stream_id` is set)"""
+        with self._lock:
+            for instance_key in list(self._models):
+                if instance_key[0] == key and (stream_id is None or instance_key[1] == stream_id):
+                    del self._models[instance_key]
+                    self._locks.pop(instance_key, None)
+        self._release_device_memory()
+
+    def reset_stream(self, stream_id: Hashable) -> None:
+        """Drop every per-stream instance (e.g. trackers) that belongs to `stream_id`"""
+        with self._lock:
+            for instance_key in list(self._models):
+                if instance_key[1] == stream_id and self._specs[instance_key[0]].per_stream:
+                    del self._models[instance_key]
+                    self._locks.pop(instance_key, None)
+
+    def unload_all(self) -> None:
+        with self._lock:
+            self._models.clear()
+            self._locks.clear()
+        self._release_device_memory()
+
+    def _instance_key(self, key: str, stream_id: Hashable) -> Tuple[str, Hashable]:
+        spec = self._specs.get(key)
+        if spec is None:
+            raise ModelRegistryException(f"Model '{key}' is not registered")
+        return key, stream_id if spec.per_stream else DEFAULT_STREAM
+
+    def _load(self, key: str) -> Any:
+        try:
+            return self._specs[key].factory()
+        except Exception as e:
+            raise ModelRegistryException(f"Failed to load model '{key}': {e}") from e
+
+    @staticmethod
+    def _release_device_memory() -> None:
+        torch = sys.modules.get('torch')
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,209 @@
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+@dataclass
+class Stage:
+    """
+    One pipeline step: `fn(item)` returns the item handed to the next stage.
+
+    `workers` threads run `fn` concurrently and read from an input queue of at
+    most `queue_size` items. An ordered stage hands its results on in source
+    order even when several workers finish out of order. Returning None (or
+    raising) drops the item for the following stages.
+    """
+    name: str
+    fn: Callable[[Any], Any]
+    workers: int = 1
+    queue_size: int = 4
+    ordered: bool = True
+
+
+class _End:
+    pass
+
+
+_END = _End()
+# Placeholder passed on for dropped items, so ordered stages further down never wait for them
+_DROPPED = object()
+
+
+class _StageRunner:
+    """Worker threads of one stage, between its input queue and the next stage's"""
+
+    def __init__(self, stage: Stage, inbox: queue.Queue, outbox: queue.Queue):
+        if stage.workers < 1:
+            raise ValueError(f"Stage {stage.name} needs at least one worker")
+
+        self.stage = stage
+        self.inbox = inbox
+        self.outbox = outbox
+
+        self.processed = 0
+        self.dropped = 0
+        self.busy = 0.0
+
+        self._lock = threading.Lock()
+        self._alive = stage.workers
+        # Results waiting for an earlier sequence number, bounded by the window
+        self._pending: Dict[int, Any] = {}
+        self._next_seq = 0
+        self._window = threading.BoundedSemaphore(2 * stage.workers) if stage.ordered else None
+
+        self.threads = [
+            threading.Thread(target=self._work, name=f"{stage.name}-{i}", daemon=True)
+            for i in range(stage.workers)
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def _work(self):
+        while True:
+            if self._window is not None:
+                self._window.acquire()
+            item = self.inbox.get()
+
+            if item is _END:
+                if self._window is not None:
+                    self._window.release()
+                # Let the other workers of this stage see the end too
+                self.inbox.put(_END)
+                with self._lock:
+                    self._alive -= 1
+                    last = self._alive == 0
+                if last:
+                    self.outbox.put(_END)
+                return
+
+            seq, payload = item
+            result = _DROPPED
+            if payload is not _DROPPED:
+                start = time.perf_counter()
+                try:
+                    result = self.stage.fn(payload)
+                except Exception as e:
+                    print(f"Error in pipeline stage {self.stage.name}: {e}")
+                    result = None
+                elapsed = time.perf_counter() - start
+
+                with self._lock:
+                    self.busy += elapsed
+                    if result is None:
+                        self.dropped += 1
+                        result = _DROPPED
+                    else:
+                        self.processed += 1
+
+            self._emit(seq, result)
+
+    def _emit(self, seq: int, result: Any) -> None:
+        if self._window is None:
+            self.outbox.put((seq, result))
+            return
+
+        with self._lock:
+            self._pending[seq] = result
+            # Hand on every result that is next in line; blocking here is the backpressure
+            while self._next_seq in self._pending:
+                self.outbox.put((self._next_seq, self._pending.pop(self._next_seq)))
+                self._next_seq += 1
+                self._window.release()
+
+
+class Pipeline:
+    """
+    Runs items from a source through stages connected by bounded queues.
+
+    The source is iterated on its own thread and each stage on its own
+    workers, so all stages work on different items at the same time and
+    throughput is set by the slowest stage instead of the sum of all of them.
+    A full queue blocks the stage in front of it (backpressure), so memory
+    stays bounded when a later stage falls behind.
+
+    Ordered stages can only follow ordered stages, so they take items in
+    source order. A stage that depends on item order (e.g. a tracker) should
+    have one worker; the last stage then also sees (and e.g. commits) items
+    in source order.
+    """
+
+    def __init__(self, stages: List[Stage], name: str = 'pipeline'):
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage")
+        for previous, stage in zip(stages, stages[1:]):
+            if stage.ordered and not previous.ordered:
+                raise ValueError(f"Ordered stage {stage.name} cannot follow unordered stage {previous.name}")
+
+        self.stages = stages
+        self.name = name
+        self._stop = threading.Event()
+        self._runners: List[_StageRunner] = []
+
+    def run(self, source: Iterable, on_result: Optional[Callable[[Any], None]] = None) -> int:
+        """
+        Process every item of `source`, blocking until all stages are done.
+
+        Args:
+          source: iterable of items for the first stage
+          on_result: called on this thread with every item that passed the last stage, in its output order
+
+        Returns:
+          Number of items that passed every stage
+        """
+        self._stop.clear()
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        results = queue.Queue(maxsize=self.stages[-1].queue_size)
+        self._runners = [
+            _StageRunner(stage, inbox, outbox)
+            for stage, inbox, outbox in zip(self.stages, queues, queues[1:] + [results])
+        ]
+
+        feeder = threading.Thread(target=self._feed, args=(source, queues[0]), name=f"{self.name}-source",
+                                  daemon=True)
+        for runner in self._runners:
+            runner.start()
+        feeder.start()
+
+        completed = 0
+        while True:
+            item = results.get()
+            if item is _END:
+                break
+            _, result = item
+            if result is _DROPPED:
+                continue
+            completed += 1
+            if on_result is not None:
+                on_result(result)
+
+        feeder.join()
+        for runner in self._runners:
+            for thread in runner.threads:
+                thread.join()
+        return completed
+
+    def stop(self) -> None:
+        """Stop reading from the source; items already in the pipeline are still finished"""
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Per-stage processed and dropped item counts and busy seconds of the last run"""
+        return {
+            runner.stage.name: {'processed': runner.processed, 'dropped': runner.dropped, 'busy': runner.busy}
+            for runner in self._runners
+        }
+
+    def _feed(self, source: Iterable, inbox: queue.Queue) -> None:
+        try:
+            for seq, payload in enumerate(source):
+                if self._stop.is_set():
+                    break
+                inbox.put((seq, payload))
+        except Exception as e:
+            print(f"Error reading {self.name} source: {e}")
+        finally:
+            inbox.put(_END)
@@ -0,0 +1,207 @@
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_NEW = 'drop_new'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+
+
+@dataclass
+class WriteOp:
+    """A single queued write: an INSERT of `rows` or an UPDATE of `values` WHERE key column = key value"""
+    kind: str
+    table: str
+    rows: List[Dict[str, Any]] = field(default_factory=list)
+    key: Optional[Tuple[str, Any]] = None
+    values: Optional[Dict[str, Any]] = None
+
+
+class _Marker:
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class _Stop(_Marker):
+    pass
+
+
+class WriteBehindQueue:
+    """
+    Bounded write-behind queue drained by a background writer thread.
+
+    Producers (the inference thread) only enqueue rows. The writer groups queued
+    rows by table, and hands them to `writer` as a list of WriteOp to be applied in
+    one transaction. A flush happens once `batch_size` items are pending or the
+    oldest pending item is `flush_interval` seconds old. Order is kept per table:
+    pending inserts are written before a later update of the same table.
+
+    When the queue is full, `overflow` decides what happens:
+      - 'block': the producer waits up to `put_timeout` seconds (backpressure), then drops
+      - 'drop_new': the new item is dropped
+      - 'drop_oldest': the oldest queued item is dropped to make room
+    """
+
+    def __init__(self, writer: Callable[[List[WriteOp]], None], max_size: int = 10000, batch_size: int = 500,
+                 flush_interval: float = 0.5, overflow: str = OVERFLOW_BLOCK, put_timeout: Optional[float] = 5.0,
+                 name: str = 'write-behind'):
+        if overflow not in (OVERFLOW_BLOCK, OVERFLOW_DROP_NEW, OVERFLOW_DROP_OLDEST):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.put_timeout = put_timeout
+
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def insert(self, table: str, row: Dict[str, Any]) -> bool:
+        """Queue one row for insertion into `table`; returns False if it was dropped"""
+        return self._put(WriteOp('insert', table, rows=[row]))
+
+    def update(self, table: str, key_column: str, key_value: Any, values: Dict[str, Any]) -> bool:
+        """Queue `UPDATE table SET values WHERE key_column = key_value`; returns False if it was dropped"""
+        return self._put(WriteOp('update', table, key=(key_column, key_value), values=dict(values)))
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything queued before this call has been written"""
+        marker = _Marker()
+        self._queue.put(marker)
+        return marker.done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Stop accepting writes, drain the queue and stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_Stop())
+        self._thread.join(timeout)
+
+    def _put(self, op: WriteOp) -> bool:
+        if self._closed:
+            raise RuntimeError("Write-behind queue is closed")
+
+        try:
+            if self.overflow == OVERFLOW_BLOCK:
+                self._queue.put(op, timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait(op)
+            return True
+        except queue.Full:
+            pass
+
+        if self.overflow == OVERFLOW_DROP_OLDEST:
+            try:
+                oldest = self._queue.get_nowait()
+                if isinstance(oldest, _Marker):
+                    # Never drop flush/stop markers, put it back and drop the new item instead
+                    self._queue.put_nowait(oldest)
+                else:
+                    self.dropped += 1
+                self._queue.put_nowait(op)
+                return True
+            except (queue.Empty, queue.Full):
+                pass
+
+        self.dropped += 1
+        return False
+
+    def _run(self):
+        batch: List[WriteOp] = []
+        deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, _Marker):
+                self._write(batch)
+                batch, deadline = [], None
+                item.done.set()
+                if isinstance(item, _Stop):
+                    return
+                continue
+
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(batch)
+                batch, deadline = [], None
+
+    def _write(self, batch: List[WriteOp]) -> None:
+        if not batch:
+            return
+        try:
+            # Writers may report a rolled back transaction by returning False instead of raising
+            if self.writer(self._group(batch)) is False:
+                self.errors += 1
+                return
+            self.written += len(batch)
+        except Exception as e:
+            self.errors += 1
+            print(f"Error writing {len(batch)} queued rows: {e}")
+
+    @staticmethod
+    def _group(batch: List[WriteOp]) -> List[WriteOp]:
+        """Merge inserts per table into multi-row inserts, keeping them ahead of later updates of that table"""
+        ops: List[WriteOp] = []
+        inserts: Dict[str, WriteOp] = {}
+        for op in batch:
+            if op.kind == 'insert':
+                if op.table not in inserts:
+                    inserts[op.table] = WriteOp('insert', op.table)
+                inserts[op.table].rows.extend(op.rows)
+            else:
+                pending = inserts.pop(op.table, None)
+                if pending is not None:
+                    ops.append(pending)
+                ops.append(op)
+        ops.extend(inserts.values())
+        return ops
+
+
+class SqlAlchemyBatchWriter:
+    """Applies grouped WriteOps through SQLAlchemy, one session and one transaction per flush"""
+
+    def __init__(self, session_factory, models):
+        self.session_factory = session_factory
+        self.models = {model.__tablename__: model for model in models}
+
+    def __call__(self, ops: List[WriteOp]) -> None:
+        from sqlalchemy import insert, update
+
+        session = self.session_factory()
+        try:
+            for op in ops:
+                model = self.models[op.table]
+                if op.kind == 'insert':
+                    session.execute(insert(model), op.rows)
+                else:
+                    column, value = op.key
+                    session.execute(update(model).where(getattr(model, column) == value).values(**op.values))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
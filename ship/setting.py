@@ -1,6 +1,7 @@
 from pydantic.v1 import Extra
 from pydantic_settings import BaseSettings
 from pathlib import Path
+from typing import Dict, List
 
 
 class Settings(BaseSettings):
@@ -10,6 +11,34 @@ class Settings(BaseSettings):
     DB_DATABASE: str
     DB_USERNAME: str
     DB_PASSWORD: str
+    # Multi-object tracker: 'strong_sort' (motion + ReID) or 'bytetrack' (motion only, no ReID network)
+    TRACKER: str = 'strong_sort'
+    # Camera motion compensation of the tracker: 'ecc', 'sparse_flow' or empty for static cameras
+    TRACKER_CMC: str = ''
+    # StrongSORT runs ReID only for detections that motion cannot match unambiguously
+    TRACKER_ADAPTIVE_REID: bool = False
+    # Face detection on the whole frame ('full_frame') or on tracked persons' upper bodies ('person_roi')
+    FACE_DETECTION_MODE: str = 'full_frame'
+    # In 'person_roi' mode every this many frames the whole frame is still searched for untracked faces
+    FACE_ROI_FULL_FRAME_INTERVAL: int = 30
+    # Face detector backend: 'mxnet' (GPU or CPU) or 'onnx' (ONNX Runtime CPU, model from export_onnx),
+    # experimental until a check_onnx_parity run against MXNet is recorded
+    FACE_DETECTOR_BACKEND: str = 'mxnet'
+    FACE_DETECTOR_ONNX_PATH: str = 'face/checkpoint/R50/R50.onnx'
+    # ONNX Runtime intra-op threads of the face detector, 0 = one per physical core
+    FACE_DETECTOR_THREADS: int = 0
+    # Face detector input scale: short side in px (0 = camera resolution) and long side cap (0 = none)
+    FACE_SCALE_TARGET_SIZE: int = 0
+    FACE_SCALE_MAX_SIZE: int = 0
+    # Pyramid levels as factors of that scale, smallest first; early exit stops once a level adds no face
+    FACE_SCALE_PYRAMID: List[float] = [1.0]
+    FACE_SCALE_EARLY_EXIT: bool = True
+    # Smallest face expected at camera resolution in px, lets the detector downscale (0 = unknown)
+    FACE_MIN_FACE_SIZE: int = 0
+    # Per-camera overrides by stream id, e.g. {"entrance": {"target_size": 1080, "min_face": 48}}
+    FACE_SCALE_CAMERAS: Dict[str, dict] = {}
+    # Print per-scale detector timings every this many frames (0 = never)
+    FACE_SCALE_REPORT_EVERY: int = 0
 
     class Config:
         env_file = '.env'
@@ -0,0 +1,36 @@
+from abc import ABC, abstractmethod
+from typing import List, Union
+
+import numpy as np
+
+
+class BaseTracker(ABC):
+    """
+    Interface of the multi-object trackers used by the processing pipeline.
+
+    `update` takes one frame's detections and returns the confirmed tracks of
+    that frame as an (M, 7) array of x1, y1, x2, y2, track_id, class_id, conf
+    (or an empty list), so callers don't depend on the tracker in use.
+    """
+
+    @abstractmethod
+    def update(self, bbox_xywh, confidences, classes, ori_img: np.ndarray) -> Union[np.ndarray, list]:
+        """
+        Args:
+          bbox_xywh: (N, 4) center x, center y, width, height
+          confidences: (N,) detection scores
+          classes: (N,) class ids
+          ori_img: the frame the detections come from
+        """
+
+    @property
+    @abstractmethod
+    def deleted_track_ids(self) -> List[int]:
+        """Ids of tracks removed by the last `update` or `increment_ages`, for callers that keep per-track state"""
+
+    @abstractmethod
+    def resume_ids(self, last_track_id: int) -> None:
+        """Continue track numbering after `last_track_id` (e.g. the highest id already persisted)"""
+
+    def increment_ages(self) -> None:
+        """Age all tracks for a frame without detections, expired tracks end up in `deleted_track_ids`"""
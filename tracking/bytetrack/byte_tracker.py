@@ -1,5 +1,8 @@
+from types import SimpleNamespace
+
 import numpy as np
 
+from tracking.base_tracker import BaseTracker
 from .kalman_filter import KalmanFilter
 from  . import matching
 from .basetrack import BaseTrack, TrackState
@@ -7,7 +10,7 @@ from .basetrack import BaseTrack, TrackState
 
 class STrack(BaseTrack):
     shared_kalman = KalmanFilter()
-    def __init__(self, tlwh, score):
+    def __init__(self, tlwh, score, class_id=0):
 
         # wait activate
         self._tlwh = np.asarray(tlwh, dtype=np.float32)
@@ -16,6 +19,7 @@ class STrack(BaseTrack):
         self.is_activated = False
 
         self.score = score
+        self.class_id = int(class_id)
         self.tracklet_len = 0
 
     def predict(self):
@@ -37,11 +41,24 @@ class STrack(BaseTrack):
                 stracks[i].mean = mean
                 stracks[i].covariance = cov
 
-    def activate(self, kalman_filter, frame_id):
+    @staticmethod
+    def multi_update(stracks, detections):
+        """Kalman correction of all matched tracks in one call; the tracks'
+        `update`/`re_activate` then only do the bookkeeping (kalman_updated=True)"""
+        if len(stracks) > 0:
+            multi_mean, multi_covariance = STrack.shared_kalman.multi_update(
+                np.asarray([st.mean for st in stracks]),
+                np.asarray([st.covariance for st in stracks]),
+                np.asarray([STrack.tlwh_to_xyah(det.tlwh) for det in detections]))
+            for i, (mean, cov) in enumerate(zip(multi_mean, multi_covariance)):
+                stracks[i].mean = mean
+                stracks[i].covariance = cov
+
+    def activate(self, kalman_filter, frame_id, track_id):
         # ReID.activate(kalman_filter=kalman_filter, frame_id=frame_id)
-        """Start a new tracklet"""
+        """Start a new tracklet with `track_id` from its tracker's counter"""
         self.kalman_filter = kalman_filter
-        self.track_id = self.next_id()
+        self.track_id = track_id
         self.mean, self.covariance = self.kalman_filter.initiate(self.tlwh_to_xyah(self._tlwh))
 
         self.tracklet_len = 0
@@ -52,36 +69,41 @@ class STrack(BaseTrack):
         self.frame_id = frame_id
         self.start_frame = frame_id
 
-    def re_activate(self, new_track, frame_id, new_id=False):
-        self.mean, self.covariance = self.kalman_filter.update(
-            self.mean, self.covariance, self.tlwh_to_xyah(new_track.tlwh)
-        )
+    def re_activate(self, new_track, frame_id, new_id=None, kalman_updated=False):
+        if not kalman_updated:
+            self.mean, self.covariance = self.kalman_filter.update(
+                self.mean, self.covariance, self.tlwh_to_xyah(new_track.tlwh)
+            )
         self.tracklet_len = 0
         self.state = TrackState.Tracked
         self.is_activated = True
         self.frame_id = frame_id
         if new_id:
-            self.track_id = self.next_id()
+            # New id from the tracker's counter
+            self.track_id = new_id
         self.score = new_track.score
+        self.class_id = new_track.class_id
 
-    def update(self, new_track, frame_id):
+    def update(self, new_track, frame_id, kalman_updated=False):
         """
         Update a matched track
         :type new_track: STrack
         :type frame_id: int
-        :type update_feature: bool
+        :type kalman_updated: bool, the Kalman step was already done by `multi_update`
         :return:
         """
         self.frame_id = frame_id
         self.tracklet_len += 1
 
-        new_tlwh = new_track.tlwh
-        self.mean, self.covariance = self.kalman_filter.update(
-            self.mean, self.covariance, self.tlwh_to_xyah(new_tlwh))
+        if not kalman_updated:
+            new_tlwh = new_track.tlwh
+            self.mean, self.covariance = self.kalman_filter.update(
+                self.mean, self.covariance, self.tlwh_to_xyah(new_tlwh))
         self.state = TrackState.Tracked
         self.is_activated = True
 
         self.score = new_track.score
+        self.class_id = new_track.class_id
 
     @property
     # @jit(nopython=True)
@@ -151,8 +173,14 @@ class BYTETracker(object):
         self.buffer_size = int(frame_rate / 30.0 * args.track_buffer)
         self.max_time_lost = self.buffer_size
         self.kalman_filter = KalmanFilter()
+        # Track ids are counted per tracker, so every camera numbers its own tracks
+        self.track_count = 0
+
+    def next_id(self):
+        self.track_count += 1
+        return self.track_count
 
-    def update(self, bboxes, scores, img_info, img_size=[1280, 720, 3]):
+    def update(self, bboxes, scores, img_info, img_size=[1280, 720, 3], classes=None):
         self.frame_id += 1
         activated_starcks = []
         refind_stracks = []
@@ -162,6 +190,8 @@ class BYTETracker(object):
         img_h, img_w = img_info[0], img_info[1]
         scale = min(img_size[0] / float(img_h), img_size[1] / float(img_w))
         bboxes /= scale
+        if classes is None:
+            classes = np.zeros(len(scores), dtype=int)
 
         remain_inds = scores > self.args.track_thresh
         inds_low = scores > 0.1
@@ -172,11 +202,13 @@ class BYTETracker(object):
         dets = bboxes[remain_inds]
         scores_keep = scores[remain_inds]
         scores_second = scores[inds_second]
+        classes_keep = classes[remain_inds]
+        classes_second = classes[inds_second]
 
         if len(dets) > 0:
             '''Detections'''
-            detections = [STrack(STrack.tlbr_to_tlwh(tlbr), s) for
-                          (tlbr, s) in zip(dets, scores_keep)]
+            detections = [STrack(STrack.tlbr_to_tlwh(tlbr), s, c) for
+                          (tlbr, s, c) in zip(dets, scores_keep, classes_keep)]
         else:
             detections = []
 
@@ -198,35 +230,37 @@ class BYTETracker(object):
             dists = matching.fuse_score(dists, detections)
         matches, u_track, u_detection = matching.linear_assignment(dists, thresh=self.args.match_thresh)
 
+        STrack.multi_update([strack_pool[i] for i, _ in matches], [detections[i] for _, i in matches])
         for itracked, idet in matches:
             track = strack_pool[itracked]
             det = detections[idet]
             if track.state == TrackState.Tracked:
-                track.update(detections[idet], self.frame_id)
+                track.update(detections[idet], self.frame_id, kalman_updated=True)
                 activated_starcks.append(track)
             else:
-                track.re_activate(det, self.frame_id, new_id=False)
+                track.re_activate(det, self.frame_id, kalman_updated=True)
                 refind_stracks.append(track)
 
         ''' Step 3: Second association, with low score detection boxes'''
         # association the untrack to the low score detections
         if len(dets_second) > 0:
             '''Detections'''
-            detections_second = [STrack(STrack.tlbr_to_tlwh(tlbr), s) for
-                          (tlbr, s) in zip(dets_second, scores_second)]
+            detections_second = [STrack(STrack.tlbr_to_tlwh(tlbr), s, c) for
+                          (tlbr, s, c) in zip(dets_second, scores_second, classes_second)]
         else:
             detections_second = []
         r_tracked_stracks = [strack_pool[i] for i in u_track if strack_pool[i].state == TrackState.Tracked]
         dists = matching.iou_distance(r_tracked_stracks, detections_second)
         matches, u_track, u_detection_second = matching.linear_assignment(dists, thresh=0.5)
+        STrack.multi_update([r_tracked_stracks[i] for i, _ in matches], [detections_second[i] for _, i in matches])
         for itracked, idet in matches:
             track = r_tracked_stracks[itracked]
             det = detections_second[idet]
             if track.state == TrackState.Tracked:
-                track.update(det, self.frame_id)
+                track.update(det, self.frame_id, kalman_updated=True)
                 activated_starcks.append(track)
             else:
-                track.re_activate(det, self.frame_id, new_id=False)
+                track.re_activate(det, self.frame_id, kalman_updated=True)
                 refind_stracks.append(track)
 
         for it in u_track:
@@ -241,8 +275,9 @@ class BYTETracker(object):
         if not self.args.mot20:
             dists = matching.fuse_score(dists, detections)
         matches, u_unconfirmed, u_detection = matching.linear_assignment(dists, thresh=0.7)
+        STrack.multi_update([unconfirmed[i] for i, _ in matches], [detections[i] for _, i in matches])
         for itracked, idet in matches:
-            unconfirmed[itracked].update(detections[idet], self.frame_id)
+            unconfirmed[itracked].update(detections[idet], self.frame_id, kalman_updated=True)
             activated_starcks.append(unconfirmed[itracked])
         for it in u_unconfirmed:
             track = unconfirmed[it]
@@ -255,7 +290,7 @@ class BYTETracker(object):
             # print(track)
             if track.score < self.det_thresh:
                 continue
-            track.activate(self.kalman_filter, self.frame_id)
+            track.activate(self.kalman_filter, self.frame_id, self.next_id())
             activated_starcks.append(track)
         """ Step 5: Update state"""
         for track in self.lost_stracks:
@@ -270,14 +305,69 @@ class BYTETracker(object):
         self.tracked_stracks = joint_stracks(self.tracked_stracks, refind_stracks)
         self.lost_stracks = sub_stracks(self.lost_stracks, self.tracked_stracks)
         self.lost_stracks.extend(lost_stracks)
+        # Only this frame's removals: older ones are in no list any more, and keeping them all grows without bound
+        self.removed_stracks = removed_stracks
         self.lost_stracks = sub_stracks(self.lost_stracks, self.removed_stracks)
-        self.removed_stracks.extend(removed_stracks)
         self.tracked_stracks, self.lost_stracks = remove_duplicate_stracks(self.tracked_stracks, self.lost_stracks)
         # get scores of lost tracks
         output_stracks = [track for track in self.tracked_stracks if track.is_activated]
         return output_stracks
 
 
+
+class ByteTrack(BaseTracker):
+    """
+    BYTETracker behind the common tracker interface: center x, center y, w, h
+    detections in, the same (M, 7) rows as StrongSORT.update out.
+
+    Association uses Kalman motion and IoU only (NumPy/SciPy), so no ReID
+    network or GPU is needed. As in upstream ByteTrack, detection scores are
+    fused into the IoU cost; `mot20=True` turns that off for very crowded scenes.
+    """
+
+    def __init__(self, track_thresh=0.3, track_buffer=30, match_thresh=0.8, mot20=False, frame_rate=30):
+        args = SimpleNamespace(track_thresh=track_thresh, track_buffer=track_buffer, match_thresh=match_thresh,
+                               mot20=mot20)
+        self.tracker = BYTETracker(args, frame_rate=frame_rate)
+
+    def update(self, bbox_xywh, confidences, classes, ori_img):
+        height, width = ori_img.shape[:2]
+        xywh = _to_numpy(bbox_xywh).astype(np.float64).reshape(-1, 4)
+        xyxy = np.c_[xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2]
+        scores = _to_numpy(confidences).astype(np.float64).reshape(-1)
+        class_ids = _to_numpy(classes).astype(int).reshape(-1)
+
+        tracks = self.tracker.update(xyxy, scores, (height, width), (height, width), classes=class_ids)
+
+        outputs = []
+        for track in tracks:
+            x1, y1, x2, y2 = track.tlbr
+            # Same clipping as StrongSORT._tlwh_to_xyxy
+            outputs.append(np.array([
+                max(int(x1), 0), max(int(y1), 0), min(int(x2), width - 1), min(int(y2), height - 1),
+                track.track_id, track.class_id, track.score
+            ]))
+        if len(outputs) > 0:
+            outputs = np.stack(outputs, axis=0)
+        return outputs
+
+    def increment_ages(self):
+        self.tracker.update(np.zeros((0, 4)), np.zeros(0), (1, 1), (1, 1))
+
+    @property
+    def deleted_track_ids(self):
+        return [track.track_id for track in self.tracker.removed_stracks]
+
+    def resume_ids(self, last_track_id):
+        self.tracker.track_count = max(self.tracker.track_count, int(last_track_id))
+
+
+def _to_numpy(values):
+    if hasattr(values, 'cpu'):
+        values = values.cpu().numpy()
+    return np.asarray(values)
+
+
 def joint_stracks(tlista, tlistb):
     exists = {}
     res = []
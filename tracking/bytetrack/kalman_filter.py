@@ -180,17 +180,78 @@ class KalmanFilter(object):
             self._std_weight_velocity * mean[:, 3]]
         sqr = np.square(np.r_[std_pos, std_vel]).T
 
-        motion_cov = []
-        for i in range(len(mean)):
-            motion_cov.append(np.diag(sqr[i]))
-        motion_cov = np.asarray(motion_cov)
-
         mean = np.dot(mean, self._motion_mat.T)
-        left = np.dot(self._motion_mat, covariance).transpose((1, 0, 2))
-        covariance = np.dot(left, self._motion_mat.T) + motion_cov
+        covariance = self._motion_mat @ covariance @ self._motion_mat.T
+        diagonal = np.arange(8)
+        covariance[:, diagonal, diagonal] += sqr
 
         return mean, covariance
 
+    def multi_project(self, mean, covariance):
+        """Project state distributions to measurement space (Vectorized version).
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean matrix of the object states.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrics of the object states.
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx4 projected means and Nx4x4 covariance matrices.
+        """
+        std = np.empty((len(mean), 4))
+        std[:, [0, 1, 3]] = self._std_weight_position * mean[:, 3:4]
+        std[:, 2] = 1e-1
+
+        projected_mean = np.dot(mean, self._update_mat.T)
+        projected_cov = self._update_mat @ covariance @ self._update_mat.T
+        diagonal = np.arange(4)
+        projected_cov[:, diagonal, diagonal] += np.square(std)
+        return projected_mean, projected_cov
+
+    def multi_update(self, mean, covariance, measurement):
+        """Run Kalman filter correction step (Vectorized version).
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional predicted mean matrix.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrics.
+        measurement : ndarray
+            The Nx4 dimensional measurements (x, y, a, h), one per state.
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the measurement-corrected state distributions.
+        """
+        projected_mean, projected_cov = self.multi_project(mean, covariance)
+
+        kalman_gain = np.linalg.solve(
+            projected_cov, (covariance @ self._update_mat.T).transpose(0, 2, 1)).transpose(0, 2, 1)
+        innovation = measurement - projected_mean
+
+        new_mean = mean + np.einsum('nij,nj->ni', kalman_gain, innovation)
+        new_covariance = covariance - kalman_gain @ projected_cov @ kalman_gain.transpose(0, 2, 1)
+        return new_mean, new_covariance
+
+    def multi_gating_distance(self, mean, covariance, measurements, only_position=False):
+        """Squared Mahalanobis distance between N state distributions and M
+        measurements (Vectorized version of `gating_distance`).
+        Returns
+        -------
+        ndarray
+            Returns an NxM matrix.
+        """
+        mean, covariance = self.multi_project(mean, covariance)
+        measurements = np.asarray(measurements, dtype=np.float64).reshape(-1, 4)
+        if only_position:
+            mean, covariance = mean[:, :2], covariance[:, :2, :2]
+            measurements = measurements[:, :2]
+
+        d = (measurements[None, :, :] - mean[:, None, :]).transpose(0, 2, 1)
+        return np.einsum('nkm,nkm->nm', d, np.linalg.solve(covariance, d))
+
     def update(self, mean, covariance, measurement):
         """Run Kalman filter correction step.
 
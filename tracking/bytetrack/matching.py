@@ -1,9 +1,8 @@
 import numpy as np
 import scipy
-import lap
+from scipy.optimize import linear_sum_assignment
 from scipy.spatial.distance import cdist
 
-from cython_bbox import bbox_overlaps as bbox_ious
 from . import kalman_filter
 
 
@@ -36,17 +35,35 @@ def _indices_to_matches(cost_matrix, indices, thresh):
 
 
 def linear_assignment(cost_matrix, thresh):
+    """
+    Minimum cost matching without pairs costing more than `thresh`
+    (SciPy replacement of `lap.lapjv(..., extend_cost=True, cost_limit=thresh)`).
+
+    Like lapjv's cost_limit, every row and column gets a dummy partner of cost
+    thresh / 2, so a pair is only matched when it is cheaper than leaving both
+    unmatched, not to maximise the number of matches.
+
+    :return: (K, 2) matched row/column indices, unmatched rows, unmatched columns
+    """
     if cost_matrix.size == 0:
         return np.empty((0, 2), dtype=int), tuple(range(cost_matrix.shape[0])), tuple(range(cost_matrix.shape[1]))
-    matches, unmatched_a, unmatched_b = [], [], []
-    cost, x, y = lap.lapjv(cost_matrix, extend_cost=True, cost_limit=thresh)
-    for ix, mx in enumerate(x):
-        if mx >= 0:
-            matches.append([ix, mx])
-    unmatched_a = np.where(x < 0)[0]
-    unmatched_b = np.where(y < 0)[0]
-    matches = np.asarray(matches)
-    return matches, unmatched_a, unmatched_b
+
+    n_rows, n_cols = cost_matrix.shape
+    extended = np.full((n_rows + n_cols, n_rows + n_cols), thresh / 2.0)
+    extended[n_rows:, n_cols:] = 0.0
+    # Infeasible pairs (inf, or above the threshold) always lose against the dummies
+    extended[:n_rows, :n_cols] = np.where(cost_matrix <= thresh, cost_matrix, thresh + 1e5)
+    rows, cols = linear_sum_assignment(extended)
+    keep = (rows < n_rows) & (cols < n_cols)
+    rows, cols = rows[keep], cols[keep]
+    keep = cost_matrix[rows, cols] <= thresh
+    matches = np.stack([rows[keep], cols[keep]], axis=1)
+
+    matched_a = np.zeros(cost_matrix.shape[0], dtype=bool)
+    matched_b = np.zeros(cost_matrix.shape[1], dtype=bool)
+    matched_a[matches[:, 0]] = True
+    matched_b[matches[:, 1]] = True
+    return matches, np.where(~matched_a)[0], np.where(~matched_b)[0]
 
 
 def bbox_ious(boxes1, boxes2):
@@ -99,14 +116,8 @@ def ious(atlbrs, btlbrs):
     ious = np.zeros((len(atlbrs), len(btlbrs)), dtype=np.float64)
     if ious.size == 0:
         return ious
-    
 
-    ious = bbox_ious(
-        np.ascontiguousarray(atlbrs, dtype=np.float32),
-        np.ascontiguousarray(btlbrs, dtype=np.float32)
-    )
-
-    return ious
+    return bbox_ious(atlbrs.reshape(-1, 4), btlbrs.reshape(-1, 4))
 
 def iou_distance(atracks, btracks):
     """
@@ -156,13 +167,13 @@ def embedding_distance(tracks, detections, metric='cosine'):
     :return: cost_matrix np.ndarray
     """
 
-    cost_matrix = np.zeros((len(tracks), len(detections)), dtype=np.float)
+    cost_matrix = np.zeros((len(tracks), len(detections)), dtype=np.float64)
     if cost_matrix.size == 0:
         return cost_matrix
-    det_features = np.asarray([track.curr_feat for track in detections], dtype=np.float)
+    det_features = np.asarray([track.curr_feat for track in detections], dtype=np.float64)
     #for i, track in enumerate(tracks):
         #cost_matrix[i, :] = np.maximum(0.0, cdist(track.smooth_feat.reshape(1,-1), det_features, metric))
-    track_features = np.asarray([track.smooth_feat for track in tracks], dtype=np.float)
+    track_features = np.asarray([track.smooth_feat for track in tracks], dtype=np.float64)
     cost_matrix = np.maximum(0.0, cdist(track_features, det_features, metric))  # Nomalized features
     return cost_matrix
 
@@ -173,10 +184,10 @@ def gate_cost_matrix(kf, cost_matrix, tracks, detections, only_position=False):
     gating_dim = 2 if only_position else 4
     gating_threshold = kalman_filter.chi2inv95[gating_dim]
     measurements = np.asarray([det.to_xyah() for det in detections])
-    for row, track in enumerate(tracks):
-        gating_distance = kf.gating_distance(
-            track.mean, track.covariance, measurements, only_position)
-        cost_matrix[row, gating_distance > gating_threshold] = np.inf
+    gating_distance = kf.multi_gating_distance(
+        np.asarray([track.mean for track in tracks]), np.asarray([track.covariance for track in tracks]),
+        measurements, only_position)
+    cost_matrix[gating_distance > gating_threshold] = np.inf
     return cost_matrix
 
 
@@ -186,12 +197,11 @@ def fuse_motion(kf, cost_matrix, tracks, detections, only_position=False, lambda
     gating_dim = 2 if only_position else 4
     gating_threshold = kalman_filter.chi2inv95[gating_dim]
     measurements = np.asarray([det.to_xyah() for det in detections])
-    for row, track in enumerate(tracks):
-        gating_distance = kf.gating_distance(
-            track.mean, track.covariance, measurements, only_position, metric='maha')
-        cost_matrix[row, gating_distance > gating_threshold] = np.inf
-        cost_matrix[row] = lambda_ * cost_matrix[row] + (1 - lambda_) * gating_distance
-    return cost_matrix
+    gating_distance = kf.multi_gating_distance(
+        np.asarray([track.mean for track in tracks]), np.asarray([track.covariance for track in tracks]),
+        measurements, only_position)
+    cost_matrix[gating_distance > gating_threshold] = np.inf
+    return lambda_ * cost_matrix + (1 - lambda_) * gating_distance
 
 
 def fuse_iou(cost_matrix, tracks, detections):
@@ -0,0 +1,150 @@
+"""
+Micro-benchmark of StrongSORT association: per-track loops against the
+vectorized AssociationCosts, for a growing number of tracks.
+
+    python -m tracking.strong_sort.benchmark_association --tracks 5 10 25 50 100 200
+"""
+import argparse
+import time
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from tracking.strong_sort.sort import kalman_filter, linear_assignment
+from tracking.strong_sort.sort.association import AssociationCosts
+from tracking.strong_sort.sort.iou_matching import iou
+from tracking.strong_sort.sort.nn_matching import NearestNeighborDistanceMetric
+from tracking.strong_sort.sort.track import Track
+
+
+class _Detection:
+    def __init__(self, tlwh, confidence, feature):
+        self.tlwh = np.asarray(tlwh, dtype=np.float32)
+        self.confidence = confidence
+        self.feature = np.asarray(feature, dtype=np.float32)
+
+    def to_xyah(self):
+        ret = self.tlwh.copy()
+        ret[:2] += ret[2:] / 2
+        ret[2] /= ret[3]
+        return ret
+
+
+def make_scene(num_tracks, feature_dim=512, budget=100, seed=0):
+    """Confirmed, predicted tracks and one noisy detection per track"""
+    rng = np.random.default_rng(seed)
+    kf = kalman_filter.KalmanFilter()
+    states = kalman_filter.StateArrays()
+    metric = NearestNeighborDistanceMetric('cosine', 0.2, budget)
+
+    boxes = np.c_[rng.uniform(0, 1800, (num_tracks, 2)), rng.uniform(30, 80, num_tracks),
+                  rng.uniform(80, 200, num_tracks)]
+    features = rng.normal(size=(num_tracks, feature_dim)).astype(np.float32)
+
+    tracks = []
+    for i, box in enumerate(boxes):
+        xyah = np.r_[box[:2] + box[2:] / 2, box[2] / box[3], box[3]]
+        track = Track(xyah, i + 1, 0, 0.9, 3, 30, 0.9, features[i].copy(), kf=kf, states=states)
+        track.state = 2  # TrackState.Confirmed
+        tracks.append(track)
+    metric.partial_fit(features, np.arange(1, num_tracks + 1), list(range(1, num_tracks + 1)))
+
+    slots = [t.slot for t in tracks]
+    states.means[slots], states.covariances[slots] = kf.multi_predict(states.means[slots], states.covariances[slots])
+    for track in tracks:
+        track.increment_age()
+
+    detections = [
+        _Detection(box + rng.normal(0, 2, 4), 0.8, feature + rng.normal(0, 0.1, feature_dim))
+        for box, feature in zip(boxes, features)
+    ]
+    return kf, metric, tracks, detections
+
+
+def _loop_min_cost_matching(cost_matrix, max_distance, track_indices, detection_indices):
+    """Assignment with the list scans the tracker used before"""
+    cost_matrix[cost_matrix > max_distance] = max_distance + 1e-5
+    row_indices, col_indices = linear_sum_assignment(cost_matrix)
+    matches, unmatched_tracks, unmatched_detections = [], [], []
+    for col, detection_idx in enumerate(detection_indices):
+        if col not in col_indices:
+            unmatched_detections.append(detection_idx)
+    for row, track_idx in enumerate(track_indices):
+        if row not in row_indices:
+            unmatched_tracks.append(track_idx)
+    for row, col in zip(row_indices, col_indices):
+        if cost_matrix[row, col] > max_distance:
+            unmatched_tracks.append(track_indices[row])
+            unmatched_detections.append(detection_indices[col])
+        else:
+            matches.append((track_indices[row], detection_indices[col]))
+    return matches, unmatched_tracks, unmatched_detections
+
+
+def associate_loop(kf, metric, tracks, detections):
+    """Appearance + gating and IoU association with one Kalman/IoU call per track"""
+    track_indices = list(range(len(tracks)))
+    detection_indices = list(range(len(detections)))
+
+    features = np.array([d.feature for d in detections])
+    cost_matrix = metric.distance(features, np.array([t.track_id for t in tracks]))
+    measurements = np.asarray([d.to_xyah() for d in detections])
+    for row, track in enumerate(tracks):
+        gating_distance = kf.gating_distance(track.mean, track.covariance, measurements)
+        cost_matrix[row, gating_distance > kalman_filter.chi2inv95[4]] = linear_assignment.INFTY_COST
+        cost_matrix[row] = 0.995 * cost_matrix[row] + (1 - 0.995) * gating_distance
+    _loop_min_cost_matching(cost_matrix, metric.matching_threshold, track_indices, detection_indices)
+
+    iou_cost = np.zeros((len(tracks), len(detections)))
+    for row, track in enumerate(tracks):
+        candidates = np.asarray([d.tlwh for d in detections])
+        iou_cost[row] = 1. - iou(track.to_tlwh(), candidates)
+    return _loop_min_cost_matching(iou_cost, 0.7, track_indices, detection_indices)
+
+
+def associate_vectorized(kf, metric, tracks, detections):
+    """The same two stages from one AssociationCosts"""
+    track_indices = list(range(len(tracks)))
+    detection_indices = list(range(len(detections)))
+    costs = AssociationCosts(kf, metric, tracks, detections)
+    linear_assignment.min_cost_matching(
+        costs.gated_appearance_cost, metric.matching_threshold, tracks, detections, track_indices, detection_indices)
+    return linear_assignment.min_cost_matching(
+        costs.iou_cost, 0.7, tracks, detections, track_indices, detection_indices)
+
+
+def appearance_only(kf, metric, tracks, detections):
+    """The nearest neighbor distance both variants compute once"""
+    return metric.distance(np.array([d.feature for d in detections]), np.array([t.track_id for t in tracks]))
+
+
+def _time(fn, args, repeat):
+    fn(*args)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(*args)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tracks', type=int, nargs='+', default=[5, 10, 25, 50, 100, 200])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    # The appearance distance is the same matrix product in both variants, so the
+    # last column compares only what is left: gating, IoU and assignment
+    print(f"{'tracks':>6} {'loop ms':>10} {'vectorized ms':>14} {'appearance ms':>14} {'speedup':>8} "
+          f"{'w/o appearance':>15}")
+    for num_tracks in args.tracks:
+        scene = make_scene(num_tracks)
+        loop_ms = _time(associate_loop, scene, args.repeat)
+        vectorized_ms = _time(associate_vectorized, scene, args.repeat)
+        appearance_ms = _time(appearance_only, scene, args.repeat)
+        rest = (loop_ms - appearance_ms) / max(vectorized_ms - appearance_ms, 1e-6)
+        print(f"{num_tracks:>6} {loop_ms:>10.3f} {vectorized_ms:>14.3f} {appearance_ms:>14.3f} "
+              f"{loop_ms / vectorized_ms:>7.1f}x {rest:>14.1f}x")
+
+
+if __name__ == '__main__':
+    main()
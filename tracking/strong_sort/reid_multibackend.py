@@ -2,7 +2,6 @@ import torch.nn as nn
 import torch
 from pathlib import Path
 import numpy as np
-import torchvision.transforms as transforms
 import cv2
 from collections import OrderedDict, namedtuple
 import gdown
@@ -27,7 +26,7 @@ def check_suffix(file='yolov5s.pt', suffix=('.pt',), msg=''):
 
 class ReIDDetectMultiBackend(nn.Module):
     # ReID models MultiBackend class for python inference on various backends
-    def __init__(self, weights='osnet_x0_25_msmt17.pt', device=torch.device('cpu'), fp16=False):
+    def __init__(self, weights='osnet_x0_25_msmt17.pt', device=torch.device('cpu'), fp16=False, max_batch_size=32):
         super().__init__()
         w = str(weights[0] if isinstance(weights, list) else weights)
         self.pt, self.jit, self.onnx, self.xml, self.engine, self.coreml, \
@@ -86,13 +85,14 @@ class ReIDDetectMultiBackend(nn.Module):
                 if model.binding_is_input(index):
                     if -1 in tuple(model.get_binding_shape(index)):  # dynamic
                         self.dynamic = True
-                        context.set_binding_shape(index, tuple(model.get_profile_shape(0, index)[2]))
+                        self.context.set_binding_shape(index, tuple(model.get_profile_shape(0, index)[2]))
                     if dtype == np.float16:
                         fp16 = True
                 shape = tuple(self.context.get_binding_shape(index))
                 data = torch.from_numpy(np.empty(shape, dtype=np.dtype(dtype))).to(device)
                 self.bindings[name] = Binding(name, dtype, shape, data, int(data.data_ptr()))
             self.binding_addrs = OrderedDict((n, d.ptr) for n, d in self.bindings.items())
+            self.model = model
             batch_size = self.bindings['images'].shape[0]  # if dynamic, this is instead max batch size
         
         elif self.tflite:
@@ -122,13 +122,21 @@ class ReIDDetectMultiBackend(nn.Module):
             
         pixel_mean=[0.485, 0.456, 0.406]
         pixel_std=[0.229, 0.224, 0.225]
-        self.norm = transforms.Compose([
-            transforms.ToTensor(),
-            transforms.Normalize(pixel_mean, pixel_std),
-        ])
-        self.size = (256, 128)
+        self.size = (256, 128)  # cv2 dsize (width, height)
         self.device = device
-        
+        # Scaled to 0..255 so uint8 crops are normalized with a single sub/div on the batch
+        self.pixel_mean = torch.tensor(pixel_mean, device=device).view(1, 3, 1, 1) * 255
+        self.pixel_std = torch.tensor(pixel_std, device=device).view(1, 3, 1, 1) * 255
+
+        # Crops go through the model in chunks of at most batch_size; models exported with a fixed
+        # batch size always get full chunks, padded with the previous contents of the input buffer.
+        # Both buffers are reused across frames: resized uint8 crops on the host, normalized input on the device
+        self.batch_size, self.static_batch = self._batch_limits(max_batch_size)
+        width, height = self.size
+        self.crop_buffer = np.zeros((self.batch_size, height, width, 3), dtype=np.uint8)
+        self.input_buffer = torch.zeros((self.batch_size, 3, height, width),
+                                        dtype=torch.half if self.fp16 else torch.float, device=self.device)
+
         
     @staticmethod
     def model_type(p='path/to/model.pt'):
@@ -142,70 +150,94 @@ class ReIDDetectMultiBackend(nn.Module):
         tflite &= not edgetpu  # *.tflite
         return pt, jit, onnx, xml, engine, coreml, saved_model, pb, tflite, edgetpu, tfjs
     
+    def _batch_limits(self, max_batch_size):
+        # Returns (chunk size, whether the model only accepts exactly that batch size)
+        if self.onnx:
+            batch = self.session.get_inputs()[0].shape[0]
+            if isinstance(batch, int):
+                return batch, True
+        elif self.engine:
+            return self.bindings['images'].shape[0], not self.dynamic
+        elif self.tflite:
+            return int(self.input_details[0]['shape'][0]), True
+        return max(1, int(max_batch_size)), False
+
     def warmup(self, imgsz=(1, 256, 128, 3)):
         # Warmup model by running inference once
         warmup_types = self.pt, self.jit, self.onnx, self.engine, self.saved_model, self.pb
         if any(warmup_types) and self.device.type != 'cpu':
-            im = torch.zeros(*imgsz, dtype=torch.half if self.fp16 else torch.float, device=self.device)  # input
-            im = im.cpu().numpy()
+            im = np.zeros(imgsz, dtype=np.uint8)  # input crops
             for _ in range(2 if self.jit else 1):  #
                 self.forward(im)  # warmup
 
     def preprocess(self, im_crops):
-        def _resize(im, size):
-            return cv2.resize(im.astype(np.float32), size)
+        """Resize uint8 crops into the crop buffer and normalize them on the device in one pass"""
+        n = len(im_crops)
+        crops = self.crop_buffer[:n]
+        for im, dst in zip(im_crops, crops):
+            cv2.resize(im, self.size, dst=dst)
 
-        im = torch.cat([self.norm(_resize(im, self.size)).unsqueeze(0) for im in im_crops], dim=0).float()
-        im = im.float().to(device=self.device)
-        return im
+        # Only uint8 data is copied to the device, the float conversion happens there
+        im = self.input_buffer[:n]
+        im.copy_(torch.from_numpy(crops).permute(0, 3, 1, 2))
+        return im.sub_(self.pixel_mean).div_(self.pixel_std)
     
+    @torch.no_grad()
     def forward(self, im_batch):
-        im_batch = self.preprocess(im_batch)
-        b, ch, h, w = im_batch.shape  # batch, channel, height, width
+        """Appearance features of all crops, (N, D) float tensor on the model device"""
         features = []
-        for i in range(0, im_batch.shape[0]):
-            im = im_batch[i, :, :, :].unsqueeze(0)
-            if self.fp16 and im.dtype != torch.float16:
-                im = im.half()  # to FP16
-            if self.pt:  # PyTorch
-                y = self.extractor.model(im)[0]
-            elif self.jit:  # TorchScript
-                y = self.model(im)[0]
-            elif self.onnx:  # ONNX Runtime
-                im = im.permute(0, 1, 3, 2).cpu().numpy()  # torch to numpy
-                y = self.session.run([self.session.get_outputs()[0].name], {self.session.get_inputs()[0].name: im})[0]
-            elif self.xml:  # OpenVINO
-                im = im.cpu().numpy()  # FP32
-                y = self.executable_network([im])[self.output_layer]
-            elif self.engine:  # TensorRT
-                im = im.permute(0, 1, 3, 2)
-                if self.dynamic and im.shape != self.bindings['images'].shape:
-                    i_in, i_out = (self.model.get_binding_index(x) for x in ('images', 'output'))
-                    self.context.set_binding_shape(i_in, im.shape)  # reshape if dynamic
-                    self.bindings['images'] = self.bindings['images']._replace(shape=im.shape)
-                    self.bindings['output'].data.resize_(tuple(self.context.get_binding_shape(i_out)))
-                s = self.bindings['images'].shape
-                assert im.shape == s, f"input size {im.shape} {'>' if self.dynamic else 'not equal to'} max model size {s}"
-                self.binding_addrs['images'] = int(im.data_ptr())
-                self.context.execute_v2(list(self.binding_addrs.values()))
-                y = self.bindings['output'].data
-            else:  # TensorFlow (SavedModel, GraphDef, Lite, Edge TPU)
-                im = im.permute(0, 3, 2, 1).cpu().numpy()  # torch BCHW to numpy BHWC shape(1,320,192,3)
-                input, output = self.input_details[0], self.output_details[0]
-                int8 = input['dtype'] == np.uint8  # is TFLite quantized uint8 model
-                if int8:
-                    scale, zero_point = input['quantization']
-                    im = (im / scale + zero_point).astype(np.uint8)  # de-scale
-                self.interpreter.set_tensor(input['index'], im)
-                self.interpreter.invoke()
-                y = torch.tensor(self.interpreter.get_tensor(output['index']))
-                if int8:
-                    scale, zero_point = output['quantization']
-                    y = (y.astype(np.float32) - zero_point) * scale  # re-scale
-            
-            if isinstance(y, np.ndarray):
-                y = torch.tensor(y, device=self.device)
-            features.append(y.squeeze())
+        for start in range(0, len(im_batch), self.batch_size):
+            crops = im_batch[start:start + self.batch_size]
+            n = len(crops)
+            im = self.preprocess(crops)
+            if self.static_batch:
+                # Fixed-batch models always run on the whole buffer, the extra rows are ignored
+                im = self.input_buffer
+            features.append(self._infer(im)[:n].float())
 
-        
-        return features
\ No newline at end of file
+        if not features:
+            return torch.empty((0, 0), device=self.device)
+        return torch.cat(features, dim=0)
+
+    def _infer(self, im):
+        # One forward call for the whole (B, 3, H, W) batch, returns (B, D)
+        if self.pt:  # PyTorch
+            y = self.extractor.model(im)
+        elif self.jit:  # TorchScript
+            y = self.model(im)
+        elif self.onnx:  # ONNX Runtime
+            im = im.permute(0, 1, 3, 2).cpu().numpy()  # torch to numpy
+            y = self.session.run([self.session.get_outputs()[0].name], {self.session.get_inputs()[0].name: im})[0]
+        elif self.xml:  # OpenVINO
+            im = im.cpu().numpy()  # FP32
+            y = self.executable_network([im])[self.output_layer]
+        elif self.engine:  # TensorRT
+            im = im.permute(0, 1, 3, 2).contiguous()
+            if self.dynamic and im.shape != self.bindings['images'].shape:
+                i_in, i_out = (self.model.get_binding_index(x) for x in ('images', 'output'))
+                self.context.set_binding_shape(i_in, im.shape)  # reshape if dynamic
+                self.bindings['images'] = self.bindings['images']._replace(shape=im.shape)
+                self.bindings['output'].data.resize_(tuple(self.context.get_binding_shape(i_out)))
+            s = self.bindings['images'].shape
+            assert im.shape == s, f"input size {im.shape} {'>' if self.dynamic else 'not equal to'} max model size {s}"
+            self.binding_addrs['images'] = int(im.data_ptr())
+            self.context.execute_v2(list(self.binding_addrs.values()))
+            # The output binding is reused by the next chunk
+            y = self.bindings['output'].data.clone()
+        else:  # TensorFlow (SavedModel, GraphDef, Lite, Edge TPU)
+            im = im.permute(0, 3, 2, 1).cpu().numpy()  # torch BCHW to numpy BHWC shape(1,320,192,3)
+            input, output = self.input_details[0], self.output_details[0]
+            int8 = input['dtype'] == np.uint8  # is TFLite quantized uint8 model
+            if int8:
+                scale, zero_point = input['quantization']
+                im = (im / scale + zero_point).astype(np.uint8)  # de-scale
+            self.interpreter.set_tensor(input['index'], im)
+            self.interpreter.invoke()
+            y = self.interpreter.get_tensor(output['index'])
+            if int8:
+                scale, zero_point = output['quantization']
+                y = (y.astype(np.float32) - zero_point) * scale  # re-scale
+
+        if isinstance(y, np.ndarray):
+            y = torch.from_numpy(y).to(self.device)
+        return y.reshape(y.shape[0], -1)
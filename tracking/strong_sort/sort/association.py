@@ -0,0 +1,174 @@
+# vim: expandtab:ts=4:sw=4
+from __future__ import absolute_import
+import numpy as np
+from . import kalman_filter
+from . import linear_assignment
+
+
+def tlwh_from_states(means):
+    """Convert Nx8 Kalman state means to Nx4 boxes `(top left x, top left y,
+    width, height)`, the vectorized version of `Track.to_tlwh`.
+    """
+    ret = np.array(means[:, :4], dtype=np.float64)
+    ret[:, 2] *= ret[:, 3]
+    ret[:, :2] -= ret[:, 2:] / 2
+    return ret
+
+
+def iou_matrix(bboxes, candidates):
+    """Compute intersection over union of every box with every candidate.
+
+    Parameters
+    ----------
+    bboxes : ndarray
+        An Nx4 matrix of bounding boxes in format `(top left x, top left y,
+        width, height)`.
+    candidates : ndarray
+        An Mx4 matrix of candidate bounding boxes in the same format.
+
+    Returns
+    -------
+    ndarray
+        The NxM intersection over union matrix in [0, 1].
+
+    """
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    candidates = np.asarray(candidates, dtype=np.float64).reshape(-1, 4)
+
+    tl = np.maximum(bboxes[:, None, :2], candidates[None, :, :2])
+    br = np.minimum(bboxes[:, None, :2] + bboxes[:, None, 2:],
+                    candidates[None, :, :2] + candidates[None, :, 2:])
+    area_intersection = np.maximum(0., br - tl).prod(axis=2)
+    area_bboxes = bboxes[:, 2:].prod(axis=1)
+    area_candidates = candidates[:, 2:].prod(axis=1)
+    return area_intersection / (area_bboxes[:, None] + area_candidates[None, :] - area_intersection)
+
+
+class AssociationCosts(object):
+    """
+    All track x detection association costs of one time step.
+
+    The IoU, the squared Mahalanobis (gating) distance and the appearance
+    distance are computed once for every track and detection with matrix
+    operations; the matching stages then only slice the rows and columns
+    they need, so no cost is recomputed per track or per stage.
+
+    Parameters
+    ----------
+    kf : kalman_filter.KalmanFilter
+        The Kalman filter.
+    metric : nn_matching.NearestNeighborDistanceMetric
+        The appearance distance metric.
+    tracks : List[track.Track]
+        The predicted tracks at the current time step.
+    detections : List[detection.Detection]
+        The detections at the current time step.
+    appearance_indices : Optional[List[int]]
+        Tracks whose appearance distance is computed (tracks that are known
+        to `metric`, i.e. confirmed ones). Defaults to all tracks. Other rows
+        of `appearance` are set to `linear_assignment.INFTY_COST`.
+
+    Attributes
+    ----------
+    iou : ndarray
+        NxM intersection over union of the predicted track and detection boxes.
+    gating_distance : ndarray
+        NxM squared Mahalanobis distance between track states and detections.
+    appearance : ndarray
+        NxM nearest neighbor appearance distance, `linear_assignment.INFTY_COST`
+        for detections without a feature.
+    time_since_update : ndarray
+        Frames since the last measurement update of every track.
+
+    """
+
+    def __init__(self, kf, metric, tracks, detections, appearance_indices=None):
+        n, m = len(tracks), len(detections)
+        self.time_since_update = np.array([t.time_since_update for t in tracks], dtype=np.int64)
+        means = np.array([t.mean for t in tracks]).reshape(n, 8)
+        covariances = np.array([t.covariance for t in tracks]).reshape(n, 8, 8)
+        det_tlwh = np.array([d.tlwh for d in detections], dtype=np.float64).reshape(m, 4)
+
+        self.iou = iou_matrix(tlwh_from_states(means), det_tlwh)
+
+        det_xyah = det_tlwh.copy()
+        det_xyah[:, :2] += det_xyah[:, 2:] / 2
+        det_xyah[:, 2] /= det_xyah[:, 3]
+        self.gating_distance = kf.multi_gating_distance(means, covariances, det_xyah) \
+            if n and m else np.zeros((n, m))
+
+        if appearance_indices is None:
+            appearance_indices = np.arange(n)
+        # Detections matched by motion alone carry no feature (adaptive ReID)
+        feature_indices = [j for j, d in enumerate(detections) if d.feature is not None]
+        self.appearance = np.full((n, m), linear_assignment.INFTY_COST)
+        if len(appearance_indices) and feature_indices:
+            self.appearance[np.ix_(np.asarray(appearance_indices, dtype=np.int64), feature_indices)] = \
+                metric.distance(
+                    np.array([detections[j].feature for j in feature_indices]),
+                    np.array([tracks[i].track_id for i in appearance_indices]))
+
+    def iou_cost(self, tracks, detections, track_indices, detection_indices):
+        """`1 - iou` for the given tracks and detections, infeasible for tracks
+        that missed more than one frame (same as `iou_matching.iou_cost`).
+        """
+        rows = np.asarray(track_indices, dtype=np.int64)
+        cost_matrix = 1. - self.iou[np.ix_(rows, np.asarray(detection_indices, dtype=np.int64))]
+        cost_matrix[self.time_since_update[rows] > 1] = linear_assignment.INFTY_COST
+        return cost_matrix
+
+    def gated_appearance_cost(self, tracks, detections, track_indices, detection_indices,
+                              gated_cost=linear_assignment.INFTY_COST):
+        """Appearance cost gated and blended with the Mahalanobis distance
+        (same as the metric's distance passed through
+        `linear_assignment.gate_cost_matrix`).
+        """
+        index = np.ix_(np.asarray(track_indices, dtype=np.int64), np.asarray(detection_indices, dtype=np.int64))
+        gating_distance = self.gating_distance[index]
+        cost_matrix = self.appearance[index]
+        cost_matrix[gating_distance > kalman_filter.chi2inv95[4]] = gated_cost
+        return 0.995 * cost_matrix + (1 - 0.995) * gating_distance
+
+
+def unambiguous_matches(iou, candidates, min_iou=0.5, margin=0.3):
+    """Find track/detection pairs that motion alone associates without doubt.
+
+    A pair qualifies if both are each other's best overlap, the overlap is
+    at least `min_iou`, and no other detection of the track and no other
+    track of the detection comes within `margin` of it (no crossing paths).
+
+    Parameters
+    ----------
+    iou : ndarray
+        NxM intersection over union of all track and detection boxes.
+    candidates : ndarray
+        N boolean mask of tracks that may be matched this way. All tracks
+        count as competitors for a detection.
+    min_iou : float
+        Minimum overlap of a pair.
+    margin : float
+        Required lead of the best overlap over the second best, per track and
+        per detection.
+
+    Returns
+    -------
+    List[(int, int)]
+        Matched (row, column) pairs.
+
+    """
+    n, m = iou.shape
+    if n == 0 or m == 0:
+        return []
+
+    best_col = iou.argmax(axis=1)
+    best_row = iou.argmax(axis=0)
+    best = iou[np.arange(n), best_col]
+    # Second best overlap per row and per column, 0 if there is none
+    row_second = np.sort(iou, axis=1)[:, -2] if m > 1 else np.zeros(n)
+    col_second = np.sort(iou, axis=0)[-2] if n > 1 else np.zeros(m)
+
+    qualified = (
+        candidates & (best_row[best_col] == np.arange(n)) & (best >= min_iou) &
+        (row_second < best - margin) & (col_second[best_col] < best - margin)
+    )
+    return [(int(row), int(best_col[row])) for row in np.nonzero(qualified)[0]]
@@ -0,0 +1,119 @@
+# vim: expandtab:ts=4:sw=4
+import cv2
+import numpy as np
+
+
+CMC_ECC = 'ecc'
+CMC_SPARSE_FLOW = 'sparse_flow'
+
+
+class CameraMotionCompensation(object):
+    """
+    Global camera motion between consecutive frames, estimated once per frame.
+
+    Frames are converted to grayscale and downscaled before estimation; the
+    previous frame (and for sparse optical flow its corners) is cached, so
+    every frame is prepared only once. The returned warp is in full
+    resolution pixel coordinates and can be applied to all tracks at once
+    (see `Tracker.camera_update`).
+
+    Parameters
+    ----------
+    method : str
+        `ecc` (OpenCV ECC, euclidean motion) or `sparse_flow` (Lucas-Kanade
+        optical flow on Shi-Tomasi corners + RANSAC similarity transform).
+    scale : float
+        Resize factor of the frames used for estimation.
+    max_corners : int
+        Number of corners tracked by `sparse_flow`.
+    eps, max_iter : float, int
+        ECC termination criteria.
+
+    """
+
+    def __init__(self, method=CMC_ECC, scale=0.25, max_corners=300, eps=1e-5, max_iter=100):
+        if method not in (CMC_ECC, CMC_SPARSE_FLOW):
+            raise ValueError(f"Unknown camera motion compensation method: {method}")
+        self.method = method
+        self.scale = scale
+        self.max_corners = max_corners
+        self.criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, max_iter, eps)
+
+        self._previous = None
+        self._previous_points = None
+
+    def reset(self):
+        self._previous = None
+        self._previous_points = None
+
+    def apply(self, frame):
+        """Estimate the warp from the previous frame to `frame`.
+
+        Parameters
+        ----------
+        frame : ndarray
+            The current BGR (or grayscale) frame.
+
+        Returns
+        -------
+        ndarray
+            2x3 affine warp matrix in full resolution coordinates, identity for
+            the first frame or if the estimation failed.
+
+        """
+        current = self._prepare(frame)
+        previous, self._previous = self._previous, current
+
+        warp = np.eye(2, 3)
+        if previous is None or previous.shape != current.shape:
+            self._previous_points = None
+            if self.method == CMC_SPARSE_FLOW:
+                self._previous_points = self._corners(current)
+            return warp
+
+        if self.method == CMC_ECC:
+            estimated = self._ecc(previous, current)
+        else:
+            estimated = self._sparse_flow(previous, current)
+
+        if estimated is not None:
+            warp = estimated.astype(np.float64)
+            # Back to full resolution: only the translation depends on the scale
+            warp[:, 2] /= self.scale
+            # Same sanity check as Track.get_matrix
+            if np.linalg.norm(np.eye(3) - np.vstack([warp, [0, 0, 1]])) >= 100:
+                warp = np.eye(2, 3)
+        return warp
+
+    def _prepare(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        if self.scale != 1:
+            gray = cv2.resize(gray, (0, 0), fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return gray
+
+    def _corners(self, gray):
+        return cv2.goodFeaturesToTrack(
+            gray, maxCorners=self.max_corners, qualityLevel=0.01, minDistance=1, blockSize=3)
+
+    def _ecc(self, previous, current):
+        warp = np.eye(2, 3, dtype=np.float32)
+        try:
+            _, warp = cv2.findTransformECC(previous, current, warp, cv2.MOTION_EUCLIDEAN, self.criteria, None, 1)
+        except cv2.error:
+            return None
+        # Maps previous frame coordinates to current frame coordinates, like Track.ECC
+        return warp
+
+    def _sparse_flow(self, previous, current):
+        previous_points = self._previous_points
+        self._previous_points = self._corners(current)
+        if previous_points is None or len(previous_points) < 4:
+            return None
+
+        points, status, _ = cv2.calcOpticalFlowPyrLK(previous, current, previous_points, None)
+        status = status.reshape(-1).astype(bool)
+        if status.sum() < 4:
+            return None
+
+        warp, _ = cv2.estimateAffinePartial2D(previous_points[status], points[status], method=cv2.RANSAC)
+        return warp
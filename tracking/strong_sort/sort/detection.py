@@ -29,7 +29,8 @@ class Detection(object):
             tlwh = tlwh.cpu().numpy()
         self.tlwh = np.asarray(tlwh, dtype=np.float32)
         self.confidence = float(confidence)
-        self.feature = np.asarray(feature.detach().cpu(), dtype=np.float32)
+        # None when the detection was matched by motion only and ReID was skipped
+        self.feature = np.asarray(feature.detach().cpu(), dtype=np.float32) if feature is not None else None
 
     def to_tlbr(self):
         """Convert bounding box to format `(min x, min y, max x, max y)`, i.e.,
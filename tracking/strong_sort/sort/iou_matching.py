@@ -1,6 +1,7 @@
 # vim: expandtab:ts=4:sw=4
 from __future__ import absolute_import
 import numpy as np
+from . import association
 from . import linear_assignment
 
 
@@ -69,14 +70,9 @@ def iou_cost(tracks, detections, track_indices=None,
     if detection_indices is None:
         detection_indices = np.arange(len(detections))
 
-    cost_matrix = np.zeros((len(track_indices), len(detection_indices)))
-    for row, track_idx in enumerate(track_indices):
-        if tracks[track_idx].time_since_update > 1:
-            cost_matrix[row, :] = linear_assignment.INFTY_COST
-            continue
-
-        bbox = tracks[track_idx].to_tlwh()
-        candidates = np.asarray(
-            [detections[i].tlwh for i in detection_indices])
-        cost_matrix[row, :] = 1. - iou(bbox, candidates)
+    bboxes = np.asarray([tracks[i].to_tlwh() for i in track_indices])
+    candidates = np.asarray([detections[i].tlwh for i in detection_indices])
+    cost_matrix = 1. - association.iou_matrix(bboxes, candidates)
+    missed = np.array([tracks[i].time_since_update > 1 for i in track_indices], dtype=bool)
+    cost_matrix[missed] = linear_assignment.INFTY_COST
     return cost_matrix
@@ -211,4 +211,142 @@ class KalmanFilter(object):
             cholesky_factor, d.T, lower=True, check_finite=False,
             overwrite_b=True)
         squared_maha = np.sum(z * z, axis=0)
-        return squared_maha
\ No newline at end of file
+        return squared_maha
+
+    def multi_predict(self, mean, covariance):
+        """Run Kalman filter prediction step (Vectorized version).
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean matrix of the object states at the previous
+            time step.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices of the object states at the
+            previous time step.
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the mean matrix and covariance matrices of the predicted
+            states.
+        """
+        sqr = np.square(mean[:, :4] * np.r_[
+            self._std_weight_position, self._std_weight_position, 1., self._std_weight_position,
+            self._std_weight_velocity, self._std_weight_velocity, 0.1, self._std_weight_velocity
+        ].reshape(2, 4)[:, None, :]).transpose(1, 0, 2).reshape(len(mean), 8)
+
+        mean = np.dot(mean, self._motion_mat.T)
+        covariance = self._motion_mat @ covariance @ self._motion_mat.T
+        diagonal = np.arange(8)
+        covariance[:, diagonal, diagonal] += sqr
+        return mean, covariance
+
+    def multi_project(self, mean, covariance, confidence=.0):
+        """Project state distributions to measurement space (Vectorized version).
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean matrix of the object states.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices of the object states.
+        confidence : float | ndarray
+            Detection confidence per state (scalar or length N).
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the projected Nx4 means and Nx4x4 covariance matrices.
+        """
+        std = np.empty((len(mean), 4))
+        std[:, [0, 1, 3]] = self._std_weight_position * mean[:, 3:4]
+        std[:, 2] = 1e-1
+        std *= (1 - np.asarray(confidence, dtype=float)).reshape(-1, 1)
+
+        projected_mean = np.dot(mean, self._update_mat.T)
+        projected_cov = self._update_mat @ covariance @ self._update_mat.T
+        diagonal = np.arange(4)
+        projected_cov[:, diagonal, diagonal] += np.square(std)
+        return projected_mean, projected_cov
+
+    def multi_update(self, mean, covariance, measurement, confidence=.0):
+        """Run Kalman filter correction step (Vectorized version).
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional predicted mean matrix.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices.
+        measurement : ndarray
+            The Nx4 dimensional measurements (x, y, a, h), one per state.
+        confidence : float | ndarray
+            Detection confidence per measurement (scalar or length N).
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the measurement-corrected state distributions.
+        """
+        projected_mean, projected_cov = self.multi_project(mean, covariance, confidence)
+
+        # K = P H^T S^-1, solved for all states at once
+        kalman_gain = np.linalg.solve(
+            projected_cov, (covariance @ self._update_mat.T).transpose(0, 2, 1)).transpose(0, 2, 1)
+        innovation = measurement - projected_mean
+
+        new_mean = mean + np.einsum('nij,nj->ni', kalman_gain, innovation)
+        new_covariance = covariance - kalman_gain @ projected_cov @ kalman_gain.transpose(0, 2, 1)
+        return new_mean, new_covariance
+
+    def multi_gating_distance(self, mean, covariance, measurements,
+                              only_position=False):
+        """Compute gating distance between N state distributions and M measurements
+        (Vectorized version of `gating_distance`).
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean matrix of the state distributions.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices of the state distributions.
+        measurements : ndarray
+            An Mx4 dimensional matrix of M measurements in format (x, y, a, h).
+        only_position : Optional[bool]
+            If True, distance computation is done with respect to the bounding
+            box center position only.
+        Returns
+        -------
+        ndarray
+            Returns an NxM matrix, where element (i, j) contains the squared
+            Mahalanobis distance between state i and `measurements[j]`.
+        """
+        mean, covariance = self.multi_project(mean, covariance)
+        measurements = np.asarray(measurements, dtype=float).reshape(-1, 4)
+
+        if only_position:
+            mean, covariance = mean[:, :2], covariance[:, :2, :2]
+            measurements = measurements[:, :2]
+
+        d = (measurements[None, :, :] - mean[:, None, :]).transpose(0, 2, 1)
+        return np.einsum('nkm,nkm->nm', d, np.linalg.solve(covariance, d))
+
+
+class StateArrays(object):
+    """
+    Struct-of-arrays storage of the Kalman state of many tracks: row `slot` of
+    `means` (Nx8) and `covariances` (Nx8x8) belongs to one track, so the
+    tracker can predict, update and gate all tracks with the vectorized
+    KalmanFilter methods. Released slots are reused, the arrays grow by
+    doubling.
+    """
+
+    def __init__(self, capacity=64, ndim=8):
+        self.means = np.zeros((capacity, ndim))
+        self.covariances = np.zeros((capacity, ndim, ndim))
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def allocate(self):
+        if not self._free:
+            capacity = len(self.means)
+            self.means = np.concatenate([self.means, np.zeros_like(self.means)])
+            self.covariances = np.concatenate([self.covariances, np.zeros_like(self.covariances)])
+            self._free = list(range(2 * capacity - 1, capacity - 1, -1))
+        return self._free.pop()
+
+    def release(self, slot):
+        self._free.append(slot)
@@ -54,21 +54,20 @@ def min_cost_matching(
     cost_matrix[cost_matrix > max_distance] = max_distance + 1e-5
     row_indices, col_indices = linear_sum_assignment(cost_matrix)
 
-    matches, unmatched_tracks, unmatched_detections = [], [], []
-    for col, detection_idx in enumerate(detection_indices):
-        if col not in col_indices:
-            unmatched_detections.append(detection_idx)
-    for row, track_idx in enumerate(track_indices):
-        if row not in row_indices:
-            unmatched_tracks.append(track_idx)
-    for row, col in zip(row_indices, col_indices):
-        track_idx = track_indices[row]
-        detection_idx = detection_indices[col]
-        if cost_matrix[row, col] > max_distance:
-            unmatched_tracks.append(track_idx)
-            unmatched_detections.append(detection_idx)
-        else:
-            matches.append((track_idx, detection_idx))
+    # Unassigned rows and columns first, then assigned pairs above the threshold
+    track_indices = np.asarray(track_indices)
+    detection_indices = np.asarray(detection_indices)
+    accepted = cost_matrix[row_indices, col_indices] <= max_distance
+    assigned_rows = np.zeros(len(track_indices), dtype=bool)
+    assigned_rows[row_indices] = True
+    assigned_cols = np.zeros(len(detection_indices), dtype=bool)
+    assigned_cols[col_indices] = True
+
+    matches = list(zip(track_indices[row_indices[accepted]].tolist(),
+                       detection_indices[col_indices[accepted]].tolist()))
+    unmatched_tracks = track_indices[~assigned_rows].tolist() + track_indices[row_indices[~accepted]].tolist()
+    unmatched_detections = \
+        detection_indices[~assigned_cols].tolist() + detection_indices[col_indices[~accepted]].tolist()
     return matches, unmatched_tracks, unmatched_detections
 
 
@@ -164,11 +163,15 @@ def gate_cost_matrix(
     """
     gating_dim = 2 if only_position else 4
     gating_threshold = kalman_filter.chi2inv95[gating_dim]
+    if len(track_indices) == 0 or len(detection_indices) == 0:
+        return cost_matrix
     measurements = np.asarray(
         [detections[i].to_xyah() for i in detection_indices])
-    for row, track_idx in enumerate(track_indices):
-        track = tracks[track_idx]
-        gating_distance = track.kf.gating_distance(track.mean, track.covariance, measurements, only_position)
-        cost_matrix[row, gating_distance > gating_threshold] = gated_cost
-        cost_matrix[row] = 0.995 * cost_matrix[row] + (1 - 0.995) *  gating_distance
+    # Gate all tracks against all detections in one vectorized call
+    means = np.asarray([tracks[i].mean for i in track_indices])
+    covariances = np.asarray([tracks[i].covariance for i in track_indices])
+    gating_distance = tracks[track_indices[0]].kf.multi_gating_distance(
+        means, covariances, measurements, only_position)
+    cost_matrix[gating_distance > gating_threshold] = gated_cost
+    cost_matrix[:] = 0.995 * cost_matrix + (1 - 0.995) * gating_distance
     return cost_matrix
\ No newline at end of file
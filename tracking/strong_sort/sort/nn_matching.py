@@ -1,102 +1,17 @@
 # vim: expandtab:ts=4:sw=4
+import heapq
 import numpy as np
-import sys
-import torch
-sys.path.append('strong_sort/deep/reid')
-from tracking.torchreid.metrics.distance import compute_distance_matrix
-
-
-def _pdist(a, b):
-    """Compute pair-wise squared distance between points in `a` and `b`.
-    Parameters
-    ----------
-    a : array_like
-        An NxM matrix of N samples of dimensionality M.
-    b : array_like
-        An LxM matrix of L samples of dimensionality M.
-    Returns
-    -------
-    ndarray
-        Returns a matrix of size len(a), len(b) such that eleement (i, j)
-        contains the squared distance between `a[i]` and `b[j]`.
-    """
-    a, b = np.asarray(a), np.asarray(b)
-    if len(a) == 0 or len(b) == 0:
-        return np.zeros((len(a), len(b)))
-    a2, b2 = np.square(a).sum(axis=1), np.square(b).sum(axis=1)
-    r2 = -2. * np.dot(a, b.T) + a2[:, None] + b2[None, :]
-    r2 = np.clip(r2, 0., float(np.inf))
-    return r2
-
-
-def _cosine_distance(a, b, data_is_normalized=False):
-    """Compute pair-wise cosine distance between points in `a` and `b`.
-    Parameters
-    ----------
-    a : array_like
-        An NxM matrix of N samples of dimensionality M.
-    b : array_like
-        An LxM matrix of L samples of dimensionality M.
-    data_is_normalized : Optional[bool]
-        If True, assumes rows in a and b are unit length vectors.
-        Otherwise, a and b are explicitly normalized to lenght 1.
-    Returns
-    -------
-    ndarray
-        Returns a matrix of size len(a), len(b) such that eleement (i, j)
-        contains the squared distance between `a[i]` and `b[j]`.
-    """
-    if not data_is_normalized:
-        a = np.asarray(a) / np.linalg.norm(a, axis=1, keepdims=True)
-        b = np.asarray(b) / np.linalg.norm(b, axis=1, keepdims=True)
-    return 1. - np.dot(a, b.T)
-
-
-def _nn_euclidean_distance(x, y):
-    """ Helper function for nearest neighbor distance metric (Euclidean).
-    Parameters
-    ----------
-    x : ndarray
-        A matrix of N row-vectors (sample points).
-    y : ndarray
-        A matrix of M row-vectors (query points).
-    Returns
-    -------
-    ndarray
-        A vector of length M that contains for each entry in `y` the
-        smallest Euclidean distance to a sample in `x`.
-    """
-    x_ = torch.from_numpy(np.asarray(x) / np.linalg.norm(x, axis=1, keepdims=True))
-    y_ = torch.from_numpy(np.asarray(y) / np.linalg.norm(y, axis=1, keepdims=True))
-    distances = compute_distance_matrix(x_, y_, metric='euclidean')
-    return np.maximum(0.0, torch.min(distances, axis=0)[0].numpy())
-
-
-def _nn_cosine_distance(x, y):
-    """ Helper function for nearest neighbor distance metric (cosine).
-    Parameters
-    ----------
-    x : ndarray
-        A matrix of N row-vectors (sample points).
-    y : ndarray
-        A matrix of M row-vectors (query points).
-    Returns
-    -------
-    ndarray
-        A vector of length M that contains for each entry in `y` the
-        smallest cosine distance to a sample in `x`.
-    """
-    x_ = torch.from_numpy(np.asarray(x))
-    y_ = torch.from_numpy(np.asarray(y))
-    distances = compute_distance_matrix(x_, y_, metric='cosine')
-    distances = distances.cpu().detach().numpy()
-    return distances.min(axis=0)
 
 
 class NearestNeighborDistanceMetric(object):
     """
     A nearest neighbor distance metric that, for each target, returns
     the closest distance to any sample that has been observed so far.
+
+    Samples live in one preallocated gallery of shape (targets, budget, D),
+    normalized once when they are added and written round-robin per target,
+    so `distance` is a single matrix product followed by a min over each
+    target's samples.
     Parameters
     ----------
     metric : str
@@ -110,21 +25,28 @@ class NearestNeighborDistanceMetric(object):
     Attributes
     ----------
     samples : Dict[int -> List[ndarray]]
-        A dictionary that maps from target identities to the list of samples
-        that have been observed so far.
+        A dictionary that maps from target identities to the (normalized)
+        samples that are currently kept for them.
     """
 
-    def __init__(self, metric, matching_threshold, budget=None):
-        if metric == "euclidean":
-            self._metric = _nn_euclidean_distance
-        elif metric == "cosine":
-            self._metric = _nn_cosine_distance
-        else:
+    def __init__(self, metric, matching_threshold, budget=None, initial_targets=32):
+        if metric not in ("euclidean", "cosine"):
             raise ValueError(
                 "Invalid metric; must be either 'euclidean' or 'cosine'")
+        self.metric = metric
         self.matching_threshold = matching_threshold
         self.budget = budget
-        self.samples = {}
+
+        self._initial_targets = initial_targets
+        self._gallery = None  # (targets, budget, D) float32, allocated on the first sample
+        self._count = np.zeros(0, dtype=np.int64)  # samples kept per gallery row
+        self._head = np.zeros(0, dtype=np.int64)  # next ring position per gallery row
+        self._rows = {}  # target -> gallery row
+        self._free = []  # heap of unused gallery rows, lowest first keeps the used rows compact
+
+    @property
+    def samples(self):
+        return {target: list(self._gallery[row, :self._count[row]]) for target, row in self._rows.items()}
 
     def partial_fit(self, features, targets, active_targets):
         """Update the distance metric with new data.
@@ -137,11 +59,26 @@ class NearestNeighborDistanceMetric(object):
         active_targets : List[int]
             A list of targets that are currently present in the scene.
         """
+        features = _normalize(features)
+        if len(features) and self._gallery is None:
+            self._allocate(features.shape[1])
+
         for feature, target in zip(features, targets):
-            self.samples.setdefault(target, []).append(feature)
-            if self.budget is not None:
-                self.samples[target] = self.samples[target][-self.budget:]
-        self.samples = {k: self.samples[k] for k in active_targets}
+            row = self._row(int(target))
+            if self._head[row] == self._gallery.shape[1]:
+                if self.budget is not None:
+                    self._head[row] = 0
+                else:
+                    self._grow_samples()
+            self._gallery[row, self._head[row]] = feature
+            self._head[row] += 1
+            self._count[row] = max(self._count[row], self._head[row])
+
+        active = set(int(target) for target in active_targets)
+        for target in [target for target in self._rows if target not in active]:
+            row = self._rows.pop(target)
+            self._count[row] = self._head[row] = 0
+            heapq.heappush(self._free, row)
 
     def distance(self, features, targets):
         """Compute distance between features and targets.
@@ -158,7 +95,56 @@ class NearestNeighborDistanceMetric(object):
             element (i, j) contains the closest squared distance between
             `targets[i]` and `features[j]`.
         """
-        cost_matrix = np.zeros((len(targets), len(features)))
-        for i, target in enumerate(targets):
-            cost_matrix[i, :] = self._metric(self.samples[target], features)
-        return cost_matrix
\ No newline at end of file
+        if len(targets) == 0 or len(features) == 0:
+            return np.zeros((len(targets), len(features)))
+
+        rows = np.array([self._rows[int(target)] for target in targets])
+        used = rows.max() + 1
+        gallery = self._gallery[:used]
+        _, budget, dim = gallery.shape
+
+        # Similarity of every kept sample to every feature in one product, empty ring slots never win
+        similarity = (gallery.reshape(-1, dim) @ _normalize(features).T).reshape(used, budget, -1)
+        empty = np.arange(budget)[None, :] >= self._count[:used, None]
+        similarity[empty] = -np.inf
+        best = similarity.max(axis=1)[rows]
+
+        # On unit vectors: squared euclidean = 2 - 2 cos, cosine distance = 1 - cos
+        if self.metric == "euclidean":
+            return np.maximum(0.0, 2.0 - 2.0 * best).astype(np.float64)
+        return (1.0 - best).astype(np.float64)
+
+    def _allocate(self, dim):
+        budget = self.budget if self.budget is not None else 16
+        self._gallery = np.zeros((self._initial_targets, budget, dim), dtype=np.float32)
+        self._count = np.zeros(self._initial_targets, dtype=np.int64)
+        self._head = np.zeros(self._initial_targets, dtype=np.int64)
+        self._free = list(range(self._initial_targets))
+
+    def _row(self, target):
+        row = self._rows.get(target)
+        if row is None:
+            if not self._free:
+                self._grow_targets()
+            row = heapq.heappop(self._free)
+            self._rows[target] = row
+        return row
+
+    def _grow_targets(self):
+        capacity = len(self._gallery)
+        self._gallery = np.concatenate([self._gallery, np.zeros_like(self._gallery)])
+        self._count = np.concatenate([self._count, np.zeros(capacity, dtype=np.int64)])
+        self._head = np.concatenate([self._head, np.zeros(capacity, dtype=np.int64)])
+        for row in range(capacity, 2 * capacity):
+            heapq.heappush(self._free, row)
+
+    def _grow_samples(self):
+        # Unbounded budget: samples are never overwritten, so the ring only grows
+        self._gallery = np.concatenate([self._gallery, np.zeros_like(self._gallery)], axis=1)
+
+
+def _normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    if len(x) == 0:
+        return x.reshape(0, x.shape[-1] if x.ndim == 2 else 0)
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
@@ -1,7 +1,7 @@
 # vim: expandtab:ts=4:sw=4
 import cv2
 import numpy as np
-from tracking.strong_sort.sort.kalman_filter import KalmanFilter
+from tracking.strong_sort.sort.kalman_filter import KalmanFilter, StateArrays
 
 
 class TrackState:
@@ -43,13 +43,20 @@ class Track:
     feature : Optional[ndarray]
         Feature vector of the detection this track originates from. If not None,
         this feature is added to the `features` cache.
+    kf : Optional[kalman_filter.KalmanFilter]
+        The Kalman filter. A new one is created if None.
+    states : Optional[kalman_filter.StateArrays]
+        Shared state storage of the tracker, so all tracks can be filtered in
+        one vectorized call. The track keeps its own if None.
 
     Attributes
     ----------
     mean : ndarray
-        Mean vector of the initial state distribution.
+        Mean vector of the state distribution (a view of its `states` row).
     covariance : ndarray
-        Covariance matrix of the initial state distribution.
+        Covariance matrix of the state distribution (a view of its `states` row).
+    slot : int
+        Row of this track in `states.means` and `states.covariances`.
     track_id : int
         A unique track identifier.
     hits : int
@@ -63,16 +70,19 @@ class Track:
     features : List[ndarray]
         A cache of features. On each measurement update, the associated feature
         vector is added to this list.
+    frames_since_feature : int
+        Frames since the last measurement update that came with a feature.
 
     """
 
     def __init__(self, detection, track_id, class_id, conf, n_init, max_age, ema_alpha,
-                 feature=None):
+                 feature=None, kf=None, states=None):
         self.track_id = track_id
         self.class_id = int(class_id)
         self.hits = 1
         self.age = 1
         self.time_since_update = 0
+        self.frames_since_feature = 0
         self.ema_alpha = ema_alpha
 
         self.state = TrackState.Tentative
@@ -85,9 +95,33 @@ class Track:
         self._n_init = n_init
         self._max_age = max_age
 
-        self.kf = KalmanFilter()
+        self.kf = kf if kf is not None else KalmanFilter()
+        self.states = states if states is not None else StateArrays(capacity=1)
+        self.slot = self.states.allocate()
         self.mean, self.covariance = self.kf.initiate(detection)
 
+    @property
+    def mean(self):
+        return self.states.means[self.slot]
+
+    @mean.setter
+    def mean(self, value):
+        self.states.means[self.slot] = value
+
+    @property
+    def covariance(self):
+        return self.states.covariances[self.slot]
+
+    @covariance.setter
+    def covariance(self, value):
+        self.states.covariances[self.slot] = value
+
+    def release(self):
+        """Give the state row back to `states` once the track is deleted."""
+        if self.slot is not None:
+            self.states.release(self.slot)
+            self.slot = None
+
     def to_tlwh(self):
         """Get current position in bounding box format `(top left x, top left y,
         width, height)`.
@@ -245,6 +279,7 @@ class Track:
     def increment_age(self):
         self.age += 1
         self.time_since_update += 1
+        self.frames_since_feature += 1
 
     def predict(self, kf):
         """Propagate the state distribution to the current time step using a
@@ -257,8 +292,7 @@ class Track:
 
         """
         self.mean, self.covariance = self.kf.predict(self.mean, self.covariance)
-        self.age += 1
-        self.time_since_update += 1
+        self.increment_age()
 
     def update(self, detection, class_id, conf):
         """Perform Kalman filter measurement update step and update the feature
@@ -268,15 +302,29 @@ class Track:
         detection : Detection
             The associated detection.
         """
+        self.mean, self.covariance = self.kf.update(self.mean, self.covariance, detection.to_xyah(), detection.confidence)
+        self.mark_hit(detection, class_id, conf)
+
+    def mark_hit(self, detection, class_id, conf):
+        """Book-keeping of a measurement update whose Kalman filter step has
+        already been applied to `mean` and `covariance` (e.g. by the tracker's
+        batched update): feature cache, hits and state.
+        Parameters
+        ----------
+        detection : Detection
+            The associated detection.
+        """
         self.conf = conf
         self.class_id = int(class_id)
-        self.mean, self.covariance = self.kf.update(self.mean, self.covariance, detection.to_xyah(), detection.confidence)
 
-        feature = detection.feature / np.linalg.norm(detection.feature)
-        # print(feature)
-        smooth_feat = self.ema_alpha * self.features[-1] + (1 - self.ema_alpha) * feature
-        smooth_feat /= np.linalg.norm(smooth_feat)
-        self.features = [smooth_feat]
+        # Matched by motion only: the appearance is kept as it is
+        if detection.feature is not None:
+            feature = detection.feature / np.linalg.norm(detection.feature)
+            # print(feature)
+            smooth_feat = self.ema_alpha * self.features[-1] + (1 - self.ema_alpha) * feature
+            smooth_feat /= np.linalg.norm(smooth_feat)
+            self.features = [smooth_feat]
+            self.frames_since_feature = 0
 
         self.hits += 1
         self.time_since_update = 0
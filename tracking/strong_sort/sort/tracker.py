@@ -1,9 +1,9 @@
 # vim: expandtab:ts=4:sw=4
 from __future__ import absolute_import
 import numpy as np
+from . import association
 from . import kalman_filter
 from . import linear_assignment
-from . import iou_matching
 from .track import Track
 
 
@@ -30,6 +30,9 @@ class Tracker:
         Number of frames that a track remains in initialization phase.
     kf : kalman_filter.KalmanFilter
         A Kalman filter to filter target trajectories in image space.
+    states : kalman_filter.StateArrays
+        Kalman state of all tracks as (N, 8) means and (N, 8, 8) covariances,
+        predicted, updated and gated in one vectorized call per frame.
     tracks : List[Track]
         The list of active tracks at the current time step.
     """
@@ -45,60 +48,153 @@ class Tracker:
         self.mc_lambda = mc_lambda
 
         self.kf = kalman_filter.KalmanFilter()
+        self.states = kalman_filter.StateArrays()
         self.tracks = []
         self._next_id = 1
+        # Ids of tracks removed by the last `update` or `increment_ages`, for callers that keep per-track state
+        self.deleted_track_ids = []
 
     def predict(self):
         """Propagate track state distributions one time step forward.
 
         This function should be called once every time step, before `update`.
         """
+        if not self.tracks:
+            return
+        slots = [track.slot for track in self.tracks]
+        self.states.means[slots], self.states.covariances[slots] = self.kf.multi_predict(
+            self.states.means[slots], self.states.covariances[slots])
         for track in self.tracks:
-            track.predict(self.kf)
+            track.increment_age()
 
     def increment_ages(self):
         for track in self.tracks:
             track.increment_age()
             track.mark_missed()
+        self._remove_deleted()
 
-    def camera_update(self, previous_img, current_img):
-        for track in self.tracks:
-            track.camera_update(previous_img, current_img)
+    def _remove_deleted(self):
+        """Drop deleted tracks, remembering their ids in `deleted_track_ids`"""
+        self.deleted_track_ids = []
+        for t in self.tracks:
+            if t.is_deleted():
+                self.deleted_track_ids.append(t.track_id)
+                t.release()
+        self.tracks = [t for t in self.tracks if not t.is_deleted()]
+
+    def resume_ids(self, last_track_id):
+        """Continue track numbering after `last_track_id` (e.g. the highest id already persisted)"""
+        self._next_id = max(self._next_id, int(last_track_id) + 1)
+
+    def camera_update(self, warp_matrix):
+        """Move all track states by the global camera motion of this frame.
+
+        Parameters
+        ----------
+        warp_matrix : ndarray
+            2x3 affine warp from the previous to the current frame, e.g. from
+            `cmc.CameraMotionCompensation.apply`. Like `Track.camera_update`,
+            the box corners are warped and the box is rebuilt from them.
+        """
+        if not self.tracks:
+            return
+        slots = [track.slot for track in self.tracks]
+        xyah = self.states.means[slots, :4]
+        half = np.c_[xyah[:, 2] * xyah[:, 3], xyah[:, 3]] / 2
+        warp_matrix = np.asarray(warp_matrix, dtype=np.float64)
+        top_left = (xyah[:, :2] - half) @ warp_matrix[:, :2].T + warp_matrix[:, 2]
+        bottom_right = (xyah[:, :2] + half) @ warp_matrix[:, :2].T + warp_matrix[:, 2]
+        wh = bottom_right - top_left
+        self.states.means[slots, :4] = np.c_[top_left + wh / 2, wh[:, 0] / wh[:, 1], wh[:, 1]]
+
+    def motion_matches(self, detections_tlwh, min_iou=0.5, margin=0.3, refresh_interval=10):
+        """Match detections to tracks by IoU and Kalman gate alone, where that
+        is unambiguous, so their appearance features need not be computed.
+
+        Only confirmed tracks seen in the previous frame whose features are
+        younger than `refresh_interval` frames qualify; long-lost tracks,
+        crowded or crossing boxes (see `association.unambiguous_matches`) and
+        stale features are left to the appearance-based matching. Call after
+        `predict`.
 
-    def update(self, detections, classes, confidences):
+        Parameters
+        ----------
+        detections_tlwh : ndarray
+            Mx4 detection boxes `(top left x, top left y, width, height)`.
+
+        Returns
+        -------
+        List[(int, int)]
+            Matched track and detection indices, to pass on to `update`.
+        """
+        detections_tlwh = np.asarray(detections_tlwh, dtype=np.float64).reshape(-1, 4)
+        if not self.tracks or len(detections_tlwh) == 0:
+            return []
+
+        slots = [track.slot for track in self.tracks]
+        means, covariances = self.states.means[slots], self.states.covariances[slots]
+        iou = association.iou_matrix(association.tlwh_from_states(means), detections_tlwh)
+        candidates = np.array([
+            t.is_confirmed() and t.time_since_update == 1 and t.frames_since_feature < refresh_interval
+            for t in self.tracks
+        ])
+        pairs = association.unambiguous_matches(iou, candidates, min_iou, margin)
+        if not pairs:
+            return []
+
+        rows, cols = np.array(pairs).T
+        measurements = detections_tlwh[cols].copy()
+        measurements[:, :2] += measurements[:, 2:] / 2
+        measurements[:, 2] /= measurements[:, 3]
+        gating_distance = self.kf.multi_gating_distance(means[rows], covariances[rows], measurements)
+        inside = gating_distance[np.arange(len(rows)), np.arange(len(rows))] <= kalman_filter.chi2inv95[4]
+        return [pair for pair, ok in zip(pairs, inside) if ok]
+
+    def update(self, detections, classes, confidences, motion_matches=()):
         """Perform measurement update and track management.
 
         Parameters
         ----------
         detections : List[deep_sort.detection.Detection]
             A list of detections at the current time step.
+        motion_matches : List[(int, int)]
+            Track and detection indices already matched by `motion_matches`.
+            These detections may come without a feature.
 
         """
         # Run matching cascade.
         matches, unmatched_tracks, unmatched_detections = \
-            self._match(detections)
+            self._match(detections, motion_matches)
+        # Tracks matched without a new feature don't add a sample to the gallery
+        motion_only = {self.tracks[track_idx].track_id for track_idx, _ in motion_matches}
 
-        # Update track set.
+        # Update track set, with one Kalman filter step for all matched tracks.
+        if matches:
+            slots = [self.tracks[track_idx].slot for track_idx, _ in matches]
+            measurements = np.asarray([detections[detection_idx].to_xyah() for _, detection_idx in matches])
+            detection_confidences = np.asarray([detections[detection_idx].confidence for _, detection_idx in matches])
+            self.states.means[slots], self.states.covariances[slots] = self.kf.multi_update(
+                self.states.means[slots], self.states.covariances[slots], measurements, detection_confidences)
         for track_idx, detection_idx in matches:
-            self.tracks[track_idx].update(
+            self.tracks[track_idx].mark_hit(
                 detections[detection_idx], classes[detection_idx], confidences[detection_idx])
         for track_idx in unmatched_tracks:
             self.tracks[track_idx].mark_missed()
         for detection_idx in unmatched_detections:
             self._initiate_track(detections[detection_idx], classes[detection_idx].item(), confidences[detection_idx].item())
-        self.tracks = [t for t in self.tracks if not t.is_deleted()]
+        self._remove_deleted()
 
         # Update distance metric.
         active_targets = [t.track_id for t in self.tracks if t.is_confirmed()]
         features, targets = [], []
         for track in self.tracks:
-            if not track.is_confirmed():
+            if not track.is_confirmed() or track.track_id in motion_only:
                 continue
             features += track.features
             targets += [track.track_id for _ in track.features]
         self.metric.partial_fit(np.asarray(features), np.asarray(targets), active_targets)
 
-    def _full_cost_metric(self, tracks, dets, track_indices, detection_indices):
+    def _full_cost_metric(self, costs, track_indices, detection_indices):
         """
         This implements the full lambda-based cost-metric. However, in doing so, it disregards
         the possibility to gate the position only which is provided by
@@ -110,21 +206,12 @@ class Tracker:
         Note also that the authors work with the squared distance. I also sqrt this, so that it
         is more intuitive in terms of values.
         """
+        index = np.ix_(np.asarray(track_indices, dtype=np.int64), np.asarray(detection_indices, dtype=np.int64))
         # Compute First the Position-based Cost Matrix
-        pos_cost = np.empty([len(track_indices), len(detection_indices)])
-        msrs = np.asarray([dets[i].to_xyah() for i in detection_indices])
-        for row, track_idx in enumerate(track_indices):
-            pos_cost[row, :] = np.sqrt(
-                self.kf.gating_distance(
-                    tracks[track_idx].mean, tracks[track_idx].covariance, msrs, False
-                )
-            ) / self.GATING_THRESHOLD
+        pos_cost = np.sqrt(costs.gating_distance[index]) / self.GATING_THRESHOLD
         pos_gate = pos_cost > 1.0
         # Now Compute the Appearance-based Cost Matrix
-        app_cost = self.metric.distance(
-            np.array([dets[i].feature for i in detection_indices]),
-            np.array([tracks[i].track_id for i in track_indices]),
-        )
+        app_cost = costs.appearance[index]
         app_gate = app_cost > self.metric.matching_threshold
         # Now combine and threshold
         cost_matrix = self._lambda * pos_cost + (1 - self._lambda) * app_cost
@@ -132,27 +219,26 @@ class Tracker:
         # Return Matrix
         return cost_matrix
 
-    def _match(self, detections):
-
-        def gated_metric(tracks, dets, track_indices, detection_indices):
-            features = np.array([dets[i].feature for i in detection_indices])
-            targets = np.array([tracks[i].track_id for i in track_indices])
-            cost_matrix = self.metric.distance(features, targets)
-            cost_matrix = linear_assignment.gate_cost_matrix(cost_matrix, tracks, dets, track_indices, detection_indices)
-
-            return cost_matrix
+    def _match(self, detections, motion_matches=()):
+        matched_tracks = set(track_idx for track_idx, _ in motion_matches)
+        matched_detections = set(detection_idx for _, detection_idx in motion_matches)
+        detection_indices = [i for i in range(len(detections)) if i not in matched_detections]
 
         # Split track set into confirmed and unconfirmed tracks.
         confirmed_tracks = [
-            i for i, t in enumerate(self.tracks) if t.is_confirmed()]
+            i for i, t in enumerate(self.tracks) if t.is_confirmed() and i not in matched_tracks]
         unconfirmed_tracks = [
-            i for i, t in enumerate(self.tracks) if not t.is_confirmed()]
+            i for i, t in enumerate(self.tracks) if not t.is_confirmed() and i not in matched_tracks]
+
+        # IoU, gating and appearance costs of all tracks x detections at once;
+        # the matching stages below only slice them.
+        costs = association.AssociationCosts(self.kf, self.metric, self.tracks, detections, confirmed_tracks)
 
         # Associate confirmed tracks using appearance features.
         matches_a, unmatched_tracks_a, unmatched_detections = \
             linear_assignment.matching_cascade(
-                gated_metric, self.metric.matching_threshold, self.max_age,
-                self.tracks, detections, confirmed_tracks)
+                costs.gated_appearance_cost, self.metric.matching_threshold, self.max_age,
+                self.tracks, detections, confirmed_tracks, detection_indices)
 
         # Associate remaining tracks together with unconfirmed tracks using IOU.
         iou_track_candidates = unconfirmed_tracks + [
@@ -163,15 +249,15 @@ class Tracker:
             self.tracks[k].time_since_update != 1]
         matches_b, unmatched_tracks_b, unmatched_detections = \
             linear_assignment.min_cost_matching(
-                iou_matching.iou_cost, self.max_iou_distance, self.tracks,
+                costs.iou_cost, self.max_iou_distance, self.tracks,
                 detections, iou_track_candidates, unmatched_detections)
 
-        matches = matches_a + matches_b
+        matches = list(motion_matches) + matches_a + matches_b
         unmatched_tracks = list(set(unmatched_tracks_a + unmatched_tracks_b))
         return matches, unmatched_tracks, unmatched_detections
 
     def _initiate_track(self, detection, class_id, conf):
         self.tracks.append(Track(
             detection.to_xyah(), self._next_id, class_id, conf, self.n_init, self.max_age, self.ema_alpha,
-            detection.feature))
+            detection.feature, kf=self.kf, states=self.states))
         self._next_id += 1
@@ -9,8 +9,10 @@ import torchvision.transforms as transforms
 from .sort.nn_matching import NearestNeighborDistanceMetric
 from .sort.detection import Detection
 from .sort.tracker import Tracker
+from .sort.cmc import CameraMotionCompensation
 from .deep.reid_model_factory import show_downloadeable_models, get_model_url, get_model_name
 
+from tracking.base_tracker import BaseTracker
 from tracking.torchreid.utils import FeatureExtractor
 from tracking.torchreid.utils.tools import download_url
 from .reid_multibackend import ReIDDetectMultiBackend
@@ -18,7 +20,7 @@ from .reid_multibackend import ReIDDetectMultiBackend
 __all__ = ['StrongSORT']
 
 
-class StrongSORT(object):
+class StrongSORT(BaseTracker):
     def __init__(self, 
                  model_weights,
                  device,
@@ -28,34 +30,66 @@ class StrongSORT(object):
                  max_age=70, n_init=3,
                  nn_budget=100,
                  mc_lambda=0.995,
-                 ema_alpha=0.95
+                 ema_alpha=0.95,
+                 reid_batch_size=32,
+                 cmc_method=None,
+                 cmc_scale=0.25,
+                 adaptive_reid=False,
+                 reid_refresh_interval=10,
+                 reid_min_iou=0.5,
+                 reid_margin=0.3
                 ):
         
-        self.model = ReIDDetectMultiBackend(weights=model_weights, device=device, fp16=fp16)
+        self.model = ReIDDetectMultiBackend(weights=model_weights, device=device, fp16=fp16,
+                                            max_batch_size=reid_batch_size)
         
         self.max_dist = max_dist
         metric = NearestNeighborDistanceMetric(
             "euclidean", self.max_dist, nn_budget)
         self.tracker = Tracker(
             metric, max_iou_distance=max_iou_distance, max_age=max_age, n_init=n_init)
+        # Global camera motion, estimated once per frame ('ecc' or 'sparse_flow'; None = static camera)
+        self.cmc = CameraMotionCompensation(cmc_method, scale=cmc_scale) if cmc_method else None
+
+        # Adaptive ReID: detections that motion matches unambiguously skip the ReID network,
+        # features of such tracks are still refreshed every reid_refresh_interval frames
+        self.adaptive_reid = adaptive_reid
+        self.reid_refresh_interval = reid_refresh_interval
+        self.reid_min_iou = reid_min_iou
+        self.reid_margin = reid_margin
+        self.reid_crops = 0
+        self.reid_skipped = 0
 
     def update(self, bbox_xywh, confidences, classes, ori_img):
         self.height, self.width = ori_img.shape[:2]
-        # generate detections 
-        # print(bbox_xywh) 
-        features = self._get_features(bbox_xywh, ori_img)
-        # print(features[0].shape, len(features))
         bbox_tlwh = self._xywh_to_tlwh(bbox_xywh)
-        # print(bbox_tlwh)
+
+        # predict first, so motion can decide which detections need appearance features
+        if self.cmc is not None:
+            self.tracker.camera_update(self.cmc.apply(ori_img))
+        self.tracker.predict()
+
+        motion_matches = []
+        if self.adaptive_reid:
+            motion_matches = self.tracker.motion_matches(
+                bbox_tlwh.cpu().numpy() if isinstance(bbox_tlwh, torch.Tensor) else bbox_tlwh,
+                min_iou=self.reid_min_iou, margin=self.reid_margin, refresh_interval=self.reid_refresh_interval)
+
+        # generate detections, running ReID only on the crops motion could not match
+        skipped = set(detection_idx for _, detection_idx in motion_matches)
+        reid_indices = [i for i in range(len(confidences)) if i not in skipped]
+        features = [None] * len(confidences)
+        if reid_indices:
+            boxes = bbox_xywh[reid_indices] if skipped else bbox_xywh
+            for i, feature in zip(reid_indices, self._get_features(boxes, ori_img)):
+                features[i] = feature
+        self.reid_crops += len(confidences)
+        self.reid_skipped += len(skipped)
+
         detections = [Detection(bbox_tlwh[i], conf, features[i]) for i, conf in enumerate(confidences)]
-        # print(detections)
-        # run on non-maximum supression
-        boxes = np.array([d.tlwh for d in detections])
-        scores = np.array([d.confidence for d in detections])
 
         # update tracker
-        self.tracker.predict()
-        self.tracker.update(detections, classes, confidences)
+        self.tracker.update(detections, classes, confidences, motion_matches)
 
         # output bbox identities
         outputs = []
@@ -115,6 +149,21 @@ class StrongSORT(object):
     def increment_ages(self):
         self.tracker.increment_ages()
 
+    def reid_stats(self):
+        """Detections seen, detections that skipped ReID and their fraction since start"""
+        return {
+            'crops': self.reid_crops,
+            'skipped': self.reid_skipped,
+            'skip_ratio': self.reid_skipped / self.reid_crops if self.reid_crops else 0.0
+        }
+
+    @property
+    def deleted_track_ids(self):
+        return self.tracker.deleted_track_ids
+
+    def resume_ids(self, last_track_id):
+        self.tracker.resume_ids(last_track_id)
+
     def _xyxy_to_tlwh(self, bbox_xyxy):
         x1, y1, x2, y2 = bbox_xyxy
 
@@ -127,15 +176,15 @@ class StrongSORT(object):
     def _get_features(self, bbox_xywh, ori_img):
         im_crops = []
         for box in bbox_xywh:
-            x1, y1, w, h = box
-            x1, y1, x2, y2 = map(int, [x1, y1, x1 + w, y1 + h])
-            # print(x1, y1, x2, y2, ori_img.shape)
-            im = ori_img[y1:y2, x1:x2]
-            # print(im.shape)
+            # Boxes are center x, y, w, h; clamp them to the frame and keep at least one pixel
+            x1, y1, x2, y2 = self._xywh_to_xyxy(box)
+            x1, y1 = min(x1, self.width - 1), min(y1, self.height - 1)
+            im = ori_img[y1:max(y2, y1 + 1), x1:max(x2, x1 + 1)]
             im_crops.append(im)
         # print(im_crops)
         if im_crops:
-            features = self.model(im_crops)
+            # One device-to-host copy for the whole batch instead of one per detection
+            features = self.model(im_crops).cpu()
         else:
             features = np.array([])
         # print(len(features)) 
@@ -0,0 +1,47 @@
+from typing import Optional
+
+from tracking.base_tracker import BaseTracker
+
+
+STRONG_SORT = 'strong_sort'
+BYTETRACK = 'bytetrack'
+TRACKER_TYPES = (STRONG_SORT, BYTETRACK)
+
+# Settings every deployment used for StrongSORT with OSNet ReID
+STRONG_SORT_DEFAULTS = dict(
+    model_weights='tracking/weights/osnet_ain_x1_0_msmt17.pt',
+    fp16=False,
+    max_dist=0.2,
+    max_iou_distance=0.7,
+    max_age=70,
+    n_init=3,
+    nn_budget=100,
+    mc_lambda=0.9,
+    ema_alpha=0.9
+)
+
+
+def create_tracker(tracker_type: str = STRONG_SORT, device: Optional[str] = None, **kwargs) -> BaseTracker:
+    """
+    Build the tracker selected for a deployment.
+
+    Args:
+      tracker_type: 'strong_sort' (motion + OSNet ReID) or 'bytetrack' (motion only, NumPy/SciPy, no ReID network)
+      device: torch device of the ReID model (CUDA if available when None), ignored by ByteTrack
+      kwargs: overrides of the tracker's constructor arguments
+
+    Returns:
+      Tracker implementing BaseTracker
+    """
+    # Imported on demand, so a ByteTrack deployment never loads torch and the ReID stack
+    if tracker_type == STRONG_SORT:
+        import torch
+        from tracking.strong_sort import StrongSORT
+
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        return StrongSORT(device=device, **{**STRONG_SORT_DEFAULTS, **kwargs})
+    if tracker_type == BYTETRACK:
+        from tracking.bytetrack.byte_tracker import ByteTrack
+        return ByteTrack(**kwargs)
+    raise ValueError(f"Unknown tracker type: {tracker_type}, expected one of {TRACKER_TYPES}")
@@ -2,31 +2,20 @@ import cv2
 import numpy as np
 from rfdetr import RFDETRBase
 import supervision as sv
-from tracking.strong_sort.strong_sort import StrongSORT
+from tracking.tracker_factory import create_tracker, STRONG_SORT
 from ultralytics import RTDETR
 from logging import warning as log_warning
 
 
 class ObjectTracking:
-    def __init__(self, draw=False, device='cuda:0', detection_model_type='rtdetr'):
+    def __init__(self, draw=False, device='cuda:0', detection_model_type='rtdetr', tracker_type=STRONG_SORT):
         self.draw = draw
         self.device = device
         self.bbox_annotator = sv.BoxAnnotator()
         self.label_annotator = sv.LabelAnnotator()
 
         self.model = RFDETRBase() if detection_model_type == 'rfdetr' else RTDETR('rtdetr-x.pt')
-        self.tracker = StrongSORT(
-            model_weights='tracking/weights/osnet_ain_x1_0_msmt17.pt',
-            device=device,
-            fp16=False,
-            max_dist=0.2,
-            max_iou_distance=0.7,
-            max_age=70,
-            n_init=3,
-            nn_budget=100,
-            mc_lambda=0.9,
-            ema_alpha=0.9
-        )
+        self.tracker = create_tracker(tracker_type, device=device)
 
     def _xyxy_to_xywh(self, xyxy):
         x1, y1, x2, y2 = xyxy